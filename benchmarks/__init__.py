@@ -0,0 +1,10 @@
+from car_framework.app import BaseApp
+from car_framework.context import Context
+
+
+# Context with the default options of a connector, argv: further connector options
+def create_context(*argv):
+    parser = BaseApp('Benchmark').parser
+    args = parser.parse_args(['-car-service-url-for-token', 'http://127.0.0.1:1/api/car/v2', '-car-service-token', 'token',
+                              '-source', 'benchmark', '-name', 'benchmark'] + list(argv))
+    return Context(args)
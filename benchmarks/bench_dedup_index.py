@@ -0,0 +1,61 @@
+"""
+Compares the -dedup-index types: time per key added and memory kept for the keys, with a share of
+duplicate keys as sent by connectors which read related objects more than once. Memory is the Python
+heap measured with tracemalloc; for "sqlite" it does not include the SQLite page cache (at most 8 MB)
+and the size of the index file is shown instead.
+
+    python -m benchmarks.bench_dedup_index -keys 1000000 -duplicates 0.2 -cache-size 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from car_framework.context import context
+from car_framework.data_handler import KEY_INDEX_TYPES
+from benchmarks import create_context
+
+
+def synthetic_keys(count, duplicates):
+    rnd = random.Random(1)
+    for i in range(count):
+        # duplicates are mostly recent keys, e.g. the same host reported by consecutive pages
+        if i and rnd.random() < duplicates:
+            i = max(0, i - int(rnd.expovariate(1 / 1000)))
+        yield 'asset-%d/10.%d.%d.%d' % (i, i >> 16 & 255, i >> 8 & 255, i & 255)
+
+
+def run(name, count, duplicates):
+    tracemalloc.start()
+    index = KEY_INDEX_TYPES[name]()
+    start = time.perf_counter()
+    added = sum(1 for key in synthetic_keys(count, duplicates) if index.add(key))
+    elapsed = time.perf_counter() - start
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    file_size = os.path.getsize(index.file_path) if hasattr(index, 'file_path') else 0
+    print('%-12s %9d keys %8.2f us/key %8.1f MB heap %8.1f MB file' % (name, added, elapsed / count * 1000000,
+        used / 1024 / 1024, file_size / 1024 / 1024))
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dedup index benchmark')
+    parser.add_argument('-keys', dest='keys', type=int, default=1000000, help='Number of keys added, default 1000000')
+    parser.add_argument('-duplicates', dest='duplicates', type=float, default=0.2, help='Share of duplicate keys, default 0.2')
+    parser.add_argument('-cache-size', dest='cache_size', type=int, default=100000, help='-dedup-index-cache-size, default 100000')
+    args = parser.parse_args()
+
+    create_context()
+    export_data_dir = tempfile.TemporaryDirectory()
+    context().args.export_data_dir = export_data_dir.name
+    context().args.dedup_index_cache_size = args.cache_size
+    for name in KEY_INDEX_TYPES:
+        run(name, args.keys, args.duplicates)
+    export_data_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
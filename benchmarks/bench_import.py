@@ -0,0 +1,61 @@
+"""
+End-to-end import throughput benchmark: runs a full and then an incremental import of the
+synthetic connector against the local mock CAR server. Arguments after "--" are passed to
+the connector, e.g.
+
+    python -m benchmarks.bench_import -size 100000 -- -upload-workers 8 -mutation-format variables
+"""
+import argparse
+import logging
+import resource
+import sys
+import tempfile
+import time
+
+from car_framework.context import context
+from tests.mock_car_server import MockCarServer
+from tests.synthetic_connector import create_app
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, server, rows, run):
+    requests, bytes_received = server.request_count, server.bytes_received
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print('%-12s %8d rows %8.2fs %10.0f rows/s %7d requests %9.1f MB sent  peak RSS %7.1f MB' % (name, rows, elapsed, rows / elapsed,
+        server.request_count - requests, (server.bytes_received - bytes_received) / 1024 / 1024, peak_rss_mb()))
+
+
+def main():
+    argv = sys.argv[1:]
+    connector_args = []
+    if '--' in argv:
+        connector_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(description='End-to-end import benchmark against the mock CAR server')
+    parser.add_argument('-size', dest='size', type=int, default=10000, help='Number of synthetic assets, default 10000')
+    parser.add_argument('-updated', dest='updated', type=int, default=None, help='Assets updated by the incremental import, default 10%% of size')
+    parser.add_argument('-deleted', dest='deleted', type=int, default=None, help='Assets deleted by the incremental import, default 1%% of size')
+    parser.add_argument('-latency', dest='latency', type=float, default=0, help='Simulated latency of every CAR request in seconds, default 0')
+    parser.add_argument('-async-job-latency', dest='async_job_latency', type=float, default=0, help='Simulated duration of CAR async jobs in seconds, default 0')
+    args = parser.parse_args(argv)
+    updated = args.size // 10 if args.updated is None else args.updated
+    deleted = args.size // 100 if args.deleted is None else args.deleted
+
+    with MockCarServer(args.latency, args.async_job_latency) as server, tempfile.TemporaryDirectory() as export_data_dir:
+        create_app(server.url, args.size, updated, deleted, ['-export-data-dir', export_data_dir] + connector_args)
+        logging.getLogger().setLevel(logging.WARNING)
+        print('connector arguments: %s' % ' '.join(connector_args))
+        # a full import creates 2 vertices and 1 edge per asset, an incremental one 1 vertex and 1 edge per updated asset
+        measure('full', server, args.size * 3, context().full_importer.run)
+        measure('incremental', server, updated * 2 + deleted, context().inc_importer.run)
+
+
+if __name__ == '__main__':
+    main()
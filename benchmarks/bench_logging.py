@@ -0,0 +1,97 @@
+"""
+Per-request logging overhead of Communicator: the eager debug message formatting and per record
+context lookups of the previous logging code vs. lazy log bodies with cached log fields, written
+synchronously or by the -log-queue background thread. Log output goes to os.devnull, DEBUG is off
+as in production unless -debug is given.
+
+    python -m benchmarks.bench_logging -requests 20000 -body-kb 50
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import time
+from datetime import datetime
+from logging.handlers import QueueListener
+
+from car_framework.communicator import BaseCommunicator
+from car_framework.context import context, ContextQueueHandler, CustomJsonFormatter
+from car_framework.util import get_json
+from benchmarks import create_context
+
+FORMAT = '%(ibm_datetime)s %(level)s %(label)s %(message)s'
+
+
+class PreviousJsonFormatter(CustomJsonFormatter):
+    # record fields as computed before the log fields were cached
+    def add_fields(self, log_record, record, message_dict):
+        log_record['ibm_datetime'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        if context().args.connector_name: log_record['connector'] = context().args.connector_name
+        if context().args.source: log_record['source'] = context().args.source
+        if context().args.version: log_record['version'] = context().args.version
+        super().add_fields(log_record, record, message_dict)
+
+
+class Response(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def previous_log_response(req, url, resp, params, data):
+    context().logger.debug('%s %s, status code: %d, response data: %s' % (req, url, resp.status_code, get_json(resp)))
+    if resp.status_code != 200:
+        context().logger.warning('%s %s, status code: %d, response data: %s, request params: %s, request data: %s' % (req,
+            url, resp.status_code, get_json(resp), params, data))
+
+
+def run(name, handler, log_response, responses, data, debug, listener=None):
+    logger = logging.getLogger()
+    saved = logger.handlers[:]
+    logger.handlers = [handler]
+    logger.setLevel(debug and logging.DEBUG or logging.INFO)
+    if listener: listener.start()
+    start = time.perf_counter()
+    for resp in responses:
+        log_response('POST', 'https://car.example.com/api/car/v2/query', resp, None, data)
+        logger.info('Request sent')
+    elapsed = time.perf_counter() - start
+    if listener: listener.stop()
+    logger.handlers = saved
+    print('%-26s %8.2f us/request (logging thread)' % (name, elapsed / len(responses) * 1000000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CAR request logging overhead benchmark')
+    parser.add_argument('-requests', dest='requests', type=int, default=20000, help='Number of requests logged, default 20000')
+    parser.add_argument('-body-kb', dest='body_kb', type=int, default=50, help='Size of the request and response bodies in KB, default 50')
+    parser.add_argument('-error-rate', dest='error_rate', type=float, default=0.01, help='Share of non 200 responses, default 0.01')
+    parser.add_argument('-debug', dest='debug', action='store_true', help='Enable DEBUG level')
+    args = parser.parse_args()
+
+    create_context()
+    devnull = open(os.devnull, 'w')
+    body = json.dumps({'data': {'rows': ['x' * 100] * (args.body_kb * 10)}})
+    errors = int(1 / args.error_rate) if args.error_rate else 0
+    responses = [Response(500 if errors and i % errors == 0 else 200, body) for i in range(args.requests)]
+    communicator = BaseCommunicator.__new__(BaseCommunicator)
+
+    def stream_handler(formatter):
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(formatter)
+        return handler
+
+    print('%d requests, %d KB bodies, DEBUG %s' % (args.requests, args.body_kb, 'on' if args.debug else 'off'))
+    run('previous', stream_handler(PreviousJsonFormatter(FORMAT)), previous_log_response, responses, body, args.debug)
+    run('lazy bodies', stream_handler(CustomJsonFormatter(FORMAT)), communicator.log_response, responses, body, args.debug)
+    handler = ContextQueueHandler(queue.SimpleQueue())
+    listener = QueueListener(handler.queue, stream_handler(CustomJsonFormatter(FORMAT)))
+    run('lazy bodies, -log-queue', handler, communicator.log_response, responses, body, args.debug, listener)
+
+
+if __name__ == '__main__':
+    main()
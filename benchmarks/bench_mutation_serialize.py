@@ -0,0 +1,37 @@
+"""
+Compares insert mutation request body serialization: objects inlined into the query text
+vs. objects sent as one $objects GraphQL variable. Timings include json.dumps of the
+request body, as done by CarService before posting it.
+
+    python -m benchmarks.bench_mutation_serialize -rows 2000 -repeat 50
+"""
+import argparse
+import json
+import time
+
+from car_framework.data_handler import json_default, Mutation
+from benchmarks.bench_spill_format import synthetic_vertices
+
+
+def run(name, page, repeat, use_variables):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = json.dumps(Mutation('asset', page).serialize(use_variables), default=json_default)
+    elapsed = (time.perf_counter() - start) / repeat
+    print('%-10s %8.2f ms/page  %8.1f KB/page' % (name, elapsed * 1000, len(body) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Insert mutation serialization benchmark')
+    parser.add_argument('-rows', dest='rows', type=int, default=2000, help='Rows per page, default 2000')
+    parser.add_argument('-repeat', dest='repeat', type=int, default=50, help='Number of pages serialized, default 50')
+    args = parser.parse_args()
+
+    page = list(synthetic_vertices(args.rows))
+    print('%d rows per page' % args.rows)
+    run('inline', page, args.repeat, False)
+    run('variables', page, args.repeat, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares export_data spill file formats: writes synthetic vertices in pages the way
+BaseDataHandler does and reads them back.
+
+    python -m benchmarks.bench_spill_format -n 1000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from car_framework.data_handler import JsonField, Mutation, SPILL_FORMATS
+
+
+def synthetic_vertices(count):
+    for i in range(count):
+        yield {
+            'external_id': 'asset-%d' % i,
+            'name': 'host-%d.example.com' % i,
+            'description': 'Synthetic asset number %d' % i,
+            'asset_type': 'server',
+            'risk': i % 10,
+            'properties': JsonField({'os': 'linux', 'index': i}),
+        }
+
+
+def pages(count, page_size):
+    page = []
+    for vertex in synthetic_vertices(count):
+        page.append(vertex)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page: yield page
+
+
+def run(name, count, page_size, dir_path):
+    spill_format = SPILL_FORMATS[name]
+    files = []
+    start = time.perf_counter()
+    for i, page in enumerate(pages(count, page_size)):
+        file_path = os.path.join(dir_path, '%06d%s' % (i, spill_format.extension))
+        spill_format.write(Mutation('asset', page), file_path)
+        files.append(file_path)
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = 0
+    for file_path in files:
+        rows += len(Mutation.load(file_path).data)
+    read_time = time.perf_counter() - start
+    assert rows == count
+
+    size = sum(os.path.getsize(f) for f in files)
+    print('%-12s write %7.2fs  read %7.2fs  size %8.1f MB' % (name, write_time, read_time, size / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export_data spill file format benchmark')
+    parser.add_argument('-n', dest='count', type=int, default=1000000, help='Number of vertices, default 1000000')
+    parser.add_argument('-page-size', dest='page_size', type=int, default=2000, help='Rows per spill file, default 2000')
+    parser.add_argument('-formats', dest='formats', default=','.join(SPILL_FORMATS.keys()), help='Comma separated formats to compare')
+    args = parser.parse_args()
+
+    print('%d vertices, page size %d' % (args.count, args.page_size))
+    for name in args.formats.split(','):
+        dir_path = tempfile.mkdtemp(prefix='car_spill_bench_')
+        try:
+            run(name, args.count, args.page_size, dir_path)
+        finally:
+            shutil.rmtree(dir_path)
+
+
+if __name__ == '__main__':
+    main()
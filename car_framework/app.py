@@ -1,11 +1,20 @@
-import argparse, traceback, sys, os
+import argparse, json, re, signal, threading, traceback, sys, os, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-from car_framework.context import Context, context
+from car_framework.car_service import max_wait_time
+from car_framework.context import Context, context, set_thread_context
+from car_framework.schedule import CronSchedule, IntervalSchedule, seconds_until
 from car_framework.util import ErrorCode, IncrementalImportNotPossible, RecoverableFailure, UnrecoverableFailure, DatasourceFailure
 
 
 class BaseApp(object):
     def __init__(self, description):
+        self.extension_ready = False
+        self.extension_lock = threading.Lock()
+        # per source contexts with -sources-file
+        self.source_contexts = None
+        self.stop_event = threading.Event()
         self.parser = argparse.ArgumentParser(description=description)
         self.parser.add_argument('-car-service-url', dest='car_service_apikey_url', default=os.getenv('CAR_SERVICE_URL',None), type=str, required=False, help='URL of the CAR ingestion service if API key is used for authorization')
         self.parser.add_argument('-car-service-key', dest='api_key', default=os.getenv('CAR_SERVICE_KEY',None), type=str, required=False, help='API key for CAR ingestion service')
@@ -20,10 +29,52 @@ class BaseApp(object):
         self.parser.add_argument('-version', dest='version', default=os.getenv('CONNECTOR_VERSION', None), type=str, required=False, help='Connector version number')
 
         self.parser.add_argument('-d', dest='debug', action='store_true', default=os.getenv('DEBUG', False), help='Enables DEBUG level logging')
+        self.parser.add_argument('-log-queue', dest='log_queue', action='store_true', default=os.getenv('LOG_QUEUE', False), help='Log records are written by a background thread, logging does not block on the output stream, default false')
+        self.parser.add_argument('-log-max-body', dest='log_max_body', type=int, default=int(os.getenv('LOG_MAX_BODY', 2000)), help='Maximum number of characters of a request or response body in the log, 0 for no limit, default 2000')
+        self.parser.add_argument('-sources-file', dest='sources_file', default=os.getenv('SOURCES_FILE', None), help='JSON file with a list of sources imported by this process, each an object of the arguments of the source (e.g. {"source": "id", ...}) overriding the command line ones')
+        self.parser.add_argument('-source-parallelism', dest='source_parallelism', type=int, default=int(os.getenv('SOURCE_PARALLELISM', 4)), help='Maximum number of sources from -sources-file imported concurrently, default 4')
+        self.parser.add_argument('-daemon', dest='daemon', action='store_true', default=os.getenv('DAEMON', False), help='Keep running and import on the -interval or -cron schedule, default false')
+        self.parser.add_argument('-interval', dest='interval', type=float, default=float(os.getenv('RUN_INTERVAL', 3600)), help='Seconds between the starts of the imports in daemon mode, default 3600')
+        self.parser.add_argument('-cron', dest='cron', default=os.getenv('RUN_CRON', None), help='Cron expression (minute hour day-of-month month day-of-week, local time) of the imports in daemon mode, instead of -interval')
         self.parser.add_argument('-connection-test', dest='connection_test', type=bool, default=os.getenv('DATASOURCE_CONNECTION_TEST', False), help='Only perform datasource connection test and exit, if this parameter is present with any value.')
+        self.parser.add_argument('-car-request-compression', dest='car_request_compression', default=os.getenv('CAR_REQUEST_COMPRESSION', 'none'), choices=['none', 'gzip', 'deflate'], help='Compression of request bodies sent to CAR, default none')
+        self.parser.add_argument('-car-request-timeout', dest='car_request_timeout', type=float, default=float(os.getenv('CAR_REQUEST_TIMEOUT', 0)), help='Seconds to wait for a CAR response, 0 to wait without limit, default 0')
+        self.parser.add_argument('-adaptive-batching', dest='adaptive_batching', action='store_true', default=os.getenv('ADAPTIVE_BATCHING', False), help='Send insert mutations in batches sized by -batch-target-bytes and -batch-target-latency, split when CAR responds with 413 or 504, default false')
+        self.parser.add_argument('-batch-target-bytes', dest='batch_target_bytes', type=int, default=int(os.getenv('BATCH_TARGET_BYTES', 2000000)), help='Target size of an insert mutation request with -adaptive-batching, default 2000000')
+        self.parser.add_argument('-batch-target-latency', dest='batch_target_latency', type=float, default=float(os.getenv('BATCH_TARGET_LATENCY', 5)), help='Target seconds for CAR to respond to an insert mutation with -adaptive-batching, default 5')
+        self.parser.add_argument('-car-max-concurrency', dest='car_max_concurrency', type=int, default=int(os.getenv('CAR_MAX_CONCURRENCY', 0)), help='Maximum number of concurrent CAR requests, halved when CAR responds with 429 or 503 and increased again on success, 0 for -car-pool-maxsize, default 0')
+        self.parser.add_argument('-car-rate-limit', dest='car_rate_limit', type=float, default=float(os.getenv('CAR_RATE_LIMIT', 0)), help='Maximum CAR requests per second, 0 for no limit, default 0')
+        self.parser.add_argument('-car-circuit-breaker-failures', dest='car_circuit_breaker_failures', type=int, default=int(os.getenv('CAR_CIRCUIT_BREAKER_FAILURES', 5)), help='Consecutive failed CAR requests (connection errors, 502, 503) after which requests fail right away with a recoverable failure, 0 to disable, default 5')
+        self.parser.add_argument('-car-circuit-breaker-reset', dest='car_circuit_breaker_reset', type=float, default=float(os.getenv('CAR_CIRCUIT_BREAKER_RESET', 30)), help='Seconds after which a request is sent again to CAR when the circuit breaker is open, default 30')
+        self.parser.add_argument('-car-pool-connections', dest='car_pool_connections', type=int, default=int(os.getenv('CAR_POOL_CONNECTIONS', 10)), help='Number of connection pools kept for CAR hosts, default 10')
+        self.parser.add_argument('-car-pool-maxsize', dest='car_pool_maxsize', type=int, default=int(os.getenv('CAR_POOL_MAXSIZE', 0)), help='Maximum number of keep-alive connections to CAR, 0 to match -upload-workers and -async-action-concurrency (at least 10), default 0')
+        self.parser.add_argument('-car-metadata-cache-ttl', dest='car_metadata_cache_ttl', type=float, default=float(os.getenv('CAR_METADATA_CACHE_TTL', 60)), help='Seconds the source (existence, model state id) and schema extension metadata read from CAR are cached, 0 to disable, default 60')
+        self.parser.add_argument('-car-metadata-cache-file', dest='car_metadata_cache_file', default=os.getenv('CAR_METADATA_CACHE_FILE', None), help='JSON file in which the CAR metadata cache is kept between runs')
         self.parser.add_argument('-export-data-dir', dest='export_data_dir', default='/tmp/car_temp_export_data', help='Export data directory path, deafualt /tmp/car_temp_export_data')
         self.parser.add_argument('-keep-export-data-dir', dest='keep_export_data_dir', action='store_true', help='True for not removing export_data directory after complete, default false')
         self.parser.add_argument('-export-data-page-size', dest='export_data_page_size', type=int, default=2000, help='File export_data dump page size, default 2000')
+        self.parser.add_argument('-export-data-memory-bytes', dest='export_data_memory_bytes', type=int, default=int(os.getenv('EXPORT_DATA_MEMORY_BYTES', 0)), help='Estimated memory for the vertices and edges of all collections not yet written to export_data files; pages are flushed by size instead of -export-data-page-size, largest first when over the budget, 0 to disable, default 0')
+        self.parser.add_argument('-export-data-page-bytes', dest='export_data_page_bytes', type=int, default=int(os.getenv('EXPORT_DATA_PAGE_BYTES', 4000000)), help='Estimated size of a page with -export-data-memory-bytes, default 4000000')
+        self.parser.add_argument('-export-data-format', dest='export_data_format', default=os.getenv('EXPORT_DATA_FORMAT', 'ndjson'), choices=['ndjson', 'ndjson.gz', 'jsonpickle'], help='File export_data dump format, default ndjson')
+        self.parser.add_argument('-resumable-full-import', dest='resumable_full_import', action='store_true', default=os.getenv('RESUMABLE_FULL_IMPORT', False), help='Keep a run manifest and the export_data files in export_data dir until a full import is completed, so that a failed full import is resumed by the next run, default false')
+        self.parser.add_argument('-resumable-full-import-max-age', dest='resumable_full_import_max_age', type=float, default=float(os.getenv('RESUMABLE_FULL_IMPORT_MAX_AGE', 86400)), help='Seconds after which the manifest of a failed full import is discarded instead of resumed, 0 for no limit, default 86400')
+        self.parser.add_argument('-snapshot-db', dest='snapshot_db', default=os.getenv('SNAPSHOT_DB', None), help='SQLite file with the snapshot of the data sent to CAR, used by SnapshotIncrementalImport to compute the changes of the datasource')
+        self.parser.add_argument('-skip-unchanged', dest='skip_unchanged', action='store_true', default=os.getenv('SKIP_UNCHANGED', False), help='Incremental import does not send vertices identical to the ones sent before, requires -snapshot-db, default false')
+        self.parser.add_argument('-upload-workers', dest='upload_workers', type=int, default=int(os.getenv('UPLOAD_WORKERS', 1)), help='Number of export_data files sent to CAR concurrently, default 1')
+        self.parser.add_argument('-upload-max-inflight-bytes', dest='upload_max_inflight_bytes', type=int, default=int(os.getenv('UPLOAD_MAX_INFLIGHT_BYTES', 0)), help='Maximum total size of export_data files being sent concurrently, 0 for no limit, default 0')
+        self.parser.add_argument('-streaming-upload', dest='streaming_upload', action='store_true', default=os.getenv('STREAMING_UPLOAD', False), help='Send full export_data pages to CAR in the background while data is still being collected, default false')
+        self.parser.add_argument('-streaming-queue-size', dest='streaming_queue_size', type=int, default=int(os.getenv('STREAMING_QUEUE_SIZE', 4)), help='Pages waiting for the background upload before pages are spilled to disk, default 4')
+        self.parser.add_argument('-async-job-timeout', dest='async_job_timeout', type=float, default=float(os.getenv('ASYNC_JOB_TIMEOUT', max_wait_time * 60)), help='Maximum time in seconds to wait for a CAR async job to complete before the run fails with a recoverable failure, 0 for no limit, default %d' % (max_wait_time * 60))
+        self.parser.add_argument('-async-action-concurrency', dest='async_action_concurrency', type=int, default=int(os.getenv('ASYNC_ACTION_CONCURRENCY', 4)), help='Maximum number of CAR async jobs (e.g. pages of deleted vertices) submitted concurrently, default 4')
+        self.parser.add_argument('-async-action-page-bytes', dest='async_action_page_bytes', type=int, default=int(os.getenv('ASYNC_ACTION_PAGE_BYTES', 100000)), help='Approximate maximum size of the vertex ids sent in one CAR async job, default 100000')
+        self.parser.add_argument('-mutation-format', dest='mutation_format', default=os.getenv('MUTATION_FORMAT', 'inline'), choices=['inline', 'variables'], help='How insert mutations are sent: "inline" writes the objects into the query, "variables" sends them as one $objects variable, default inline')
+        self.parser.add_argument('-metrics-file', dest='metrics_file', default=os.getenv('METRICS_FILE', None), help='Write run metrics to this file in Prometheus text format (node_exporter textfile collector / pushgateway)')
+        self.parser.add_argument('-metrics-json-file', dest='metrics_json_file', default=os.getenv('METRICS_JSON_FILE', None), help='Write run metrics summary to this file as JSON')
+        self.parser.add_argument('-dedup-index', dest='dedup_index', default=os.getenv('DEDUP_INDEX', 'memory'), choices=['memory', 'fingerprint', 'sqlite'], help='Index used to skip duplicate vertices and edges: "memory" keeps the keys, "fingerprint" keeps 64 bit hashes of the keys to save memory, "sqlite" keeps the keys in a temporary SQLite file in export_data dir, default memory')
+        self.parser.add_argument('-dedup-index-cache-size', dest='dedup_index_cache_size', type=int, default=int(os.getenv('DEDUP_INDEX_CACHE_SIZE', 100000)), help='Number of recently used keys kept in memory per collection by -dedup-index sqlite, default 100000')
+        self.parser.add_argument('-datasource-workers', dest='datasource_workers', type=int, default=int(os.getenv('DATASOURCE_WORKERS', 4)), help='Number of datasource pages requested concurrently by BaseAssetServer.fetch_pages, default 4')
+        self.parser.add_argument('-datasource-rate-limit', dest='datasource_rate_limit', type=float, default=float(os.getenv('DATASOURCE_RATE_LIMIT', 0)), help='Maximum datasource page requests per second of BaseAssetServer.fetch_pages, 0 for no limit, default 0')
+        self.parser.add_argument('-datasource-retries', dest='datasource_retries', type=int, default=int(os.getenv('DATASOURCE_RETRIES', 3)), help='Number of retries of a failed datasource page request of BaseAssetServer.fetch_pages, default 3')
 
 
     def setup(self):
@@ -53,15 +104,102 @@ class BaseApp(object):
                 sys.stderr.write('If -car-service-url-for-token is provided then -car-service-token argument is required.')
                 sys.exit(ErrorCode.CONNECTOR_RUNTIME_INVALID_PARAMETER.value)
 
-        if not args.source:
+        if not args.source and not args.sources_file:
             self.parser.print_usage(sys.stderr)
             sys.stderr.write('Missing required -source argument.')
             sys.exit(ErrorCode.CONNECTOR_RUNTIME_INVALID_PARAMETER.value)
 
+        if args.cron:
+            try:
+                CronSchedule(args.cron)
+            except ValueError as e:
+                self.parser.print_usage(sys.stderr)
+                sys.stderr.write(str(e))
+                sys.exit(ErrorCode.CONNECTOR_RUNTIME_INVALID_PARAMETER.value)
+
+        if args.skip_unchanged and not args.snapshot_db:
+            self.parser.print_usage(sys.stderr)
+            sys.stderr.write('-skip-unchanged argument requires -snapshot-db.')
+            sys.exit(ErrorCode.CONNECTOR_RUNTIME_INVALID_PARAMETER.value)
+
         Context(args)
 
 
     def run(self):
+        if self.args.daemon and not self.args.connection_test:
+            self.run_daemon()
+            return
+        code = self.run_once()
+        if code or self.args.connection_test:
+            sys.exit(code)
+
+
+    # Runs one import of the source, or of every source of -sources-file, returns the exit code
+    def run_once(self):
+        if self.args.sources_file and not self.args.connection_test:
+            return self.run_sources()
+        return self.run_import()
+
+
+    # Creates the connector objects (asset_server, full_importer, inc_importer) in context(), required for -sources-file
+    def setup_context(self):
+        raise NotImplementedError()
+
+
+    def create_source_contexts(self):
+        with open(self.args.sources_file) as infile:
+            sources = json.load(infile)
+        communicator = context().car_service.communicator
+        contexts = []
+        try:
+            for source_args in sources:
+                args = argparse.Namespace(**vars(self.args))
+                for key, value in source_args.items():
+                    setattr(args, key.replace('-', '_'), value)
+                if not args.source:
+                    raise ValueError('Missing "source" in %s' % self.args.sources_file)
+                # files of the sources are kept apart
+                if 'export_data_dir' not in source_args:
+                    args.export_data_dir = os.path.join(args.export_data_dir, safe_file_name(args.source))
+                for name in ('metrics_file', 'metrics_json_file', 'snapshot_db', 'car_metadata_cache_file'):
+                    if getattr(args, name) and name not in source_args:
+                        setattr(args, name, source_file_path(getattr(args, name), args.source))
+                contexts.append(Context(args, communicator, thread_local=True))
+                self.setup_context()
+        finally:
+            set_thread_context(None)
+        return contexts
+
+
+    # Imports the sources of -sources-file, up to -source-parallelism at once, returns the first non zero exit code
+    def run_sources(self):
+        try:
+            if self.source_contexts is None:
+                self.source_contexts = self.create_source_contexts()
+        except Exception as e:
+            context().logger.exception(e)
+            return ErrorCode.GENERAL_APPLICATION_FAILURE.value
+
+        with ThreadPoolExecutor(max_workers=max(1, self.args.source_parallelism), thread_name_prefix='car-source') as executor:
+            codes = list(executor.map(self.run_source, self.source_contexts))
+        failed = [ctx.args.source for ctx, code in zip(self.source_contexts, codes) if code]
+        context().logger.info('Imported %d sources, failed: %s' % (len(codes), ', '.join(failed) or 'none'))
+        return next((code for code in codes if code), 0)
+
+
+    def run_source(self, source_context):
+        set_thread_context(source_context)
+        try:
+            return self.run_import()
+        finally:
+            set_thread_context(None)
+
+
+    # Runs one import of the source of context(), returns the exit code
+    def run_import(self):
+        context().start_run()
+        start = time.perf_counter()
+        code = 0
         try:
             if self.args.connection_test:
                 if hasattr(context(), 'asset_server') and hasattr(context().asset_server, 'test_connection') :
@@ -71,13 +209,17 @@ class BaseApp(object):
                         context().logger.info('Testing the datasource connection was successful.')
                     else:
                         context().logger.error('Testing the datasource connection failed with code ' + str(code))
-                    sys.exit(code)
+                    return code
                 else:
                     raise DatasourceFailure("The connector did not implement connection_test call.")
             else:
                 try:
-                    extension = self.get_schema_extension()
-                    if extension: extension.setup()
+                    # the schema extension is set up once per process
+                    with self.extension_lock:
+                        if not self.extension_ready:
+                            extension = self.get_schema_extension()
+                            if extension: extension.setup()
+                            self.extension_ready = True
 
                     context().logger.info('Attempting incremental import...')
                     context().inc_importer.run()
@@ -90,21 +232,81 @@ class BaseApp(object):
         except RecoverableFailure as e:
             context().logger.info('Recoverable failure: ' + e.message)
             context().logger.info('Incremental import will be attempted again in the next run.')
-            sys.exit(e.code)
+            code = e.code
         except UnrecoverableFailure as e:
             context().logger.info('Unrecoverable failure: ' + e.message)
             context().logger.info('Incremental import will not be possible in the next run.')
-            context().car_service.reset_model_state_id()
-            sys.exit(e.code)
+            code = e.code
+            try:
+                context().car_service.reset_model_state_id()
+            except Exception as e:
+                context().logger.error('Failed to reset model state id: %s' % str(e))
         except DatasourceFailure as e:
             context().logger.info('Datasource failure: ' + str(e.message))
-            sys.exit(e.code)
+            code = e.code
         except Exception as e:
             context().logger.exception(e)
             context().logger.error(traceback.format_exc())
             # traceback.print_exc()
-            sys.exit(ErrorCode.GENERAL_APPLICATION_FAILURE.value)
+            code = ErrorCode.GENERAL_APPLICATION_FAILURE.value
+        finally:
+            context().metrics.observe('phase_duration_seconds', time.perf_counter() - start, phase='run')
+            context().metrics.set('run_exit_code', code)
+            self.report_metrics()
+        return code
+
+
+    # Runs imports on the -interval or -cron schedule until SIGTERM / SIGINT or max_runs runs
+    def run_daemon(self, max_runs=None):
+        schedule = CronSchedule(self.args.cron) if self.args.cron else IntervalSchedule(self.args.interval)
+        self.stop_event.clear()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                signal.signal(signum, lambda signum, frame: self.stop())
+            except ValueError:
+                # not the main thread
+                pass
+
+        runs = 0
+        next_time = datetime.now() if not self.args.cron else schedule.next_time(datetime.now())
+        while not self.stop_event.is_set():
+            if self.stop_event.wait(seconds_until(next_time)): break
+            run_start = datetime.now()
+            code = self.run_once()
+            runs += 1
+            if max_runs and runs >= max_runs: break
+            next_time = schedule.next_time(datetime.now(), run_start)
+            context().logger.info('Run finished with exit code %d, next run at %s' % (code, next_time.isoformat(timespec='seconds')))
+        context().logger.info('Daemon stopped.')
+
+
+    def stop(self):
+        self.stop_event.set()
+
+
+    def report_metrics(self):
+        metrics = context().metrics
+        args = context().args
+        context().logger.info('Run metrics: %s', json.dumps(metrics.summary()))
+        try:
+            if args.metrics_file:
+                metrics.write_prometheus(args.metrics_file, {'source': args.source, 'connector': args.connector_name or ''})
+            if args.metrics_json_file:
+                metrics.write_json(args.metrics_json_file)
+        except OSError as e:
+            context().logger.error('Failed to write metrics: %s' % str(e))
 
 
     def get_schema_extension(self):
         return None
+
+
+def safe_file_name(name):
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+# File of the source: "{source}" in the path is replaced with the source id, or the id is appended to the file name
+def source_file_path(path, source):
+    if '{source}' in path: return path.replace('{source}', safe_file_name(source))
+    root, ext = os.path.splitext(path)
+    return '%s_%s%s' % (root, safe_file_name(source), ext)
@@ -0,0 +1,172 @@
+import asyncio, json, time
+
+from car_framework.car_service import AsyncActionStats, CAR_SCHEMA, GRAPH_QL, SOURCE_FIELDS, async_action_query, async_job_timeout_failure, \
+    async_jobs_status_query, check_source_inserted, delete_vertices_kwargs_list, extension_cache_key, extension_data, insert_source_query, \
+    limit_edges_kwargs_list, max_jobs_per_status_query, max_wait_time, MetadataCache, parse_async_job_id, parse_async_jobs_done, parse_source_info, poll_intervals, \
+    save_model_state_id_query, serialize_mutation, source_cache_key, source_query
+from car_framework.context import context
+from car_framework.data_handler import json_default
+from car_framework.util import check_status_code, get_json
+
+
+class AsyncCarService(AsyncActionStats):
+    """ asyncio counterpart of CarService, every method is a coroutine. """
+
+    def __init__(self, communicator):
+        super().__init__()
+        self.communicator = communicator
+        # sources known to exist, checked once per process
+        self.sources_created = set()
+        self.metadata_cache = MetadataCache.create()
+
+
+    async def close(self):
+        await self.communicator.close()
+
+
+    async def create_source_if_needed(self):
+        source = context().args.source
+        if source in self.sources_created: return
+        if not (await self.get_source_info())['exists']:
+            res = await self.query_graphql(insert_source_query(source))
+            check_source_inserted(res)
+            self.metadata_cache.set(source_cache_key(source), {'exists': True, 'model_state_id': None})
+        self.sources_created.add(source)
+
+
+    async def get_source_info(self):
+        source = context().args.source
+        info = self.metadata_cache.get(source_cache_key(source))
+        if info is None:
+            info = parse_source_info(await self.query_graphql(source_query(source, SOURCE_FIELDS)))
+            self.metadata_cache.set(source_cache_key(source), info)
+        return info
+
+
+    async def get_model_state_id(self):
+        return (await self.get_source_info())['model_state_id']
+
+
+    async def save_model_state_id(self, new_model_state_id):
+        source = context().args.source
+        try:
+            await self.query_graphql(save_model_state_id_query(source, new_model_state_id))
+        except Exception:
+            self.metadata_cache.invalidate(source_cache_key(source))
+            raise
+        self.metadata_cache.set(source_cache_key(source), {'exists': True, 'model_state_id': new_model_state_id})
+
+
+    async def reset_model_state_id(self):
+        await self.save_model_state_id('')
+
+
+    async def send_mutation(self, mutation):
+        return await self._query_graphql(serialize_mutation(mutation))
+
+
+    async def delete_vertices(self, collection, ids):
+        if context().snapshot_store: context().snapshot_store.discard_vertices(collection, ids)
+        await self._async_actions('soft_delete_vertices', delete_vertices_kwargs_list(collection, ids, getattr(context().args, 'async_action_page_bytes', 100000)))
+
+
+    async def query_graphql(self, query):
+        return await self._query_graphql({'query': query})
+
+
+    async def _query_graphql(self, data):
+        r = await self.communicator.post(GRAPH_QL, data=json.dumps(data, default=json_default))
+        check_status_code(r.status_code, 'Accessing CAR Graphql query API')
+        return get_json(r)
+
+
+    async def prepare_full_import(self, report_time):
+        await self._async_action('prepare_full_import', source=context().args.source, report_time=report_time)
+
+
+    async def complete_full_import(self):
+        await self._async_action('complete_full_import', source=context().args.source)
+
+
+    async def prepare_incremental_import(self, report_time):
+        await self._async_action('prepare_incremental_import', source=context().args.source, report_time=report_time)
+
+
+    async def complete_incremental_import(self):
+        await self._async_action('complete_incremental_import', source=context().args.source)
+
+
+    async def get_extension(self, key):
+        cached = self.metadata_cache.get(extension_cache_key(key))
+        if cached is not None: return cached
+        r = await self.communicator.get('%s/%s' % (CAR_SCHEMA, key))
+        if r.status_code == 200:
+            extension = get_json(r)
+            self.metadata_cache.set(extension_cache_key(key), extension)
+            return extension
+        if r.status_code == 404:
+            return None
+        raise Exception('Error when getting schema extension: %d' % r.status_code)
+
+
+    async def setup_extension(self, extension):
+        self.metadata_cache.invalidate(extension_cache_key(extension.key))
+        r = await self.communicator.post(CAR_SCHEMA, data=json.dumps(extension_data(extension)))
+        if r.status_code not in (200, 201):
+            raise Exception('Error when posting schema extension: %d' % r.status_code)
+
+
+    async def limit_edges_to_report(self, source, vertex_collection, edge_collections, ids, report_time):
+        await self.limit_edges_to_report_batch(source, [(vertex_collection, edge_collections, ids)], report_time)
+
+
+    async def limit_edges_to_report_batch(self, source, items, report_time):
+        await self._async_actions('limit_edges_to_report', limit_edges_kwargs_list(source, items, report_time, getattr(context().args, 'async_action_page_bytes', 100000)))
+
+
+    async def _async_action(self, action_name, **kwargs):
+        async_job_id = await self._submit_async_action(action_name, **kwargs)
+        await self._async_actions_wait(action_name, [async_job_id])
+
+
+    async def _async_actions(self, action_name, kwargs_list):
+        if not kwargs_list: return
+        semaphore = asyncio.Semaphore(max(1, getattr(context().args, 'async_action_concurrency', 4)))
+
+        async def submit(kwargs):
+            async with semaphore:
+                return await self._submit_async_action(action_name, **kwargs)
+
+        results = await asyncio.gather(*[submit(kwargs) for kwargs in kwargs_list], return_exceptions=True)
+        # report the failure of the first page, like CarService does
+        for result in results:
+            if isinstance(result, BaseException): raise result
+        await self._async_actions_wait(action_name, results)
+
+
+    async def _submit_async_action(self, action_name, **kwargs):
+        res = await self.query_graphql(async_action_query(action_name, kwargs))
+        return parse_async_job_id(action_name, res)
+
+
+    async def _async_actions_wait(self, action, async_job_ids):
+        start = time.monotonic()
+        timeout = getattr(context().args, 'async_job_timeout', max_wait_time * 60)
+        pending = list(async_job_ids)
+        polls = 0
+        for interval in poll_intervals():
+            if not pending: break
+            if timeout:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise async_job_timeout_failure(action, pending, timeout)
+                interval = min(interval, remaining)
+            await asyncio.sleep(interval)
+            polls += 1
+            done = set()
+            for i in range(0, len(pending), max_jobs_per_status_query):
+                batch = pending[i:i + max_jobs_per_status_query]
+                done.update(parse_async_jobs_done(await self.query_graphql(async_jobs_status_query(action, batch)), batch))
+            pending = [job_id for job_id in pending if job_id not in done]
+
+        self._record_async_action(action, time.monotonic() - start, polls)
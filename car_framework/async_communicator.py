@@ -0,0 +1,127 @@
+import asyncio, json, time
+
+from car_framework.communicator import BaseCommunicator, Response, default_api_version, parse_retry_after, retry_after_statuses, retry_backoff_time, retry_status_forcelist, retry_total
+from car_framework.context import context
+
+class AsyncCommunicator(BaseCommunicator):
+    """
+    asyncio counterpart of Communicator based on aiohttp (pip install car-connector-framework[async]).
+    Requests are retried like in Communicator, connection failures are returned as a 503 Response and
+    timeouts as a 504 Response.
+    Failures are counted by its own CircuitBreaker, the Throttle of Communicator is not used.
+    """
+    def __init__(self):
+        super().__init__()
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('aiohttp package is required for AsyncCommunicator')
+        self.aiohttp = aiohttp
+        self.auth = aiohttp.BasicAuth(self.basic_auth.username, self.basic_auth.password) if self.basic_auth else None
+        self.session = None
+        self.session_loop = None
+        self.timeout = getattr(context().args, 'car_request_timeout', 0) or None
+
+
+    async def get_session(self):
+        loop = asyncio.get_running_loop()
+        # a session can only be used in the event loop it was created in
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            previous = self.session
+            connector = self.aiohttp.TCPConnector(limit=self.pool_maxsize)
+            session_args = {'connector': connector}
+            # -car-request-timeout applies to connecting and to every read, as in Communicator
+            if self.timeout: session_args['timeout'] = self.aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout)
+            self.session = self.aiohttp.ClientSession(**session_args)
+            self.session_loop = loop
+            # the connections of the session of an earlier event loop
+            if previous is not None and not previous.closed: await previous.close()
+        return self.session
+
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+
+    async def send_request(self, req, path, **args):
+        self.circuit_breaker.before_request()
+        try:
+            return await self._send_with_retries(req, path, **args)
+        except BaseException:
+            self.circuit_breaker.record_exception()
+            raise
+
+
+    async def _send_with_retries(self, req, path, **args):
+        url = self.make_url(path)
+        if 'api_version' in args:
+            url = url.replace(default_api_version, args['api_version'])
+            del args['api_version']
+
+        data = args.get('data')
+        headers, body = self.encode_body(data)
+        session = await self.get_session()
+
+        start = time.perf_counter()
+        consecutive_errors = 0
+        while True:
+            try:
+                async with session.request(req, url, data=body, params=args.get('params'), headers=headers, auth=self.auth, allow_redirects=False) as r:
+                    text = await r.text()
+                    resp = Response(r.status, self._parse_json(text))
+                    retry_after = r.headers.get('Retry-After')
+            except asyncio.TimeoutError as e:
+                # not retried, e.g. AdaptiveBatcher splits the batch
+                context().logger.error('Timeout while sending %s request: %s' % (req, str(e)))
+                self.record_request(req, 'timeout', body, time.perf_counter() - start)
+                self.circuit_breaker.record(504)
+                return Response(504, {'error' : str(e)})
+            except self.aiohttp.ClientConnectionError as e:
+                consecutive_errors += 1
+                if consecutive_errors > retry_total:
+                    context().logger.error('Error while sending %s request: %s' % (req, str(e)))
+                    self.record_request(req, 'error', body, time.perf_counter() - start)
+                    self.circuit_breaker.record(503)
+                    return Response(503, {'error' : str(e)})
+                await self._retry_wait(url, retry_backoff_time(consecutive_errors))
+                continue
+
+            if resp.status_code in retry_status_forcelist and consecutive_errors < retry_total:
+                consecutive_errors += 1
+                backoff_time = parse_retry_after(retry_after) if resp.status_code in retry_after_statuses else None
+                if backoff_time is None: backoff_time = retry_backoff_time(consecutive_errors)
+                await self._retry_wait(url, backoff_time)
+                continue
+
+            self.record_request(req, resp.status_code, body, time.perf_counter() - start)
+            self.circuit_breaker.record(resp.status_code)
+            self.log_response(req, url, resp, args.get('params'), data)
+            return resp
+
+
+    async def _retry_wait(self, url, backoff_time):
+        context().logger.info('Retry after %s sec invoked with url %s' % (backoff_time, url))
+        await asyncio.sleep(backoff_time)
+
+
+    def _parse_json(self, text):
+        try: return json.loads(text)
+        except ValueError: return {}
+
+
+    async def post(self, path, **args):
+        return await self.send_request('POST', path, **args)
+
+
+    async def get(self, path, **args):
+        return await self.send_request('GET', path, **args)
+
+
+    async def patch(self, path, **args):
+        return await self.send_request('PATCH', path, **args)
+
+
+    async def delete(self, path, **args):
+        return await self.send_request('DELETE', path, **args)
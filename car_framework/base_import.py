@@ -1,3 +1,5 @@
+import asyncio
+
 from car_framework.util import check_for_error, BATCH_SIZE
 from car_framework.context import context
 
@@ -6,11 +8,46 @@ class BaseImport(object):
 
     def __init__(self):
         self.statuses = []
+        # data handlers of the run, see close_data_handlers
+        self.data_handlers = []
+
+    # importers of connectors may not call BaseImport.__init__
+    def add_data_handler(self, data_handler):
+        data_handlers = self.__dict__.setdefault('data_handlers', [])
+        if data_handler not in data_handlers: data_handlers.append(data_handler)
+
+    # Stops the background uploads of the data handlers when the import failed
+    def close_data_handlers(self):
+        for data_handler in getattr(self, 'data_handlers', []):
+            data_handler.close()
+        self.data_handlers = []
 
     def send_mutation(self, mutation):
+        if context().mutation_batcher:
+            context().mutation_batcher.send(mutation)
+            return
         status = context().car_service.send_mutation(mutation)
         check_for_error(status)
 
+    async def send_mutation_async(self, mutation):
+        status = await context().async_car_service.send_mutation(mutation)
+        check_for_error(status)
+
+    # Runs a coroutine which uses context().async_car_service and closes its connections when done
+    def run_async(self, coroutine):
+        async def run():
+            try: return await coroutine
+            finally: await context().async_car_service.close()
+        return asyncio.run(run())
+
+    # Called by the data handler with every page of vertices before it is sent, returns the objects to send
+    def filter_vertices(self, collection, objects):
+        return objects
+
+    # Called by the data handler with every page of edges before it is sent, returns the objects to send
+    def filter_edges(self, collection, objects):
+        return objects
+
     def get_last_model_state_id(self):
         return context().car_service.get_model_state_id()
 
@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+from car_framework.car_service import serialize_mutation
+from car_framework.context import context
+from car_framework.data_handler import Mutation, json_default
+from car_framework.util import check_for_error, check_status_code
+
+# responses after which the batch is split and sent again
+SPLIT_STATUS_CODES = (413, 504)
+grow_factor = 1.5
+shrink_factor = 0.5
+
+
+class AdaptiveBatcher(object):
+    """
+    Sends the rows of insert mutations in batches sized per collection to stay around `target_bytes`
+    request size and `target_latency` seconds response time. A batch is split and sent again when CAR
+    responds with 413 or 504 (also for a request timeout), and grows when CAR responds quickly.
+    Batches are never larger than the page they come from.
+    """
+    def __init__(self, target_bytes, target_latency):
+        self.target_bytes = target_bytes
+        self.target_latency = target_latency
+        self.lock = threading.Lock()
+        # collection -> {'rows': batch size, 'row_bytes': average serialized row size}
+        self.state = {}
+
+    def send(self, mutation):
+        rows = mutation.data
+        start = 0
+        while start < len(rows):
+            batch = rows[start:start + self.batch_rows(mutation.collection_name, len(rows))]
+            self.send_batch(mutation.collection_name, batch)
+            start += len(batch)
+
+    def batch_rows(self, collection, page_rows):
+        with self.lock:
+            state = self.state.get(collection)
+            if state is None: return page_rows
+            rows = state['rows']
+            if state['row_bytes']: rows = min(rows, self.target_bytes / state['row_bytes'])
+            return max(1, min(page_rows, int(rows)))
+
+    def send_batch(self, collection, batch):
+        body = json.dumps(serialize_mutation(Mutation(collection, batch)), default=json_default)
+        start = time.perf_counter()
+        status_code, res = context().car_service.send_mutation_body(body)
+        latency = time.perf_counter() - start
+
+        if status_code in SPLIT_STATUS_CODES and len(batch) > 1:
+            half = len(batch) // 2
+            context().logger.info('Splitting %d rows of %s after status code %d' % (len(batch), collection, status_code))
+            context().metrics.inc('batch_splits_total', collection=collection, status=str(status_code))
+            self.update(collection, half, len(body) / len(batch))
+            self.send_batch(collection, batch[:half])
+            self.send_batch(collection, batch[half:])
+            return
+
+        check_status_code(status_code, 'Accessing CAR Graphql query API')
+        check_for_error(res)
+        if latency > self.target_latency:
+            rows = len(batch) * shrink_factor
+        elif latency < self.target_latency / 2 and len(body) < self.target_bytes:
+            rows = len(batch) * grow_factor
+        else:
+            rows = len(batch)
+        self.update(collection, rows, len(body) / len(batch))
+
+    def update(self, collection, rows, row_bytes):
+        with self.lock:
+            state = self.state.setdefault(collection, {'rows': rows, 'row_bytes': row_bytes})
+            state['rows'] = max(1, rows)
+            # moving average, rows of a collection have similar sizes
+            state['row_bytes'] = 0.8 * state['row_bytes'] + 0.2 * row_bytes
+        context().metrics.set('batch_rows', int(max(1, rows)), collection=collection)
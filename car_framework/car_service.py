@@ -1,15 +1,27 @@
 from cmath import log
-import json, urllib
+from concurrent.futures import ThreadPoolExecutor
+import json, os, threading, urllib
 from enum import Enum
-from car_framework.util import check_status_code, get, get_json, deprecate, recoverable_failure_status_code, RecoverableFailure, UnrecoverableFailure
-from car_framework.context import context
+from car_framework.util import check_status_code, get, get_json, deprecate, recoverable_failure_status_code, write_file_atomic, RecoverableFailure, UnrecoverableFailure
+from car_framework.context import context, set_thread_context
+from car_framework.data_handler import json_default
+import random
 import time
 
 CAR_SCHEMA = '/carSchema'
 GRAPH_QL = '/query'
 
 MODEL_STATE_ID = 'model_state_id'
+# maximum time in minutes to wait for an async job to complete, default of -async-job-timeout
 max_wait_time = 60
+# async job status polling: first poll after poll_initial_interval sec, the interval then grows
+# by poll_backoff_factor (+/- poll_jitter) up to max_poll_interval sec between polls
+max_poll_interval = 20
+poll_initial_interval = 0.25
+poll_backoff_factor = 1.5
+poll_jitter = 0.2
+# maximum number of async jobs whose status is requested in one query
+max_jobs_per_status_query = 50
 
 
 def graphql_list(items):
@@ -26,54 +38,258 @@ def graphql_arg(key, value):
 def graphql_args(kwargs):
     return ', '.join( map(lambda item: graphql_arg(item[0], item[1]), kwargs.items()) )
 
+def poll_intervals():
+    interval = poll_initial_interval
+    while True:
+        yield interval * random.uniform(1 - poll_jitter, 1 + poll_jitter)
+        interval = min(interval * poll_backoff_factor, max_poll_interval)
 
-class CarService(object):
+def compose_paginated_list(ids, limit=1800):
+    output = {}
+    page = 1
+    length = 0
+    for id in ids:
+        id = str(id)
+        length += len(id)
+        if (length > (limit * page)):
+            page += 1
 
-    def __init__(self, communicator):
-        self.communicator = communicator
+        if not output.get(page):
+            output[page] = []
+        output[page].append(id)
 
+    return output
 
-    def create_source_if_needed(self):
-        source = context().args.source
-        res = self.query_graphql('''
+
+# GraphQL requests and response parsing shared by CarService and AsyncCarService
+
+def serialize_mutation(mutation):
+    with context().metrics.timer('mutation_serialize_seconds'):
+        data = mutation.serialize()
+    context().metrics.inc('mutation_rows_total', len(mutation.data), collection=mutation.collection_name)
+    return data
+
+def source_query(source, fields):
+    return '''
             {
-                source(where: {id: {_eq: "%s"}}) { id }
-            }''' % (source))
-        res = get(res, 'data.source')
-        if len(res) > 0: return
+                source(where: {id: {_eq: "%s"}}) { %s }
+            }''' % (source, fields)
 
-        res = self.query_graphql('''
+def insert_source_query(source):
+    return '''
             mutation {
                 insert_source(objects: {id: "%s", name: "%s"}) {
                     affected_rows
                 }
-            }''' % (source, source))
+            }''' % (source, source)
 
-        affected_rows = get(res, 'data.insert_source.affected_rows')
-        if affected_rows == 1: return
-        raise Exception('Failed to create the "source" object: %s' % json.dumps(res))
+def check_source_inserted(res):
+    affected_rows = get(res, 'data.insert_source.affected_rows')
+    if affected_rows == 1: return
+    raise Exception('Failed to create the "source" object: %s' % json.dumps(res))
 
+def parse_model_state_id(res):
+    properties = get(res, 'data.source')
+    if len(properties) != 1: return None
+    properties = properties[0].get('properties')
+    if not properties: return None
+    properties = json.loads(properties)
+    return properties.get(MODEL_STATE_ID)
 
-    def get_model_state_id(self):
-        res = self.query_graphql('''
-            {
-                source(where: {id: {_eq: "%s"}}) { properties }
-            }''' % (context().args.source))
-        properties = get(res, 'data.source')
-        if len(properties) != 1: return None
-        properties = properties[0].get('properties')
-        if not properties: return None
-        properties = json.loads(properties)
-        return properties.get(MODEL_STATE_ID)
+# Source existence and model state id from the response of source_query(source, SOURCE_FIELDS)
+SOURCE_FIELDS = 'id properties'
 
+def parse_source_info(res):
+    return {'exists': len(get(res, 'data.source')) > 0, 'model_state_id': parse_model_state_id(res)}
 
-    def save_model_state_id(self, new_model_state_id):
-        self.query_graphql(r'''
+def source_cache_key(source):
+    return 'source:%s' % source
+
+def extension_cache_key(key):
+    return 'extension:%s' % key
+
+def save_model_state_id_query(source, new_model_state_id):
+    return r'''
             mutation {
                 update_source(where: {id: {_eq: "%s"}}, _set: {properties: "{\"%s\":\"%s\"}"}) {
                     affected_rows
                 }
-            }''' % (context().args.source, MODEL_STATE_ID, new_model_state_id))
+            }''' % (source, MODEL_STATE_ID, new_model_state_id)
+
+def delete_vertices_kwargs_list(collection, ids, page_bytes):
+    return [{'collection': collection, 'ids': page} for page in compose_paginated_list(ids, page_bytes).values()]
+
+# items: list of (vertex_collection, edge_collections, vertex ids)
+def limit_edges_kwargs_list(source, items, report_time, page_bytes):
+    kwargs_list = []
+    for vertex_collection, edge_collections, ids in items:
+        for page in compose_paginated_list(ids, page_bytes).values():
+            kwargs_list.append({'source': source, 'collection': vertex_collection, 'edge_collections': edge_collections, 'vertex_ids': page, 'report_time': report_time})
+    return kwargs_list
+
+def async_action_query(action_name, kwargs):
+    return '''
+            mutation {
+                %s(%s)
+            }''' % (action_name, graphql_args(kwargs))
+
+def parse_async_job_id(action_name, res):
+    if res.get('errors'):
+        raise UnrecoverableFailure('Failed operation: "%s". Error: %s' % (action_name, str(res.get('errors'))))
+    data = res['data']
+    error = data.get('error')
+    if error:
+        raise UnrecoverableFailure('Failed operation: "%s". Error: %s' % (action_name, error))
+    async_job_id = data.get(action_name)
+    if not async_job_id:
+        raise UnrecoverableFailure('Async job ID is not found for operation: "%s"' % action_name)
+    return async_job_id
+
+def async_jobs_status_query(action, async_job_ids):
+    return '''
+            query MyQuery {
+                %s
+            }''' % '\n'.join('''
+                job%d: %s(id: "%s") {
+                    errors
+                    output {
+                    error
+                    }
+                }''' % (i, action, async_job_id) for i, async_job_id in enumerate(async_job_ids))
+
+# Returns the ids of the completed jobs, raises UnrecoverableFailure if any of the jobs failed
+def parse_async_jobs_done(res, async_job_ids):
+    done = set()
+    for i, async_job_id in enumerate(async_job_ids):
+        status = get(res, 'data.job%d' % i)
+        if status.get('errors') != None:
+            raise UnrecoverableFailure('Error: ' + str(status.get('errors')))
+        output = status.get('output')
+        if output == None: continue
+        if output.get('error') != None:
+            raise UnrecoverableFailure('Error: ' + str(output.get('error')))
+        done.add(async_job_id)
+    return done
+
+# the jobs may still complete, the next run tries again
+def async_job_timeout_failure(action, pending, timeout):
+    return RecoverableFailure('Async job "%s" %s did not complete in %s sec' % (action, ', '.join(map(str, pending)), timeout))
+
+def extension_data(extension):
+    return {
+        'key': extension.key,
+        'owner': extension.owner,
+        'version': extension.version,
+        'schema': json.loads(extension.schema)
+    }
+
+class MetadataCache(object):
+    """
+    Source and schema extension metadata read from CAR, kept for `ttl` seconds (0 disables the cache)
+    in the process and, with `file_path`, in a JSON file so that the next process can use it too.
+    """
+    def __init__(self, ttl=0, file_path=None):
+        self.ttl = ttl
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if ttl and file_path and os.path.exists(file_path):
+            try:
+                with open(file_path) as infile:
+                    self.entries = json.load(infile)
+            except ValueError as e:
+                context().logger.warning('Ignoring unreadable metadata cache file %s: %s' % (file_path, str(e)))
+
+    # Cache configured by -car-metadata-cache-ttl and -car-metadata-cache-file
+    @staticmethod
+    def create():
+        return MetadataCache(getattr(context().args, 'car_metadata_cache_ttl', 60), getattr(context().args, 'car_metadata_cache_file', None))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['expires'] > time.time():
+                return entry['value']
+        return None
+
+    def set(self, key, value):
+        if not self.ttl: return
+        with self.lock:
+            self.entries[key] = {'value': value, 'expires': time.time() + self.ttl}
+            self._save()
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None: self._save()
+
+    def _save(self):
+        if not self.file_path: return
+        now = time.time()
+        try:
+            write_file_atomic(self.file_path, json.dumps({key: entry for key, entry in self.entries.items() if entry['expires'] > now}))
+        except OSError as e:
+            context().logger.warning('Failed to write metadata cache file %s: %s' % (self.file_path, str(e)))
+
+
+class AsyncActionStats(object):
+    """ Duration and number of status requests of the completed async jobs, per action. """
+    def __init__(self):
+        # action name -> {'count', 'total_time', 'max_time', 'polls'}
+        self.async_action_stats = {}
+
+    def _record_async_action(self, action, duration, polls):
+        stats = self.async_action_stats.setdefault(action, {'count': 0, 'total_time': 0.0, 'max_time': 0.0, 'polls': 0})
+        stats['count'] += 1
+        stats['total_time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+        stats['polls'] += polls
+        context().metrics.observe('car_async_job_duration_seconds', duration, action=action)
+        context().metrics.inc('car_async_job_polls_total', polls, action=action)
+        context().logger.info('Async job "%s" completed in %.2f sec after %d status requests', action, duration, polls)
+
+
+class CarService(AsyncActionStats):
+
+    def __init__(self, communicator):
+        super().__init__()
+        self.communicator = communicator
+        # sources known to exist, checked once per process
+        self.sources_created = set()
+        self.metadata_cache = MetadataCache.create()
+
+
+    def create_source_if_needed(self):
+        source = context().args.source
+        if source in self.sources_created: return
+        if not self.get_source_info()['exists']:
+            res = self.query_graphql(insert_source_query(source))
+            check_source_inserted(res)
+            self.metadata_cache.set(source_cache_key(source), {'exists': True, 'model_state_id': None})
+        self.sources_created.add(source)
+
+
+    # Existence and model state id of the source, read with one query and cached
+    def get_source_info(self):
+        source = context().args.source
+        info = self.metadata_cache.get(source_cache_key(source))
+        if info is None:
+            info = parse_source_info(self.query_graphql(source_query(source, SOURCE_FIELDS)))
+            self.metadata_cache.set(source_cache_key(source), info)
+        return info
+
+
+    def get_model_state_id(self):
+        return self.get_source_info()['model_state_id']
+
+
+    def save_model_state_id(self, new_model_state_id):
+        source = context().args.source
+        try:
+            self.query_graphql(save_model_state_id_query(source, new_model_state_id))
+        except Exception:
+            self.metadata_cache.invalidate(source_cache_key(source))
+            raise
+        self.metadata_cache.set(source_cache_key(source), {'exists': True, 'model_state_id': new_model_state_id})
 
 
     def reset_model_state_id(self):
@@ -81,11 +297,18 @@ class CarService(object):
 
 
     def send_mutation(self, mutation):
-        return self._query_graphql(mutation.serialize())
+        return self._query_graphql(serialize_mutation(mutation))
+
+
+    # Sends a serialized mutation, returns the status code and the response data without checking the status
+    def send_mutation_body(self, body):
+        r = self.communicator.post(GRAPH_QL, data=body)
+        return r.status_code, get_json(r)
 
 
     def delete_vertices(self, collection, ids):
-        self._async_action('soft_delete_vertices', collection=collection, ids=ids)
+        if context().snapshot_store: context().snapshot_store.discard_vertices(collection, ids)
+        self._async_actions('soft_delete_vertices', delete_vertices_kwargs_list(collection, ids, getattr(context().args, 'async_action_page_bytes', 100000)))
 
 
     def search_collection(self, resource, attribute, search_id, fields):
@@ -102,7 +325,7 @@ class CarService(object):
 
 
     def _query_graphql(self, data):
-        r = self.communicator.post(GRAPH_QL, data=json.dumps(data))
+        r = self.communicator.post(GRAPH_QL, data=json.dumps(data, default=json_default))
         check_status_code(r.status_code, 'Accessing CAR Graphql query API')
         return get_json(r)
 
@@ -123,85 +346,90 @@ class CarService(object):
         self._async_action('complete_incremental_import', source=context().args.source)
 
 
-    def compose_paginated_list(self, ids):
-        output = {}
-        page = 1
-        limit = 1800
-        length = 0
-        for id in ids:
-            id = str(id)
-            length += len(id)
-            if (length > (limit * page)):
-                page += 1
-
-            if not output.get(page):
-                output[page] = []
-            output[page].append(id)
-
-        return output
+    def compose_paginated_list(self, ids, limit=1800):
+        return compose_paginated_list(ids, limit)
 
 
     def get_extension(self, key):
+        cached = self.metadata_cache.get(extension_cache_key(key))
+        if cached is not None: return cached
         endpoint = '%s/%s' % (CAR_SCHEMA, key)
         r = self.communicator.get(endpoint)
         if r.status_code == 200:
-            return get_json(r)
+            extension = get_json(r)
+            self.metadata_cache.set(extension_cache_key(key), extension)
+            return extension
         if r.status_code == 404:
             return None
         raise Exception('Error when getting schema extension: %d' % r.status_code)
 
 
     def setup_extension(self, extension):
-        data = {
-            'key': extension.key,
-            'owner': extension.owner,
-            'version': extension.version,
-            'schema': json.loads(extension.schema)
-        }
-        r = self.communicator.post(CAR_SCHEMA, data=json.dumps(data))
+        self.metadata_cache.invalidate(extension_cache_key(extension.key))
+        r = self.communicator.post(CAR_SCHEMA, data=json.dumps(extension_data(extension)))
         if r.status_code not in (200, 201):
             raise Exception('Error when posting schema extension: %d' % r.status_code)
 
 
     def limit_edges_to_report(self, source, vertex_collection, edge_collections, ids, report_time):
-        self._async_action('limit_edges_to_report', source=source, collection=vertex_collection, edge_collections=edge_collections, vertex_ids=ids, report_time=report_time)
+        self.limit_edges_to_report_batch(source, [(vertex_collection, edge_collections, ids)], report_time)
+
+
+    # items: list of (vertex_collection, edge_collections, vertex ids), all pages of all collections are processed in parallel
+    def limit_edges_to_report_batch(self, source, items, report_time):
+        self._async_actions('limit_edges_to_report', limit_edges_kwargs_list(source, items, report_time, getattr(context().args, 'async_action_page_bytes', 100000)))
 
 
     def _async_action_wait(self, action, async_job_id):
-        while True:
-            time.sleep(2)
-            res = self.query_graphql('''
-                query MyQuery {
-                    %s(id: "%s") {
-                        errors
-                        output {
-                        error
-                        }
-                      }
-                    }''' % (action, async_job_id))
-
-            res = get(res, 'data.' + action)
-            if res.get('errors') != None:
-                raise UnrecoverableFailure('Error: ' + str(res.get('errors')))
-            res = res.get('output')
-            if res == None: continue
-            if res.get('error') != None:
-                raise UnrecoverableFailure('Error: ' + str(res.get('error')))
-            break
+        self._async_actions_wait(action, [async_job_id])
+
+
+    # Waits for all async jobs of the action, the status of all pending jobs is requested in one shared polling loop
+    def _async_actions_wait(self, action, async_job_ids):
+        start = time.monotonic()
+        timeout = getattr(context().args, 'async_job_timeout', max_wait_time * 60)
+        pending = list(async_job_ids)
+        polls = 0
+        for interval in poll_intervals():
+            if not pending: break
+            if timeout:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise async_job_timeout_failure(action, pending, timeout)
+                interval = min(interval, remaining)
+            time.sleep(interval)
+            polls += 1
+            done = set()
+            for i in range(0, len(pending), max_jobs_per_status_query):
+                batch = pending[i:i + max_jobs_per_status_query]
+                done.update(parse_async_jobs_done(self.query_graphql(async_jobs_status_query(action, batch)), batch))
+            pending = [job_id for job_id in pending if job_id not in done]
+
+        self._record_async_action(action, time.monotonic() - start, polls)
 
 
     def _async_action(self, action_name, **kwargs):
-        res = self.query_graphql('''
-            mutation {
-                %s(%s)
-            }''' % (action_name, graphql_args(kwargs)))
-        if res.get('errors'):
-            raise UnrecoverableFailure('Failed operation: "%s". Error: %s' % (action_name, str(res.get('errors'))))
-        data = res['data']
-        error = data.get('error')
-        if error:
-            raise UnrecoverableFailure('Failed operation: "%s". Error: %s' % (action_name, error))
-        async_job_id = data.get(action_name)
-        if not async_job_id:
-            raise UnrecoverableFailure('Async job ID is not found for operation: "%s"' % action_name)
+        async_job_id = self._submit_async_action(action_name, **kwargs)
         self._async_action_wait(action_name, async_job_id)
+
+
+    # Submits one async job per kwargs item, up to async_action_concurrency at once, and waits for all of them
+    def _async_actions(self, action_name, kwargs_list):
+        if not kwargs_list: return
+        if len(kwargs_list) == 1:
+            return self._async_action(action_name, **kwargs_list[0])
+
+        ctx = context()
+
+        def submit(kwargs):
+            set_thread_context(ctx)
+            return self._submit_async_action(action_name, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=max(1, getattr(ctx.args, 'async_action_concurrency', 4)), thread_name_prefix='car-async-action') as executor:
+            async_job_ids = list(executor.map(submit, kwargs_list))
+        self._async_actions_wait(action_name, async_job_ids)
+
+
+    def _submit_async_action(self, action_name, **kwargs):
+        res = self.query_graphql(async_action_query(action_name, kwargs))
+        return parse_async_job_id(action_name, res)
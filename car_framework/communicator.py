@@ -1,18 +1,58 @@
-import requests, os
-from requests.exceptions import ConnectionError, ConnectTimeout, RetryError
+import requests, os, gzip, logging, threading, time, zlib
+from email.utils import parsedate_to_datetime
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout, RetryError
+from urllib3.exceptions import ReadTimeoutError
 from requests.auth import HTTPBasicAuth
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
-from car_framework.util import get_json
+from car_framework.util import get_json, LogBody, RecoverableFailure, TokenBucket
 from car_framework.context import context
 
 default_api_version = '/api/car/v2'
+# retry policy for CAR requests
+retry_total = 3
+retry_backoff_factor = 2
+retry_status_forcelist = [403, 429, 503]
+# statuses for which the Retry-After header is honored, as urllib3 Retry does
+retry_after_statuses = (413, 429, 503)
+# statuses which reduce the number of concurrent requests of the Throttle
+throttle_status_codes = (429, 503)
+# statuses counted as failures by the CircuitBreaker, connection errors are returned as 503. 504 (also
+# returned for read timeouts) is not counted, AdaptiveBatcher splits the batch and sends it again
+circuit_status_codes = (502, 503)
+# request bodies smaller than this are sent uncompressed
+min_compress_size = 1024
+compression_level = 1
+
+compressors = {
+    'gzip': lambda data: gzip.compress(data, compresslevel=compression_level),
+    'deflate': lambda data: zlib.compress(data, compression_level),
+}
+
+def retry_backoff_time(consecutive_errors):
+    # same schedule as urllib3 Retry
+    if consecutive_errors <= 1: return 0
+    return retry_backoff_factor * (2 ** (consecutive_errors - 1))
+
+
+def parse_retry_after(value):
+    if not value: return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 
 class Response(object):
     def __init__(self, sc, data):
         self.status_code = sc
         self.data = data
+        self.headers = {}
 
     def json(self):
         return self.data
@@ -30,9 +70,102 @@ class CallbackRetry(Retry):
         context().logger.info('Retry after %s sec invoked with url %s' % (backoff_time, url))
 
 
-class Communicator(object):
+class Throttle(object):
+    """
+    Client side throttle of the requests to CAR, shared by all threads: at most `limit` requests are
+    sent concurrently. The limit is halved when CAR responds with 429 or 503 and grows by one for every
+    `limit` successful responses up to max_concurrency (AIMD). No request is sent until the Retry-After
+    time of a response has passed.
+    """
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.running = 0
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.running < int(self.limit): break
+                self.condition.wait(wait if wait > 0 else None)
+            self.running += 1
+
+    def release(self, status_code, retry_after=None):
+        with self.condition:
+            self.running -= 1
+            now = time.monotonic()
+            if status_code in throttle_status_codes:
+                # responses to requests sent before the last decrease do not decrease the limit again
+                if now - self.last_decrease >= 1:
+                    self.limit = max(1, self.limit / 2)
+                    self.last_decrease = now
+                if retry_after: self.paused_until = max(self.paused_until, now + retry_after)
+                context().metrics.inc('car_throttled_total', status=str(status_code))
+            elif status_code is not None and status_code < 500:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            context().metrics.set('car_concurrency_limit', int(self.limit))
+            self.condition.notify_all()
+
+
+class CircuitBreaker(object):
+    """
+    Requests to CAR raise RecoverableFailure right away for `reset_timeout` seconds after `failures`
+    consecutive requests failed with a connection error, 502 or 503. Then one request is sent,
+    the circuit is closed when it succeeds and opened again otherwise. failures 0 disables it.
+    """
+    def __init__(self, failures, reset_timeout):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        if not self.failures: return
+        with self.lock:
+            if self.opened_at is None: return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                context().metrics.inc('car_circuit_rejected_total')
+                raise RecoverableFailure('CAR service is unavailable, %d consecutive requests failed' % self.consecutive_failures)
+            self.trial = True
+
+    def record(self, status_code):
+        if not self.failures: return
+        with self.lock:
+            if status_code in circuit_status_codes:
+                self.consecutive_failures += 1
+                if self.trial or (self.opened_at is None and self.consecutive_failures >= self.failures):
+                    context().logger.warning('CAR service is unavailable, no requests are sent for %s sec' % self.reset_timeout)
+                    self.opened_at = time.monotonic()
+            else:
+                if self.opened_at is not None: context().logger.info('CAR service is available again')
+                self.consecutive_failures = 0
+                self.opened_at = None
+            self.trial = False
+
+    # The request raised an exception instead of returning a response, the circuit is opened again after a trial request
+    def record_exception(self):
+        if not self.failures: return
+        with self.lock:
+            if self.trial: self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class BaseCommunicator(object):
+    """ CAR service URL, authentication and request body encoding shared by Communicator and AsyncCommunicator. """
     def __init__(self):
-        self.headers = {'Accept' : 'application/json', 'Content-Type' : 'application/json'}
+        self.headers = {'Accept' : 'application/json', 'Content-Type' : 'application/json', 'Accept-Encoding': 'gzip, deflate'}
+        args = context().args
+        # options added after the first releases are optional, args objects of connector tests may not have them
+        self.compression = getattr(args, 'car_request_compression', 'none')
+        if self.compression == 'none': self.compression = None
 
         auth_token = context().args.api_token
         if auth_token:
@@ -46,48 +179,137 @@ class Communicator(object):
         if not self.base_url.endswith('/'):
             self.base_url = self.base_url + '/'
 
+        self.pool_maxsize = getattr(args, 'car_pool_maxsize', 0)
+        if not self.pool_maxsize:
+            # enough connections for all concurrent uploads and async job submissions
+            self.pool_maxsize = max(10, getattr(args, 'upload_workers', 1), getattr(args, 'async_action_concurrency', 4))
+            if getattr(args, 'sources_file', None):
+                # the Communicator is shared by the sources imported concurrently
+                self.pool_maxsize *= max(1, getattr(args, 'source_parallelism', 4))
+        self.circuit_breaker = CircuitBreaker(getattr(args, 'car_circuit_breaker_failures', 5), getattr(args, 'car_circuit_breaker_reset', 30))
+
+
+    def make_url(self, path):
+        if path.startswith('http'):
+            context().logger.warn('A URL is passed in to the Communicator instead of a path: ' + path)
+            return path
+
+        if path.startswith('/'): path = path[1:]
+        return self.base_url + path
+
+
+    def record_request(self, req, status_code, body, duration):
+        metrics = context().metrics
+        metrics.inc('car_requests_total', method=req, status=str(status_code))
+        metrics.observe('car_request_duration_seconds', duration, method=req)
+        if body: metrics.inc('car_request_bytes_total', len(body))
+
+
+    # Bodies are converted and truncated to -log-max-body only when the message is logged
+    def log_response(self, req, url, resp, params, data):
+        logger = context().logger
+        max_size = getattr(context().args, 'log_max_body', 2000)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s %s, status code: %d, response data: %s', req, url, resp.status_code, LogBody(lambda: get_json(resp), max_size))
+        if resp.status_code != 200:
+            logger.warning('%s %s, status code: %d, response data: %s, request params: %s, request data: %s', req, url, resp.status_code,
+                           LogBody(lambda: get_json(resp), max_size), params, LogBody(lambda: data, max_size))
+
+
+    # Returns the headers and the body to send, compressed if enabled
+    def encode_body(self, data):
+        if self.compression and data and len(data) >= min_compress_size:
+            body = compressors[self.compression](data.encode('utf-8') if isinstance(data, str) else data)
+            return dict(self.headers, **{'Content-Encoding': self.compression}), body
+        return self.headers, data
+
+
+class Communicator(BaseCommunicator):
+    def __init__(self):
+        super().__init__()
+
+        # connection errors only, statuses are retried by send_request
         retry_strategy = CallbackRetry(
-            total=3,
-            backoff_factor=10,
+            total=retry_total,
+            backoff_factor=retry_backoff_factor,
             raise_on_status=False,
-            status_forcelist=[403, 429, 503],
             allowed_methods=["HEAD", "GET", "POST", "PUT", "DELETE", "OPTIONS", "TRACE"]
         )
 
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        args = context().args
+        adapter = HTTPAdapter(pool_connections=getattr(args, 'car_pool_connections', 10), pool_maxsize=self.pool_maxsize, max_retries=retry_strategy)
         self.http = requests.Session()
         self.http.mount("https://", adapter)
         self.http.mount("http://", adapter)
+        self.timeout = getattr(args, 'car_request_timeout', 0) or None
+        self.throttle = Throttle(getattr(args, 'car_max_concurrency', 0) or self.pool_maxsize)
+        self.rate_limiter = TokenBucket(getattr(args, 'car_rate_limit', 0))
 
 
-    def make_url(self, path):
-        if path.startswith('http'):
-            context().logger.warn('A URL is passed in to the Communicator instead of a path: ' + path)
-            return path
+    # Retries the statuses of retry_status_forcelist, waiting for Retry-After if given
+    def send_request(self, req, func, path, **args):
+        self.circuit_breaker.before_request()
+        consecutive_errors = 0
+        while True:
+            self.rate_limiter.acquire()
+            self.throttle.acquire()
+            resp = None
+            try:
+                resp = self._send_request(req, func, path, **args)
+            except BaseException:
+                self.circuit_breaker.record_exception()
+                raise
+            finally:
+                retry_after = None
+                if resp is not None and resp.status_code in retry_after_statuses:
+                    retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                self.throttle.release(resp.status_code if resp is not None else None, retry_after)
+            self.circuit_breaker.record(resp.status_code)
 
-        if path.startswith('/'): path = path[1:]
-        return self.base_url + path
+            # connection errors (Response) were retried already
+            if resp.status_code not in retry_status_forcelist or isinstance(resp, Response) or consecutive_errors >= retry_total or self.circuit_breaker.is_open():
+                return resp
+            consecutive_errors += 1
+            backoff_time = retry_after if retry_after is not None else retry_backoff_time(consecutive_errors)
+            context().logger.info('Retry after %s sec invoked with url %s' % (backoff_time, path))
+            # the throttle waits for Retry-After
+            if retry_after is None: time.sleep(backoff_time)
 
 
-    def send_request(self, req, func, path, **args):
+    def _send_request(self, req, func, path, **args):
+        start = time.perf_counter()
+        body = None
         try:
             url = self.make_url(path)
             if 'api_version' in args:
                 url = url.replace(default_api_version, args['api_version'])
                 del args['api_version']
 
-            resp = func(url, auth=self.basic_auth, allow_redirects=False, headers=self.headers, **args)
-            context().logger.debug('%s %s, status code: %d, response data: %s' % (req, url, resp.status_code, get_json(resp)))
-            if resp.status_code != 200:
-                context().logger.warn('%s %s, status code: %d, response data: %s, request params: %s, request data: %s' % (req,
-                    url, resp.status_code, get_json(resp), args.get('params'), args.get('data')))
+            data = args.get('data')
+            headers, body = self.encode_body(data)
+            if body is not data: args = dict(args, data=body)
+
+            if self.timeout: args.setdefault('timeout', self.timeout)
+            resp = func(url, auth=self.basic_auth, allow_redirects=False, headers=headers, **args)
+            self.record_request(req, resp.status_code, body, time.perf_counter() - start)
+            self.log_response(req, url, resp, args.get('params'), data)
             return resp
         except RetryError as e:
             context().logger.error('Max retries exceeded error while sending %s request: %s' % (req, str(e)))
+            self.record_request(req, 'error', body, time.perf_counter() - start)
             return Response(503, {'error' : str(e)})
         except (ConnectionError, ConnectTimeout) as e:
+            if isinstance(getattr(e.args[0] if e.args else None, 'reason', None), ReadTimeoutError):
+                context().logger.error('Timeout while sending %s request: %s' % (req, str(e)))
+                self.record_request(req, 'timeout', body, time.perf_counter() - start)
+                return Response(504, {'error' : str(e)})
             context().logger.error('Error while sending %s request: %s' % (req, str(e)))
+            self.record_request(req, 'error', body, time.perf_counter() - start)
             return Response(503, {'error' : str(e)})
+        except ReadTimeout as e:
+            context().logger.error('Timeout while sending %s request: %s' % (req, str(e)))
+            self.record_request(req, 'timeout', body, time.perf_counter() - start)
+            return Response(504, {'error' : str(e)})
 
 
     def post(self, path, **args):
@@ -1,6 +1,34 @@
+import atexit
 import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 from pythonjsonlogger import jsonlogger
 from datetime import datetime
+from car_framework.util import LogBody
+
+# (second, formatted) of the last log record timestamp
+last_log_time = (None, '')
+
+def format_log_time(created):
+    global last_log_time
+    seconds = int(created)
+    cached = last_log_time
+    if cached[0] != seconds:
+        cached = last_log_time = (seconds, time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)))
+    return '%s.%06dZ' % (cached[1], (created - seconds) * 1000000)
+
+# connector, source and version of the current context added to every log record, computed once per context
+def context_log_fields():
+    ctx = context()
+    if ctx is None: return {}
+    fields = getattr(ctx, '_log_fields', None)
+    if fields is None:
+        args = ctx.args
+        fields = {name: value for name, value in (('connector', args.connector_name), ('source', args.source), ('version', getattr(args, 'version', None))) if value}
+        ctx._log_fields = fields
+    return fields
 
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
     def add_fields(self, log_record, record, message_dict):
@@ -8,32 +36,65 @@ class CustomJsonFormatter(jsonlogger.JsonFormatter):
         super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
 
         if not log_record.get('ibm_datetime'):
-            now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            log_record['ibm_datetime'] = now
-        
-        if not log_record.get('connector') and context().args.connector_name:
-            log_record['connector'] = context().args.connector_name
-        
-        if not log_record.get('source') and context().args.source:
-            log_record['source'] = context().args.source
-        
-        if not log_record.get('version') and context().args.version:
-            log_record['version'] = context().args.version
+            log_record['ibm_datetime'] = format_log_time(record.created)
+
+        # set by ContextQueueHandler, records are formatted by the listener thread which has no context
+        fields = getattr(record, 'car_fields', None)
+        if fields is None: fields = context_log_fields()
+        for name, value in fields.items():
+            if not log_record.get(name): log_record[name] = value
 
         # assign values to log_record
         log_record['level'] = log_record['level'].lower() if log_record.get('level') else record.levelname
         log_record['message'] = log_record['message'] if log_record.get('log') else record.message
         log_record['label'] = log_record['label'] if log_record.get('type') else record.name
 
-def create_logger(debug = False):
-    logger = logging.getLogger()
-    logger.setLevel(debug and logging.DEBUG or logging.INFO)
+# message arguments of these types are formatted by the listener thread
+deferred_arg_types = (str, int, float, type(None), LogBody)
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Puts log records on a queue written by a background QueueListener, with the log fields of the
+    context of the logging thread. String messages with immutable arguments and LogBody are formatted
+    by the listener, other ones (e.g. a logged dict the connector keeps changing) when logged.
+    """
+    def prepare(self, record):
+        record.car_fields = context_log_fields()
+        if record.exc_info or not isinstance(record.msg, str) or not isinstance(record.args, tuple) or \
+                not all(isinstance(arg, deferred_arg_types) for arg in record.args):
+            return super().prepare(record)
+        return record
 
+def create_stream_handler():
     handler = logging.StreamHandler()
-    handler.setLevel(debug and logging.DEBUG or logging.INFO)
     format_string = '%(ibm_datetime)s %(level)s %(label)s %(message)s'
-    formatter = CustomJsonFormatter(format_string)
-    handler.setFormatter(formatter)
+    handler.setFormatter(CustomJsonFormatter(format_string))
+    return handler
+
+# use_queue: records are written by a background thread, logging does not wait for the output stream
+def create_logger(debug = False, use_queue = False):
+    level = debug and logging.DEBUG or logging.INFO
+    logger = logging.getLogger()
+    logger.setLevel(level)
+
+    # every context (e.g. one per source) shares the handler
+    for handler in logger.handlers:
+        if getattr(handler, 'car_framework', False):
+            handler.setLevel(level)
+            return logger
+
+    if use_queue:
+        stream_handler = create_stream_handler()
+        stream_handler.setLevel(level)
+        handler = ContextQueueHandler(queue.SimpleQueue())
+        handler.listener = QueueListener(handler.queue, stream_handler)
+        handler.listener.start()
+        # writes the queued records on exit
+        atexit.register(handler.listener.stop)
+    else:
+        handler = create_stream_handler()
+    handler.car_framework = True
+    handler.setLevel(level)
     logger.addHandler(handler)
     return logger
 
@@ -49,20 +110,69 @@ def read_config(file_path, args):
 
 
 class Context(object):
-    def __init__(self, args):
+    """
+    Arguments and services of a connector run, returned by context().
+    thread_local: the context is used only by the current thread (see set_thread_context) instead of
+    becoming the global context, e.g. one context per source. communicator: CAR Communicator shared
+    with other contexts.
+    """
+    def __init__(self, args, communicator=None, thread_local=False):
         global global_context
-        global_context = self
+        if thread_local:
+            set_thread_context(self)
+        else:
+            global_context = self
 
         from car_framework.car_service import CarService
         from car_framework.communicator import Communicator
+        from car_framework.metrics import Metrics
         self.args = args
+        self.metrics = Metrics()
         if not args.connector_name:
             read_config('configurations/config.json', self.args)
-        self.logger = create_logger(args.debug)
-        self.car_service = CarService(Communicator())
+        self.logger = create_logger(args.debug, getattr(args, 'log_queue', False))
+        self.car_service = CarService(communicator or Communicator())
+        self._async_car_service = None
+        self.snapshot_store = None
+        # options added after the first releases are optional, args objects of connector tests may not have them
+        if getattr(args, 'snapshot_db', None):
+            from car_framework.snapshot import SnapshotStore
+            self.snapshot_store = SnapshotStore(args.snapshot_db)
+        # kept by all runs, batch sizes learned by a run are used by the next one
+        self.mutation_batcher = None
+        if getattr(args, 'adaptive_batching', False):
+            from car_framework.batcher import AdaptiveBatcher
+            self.mutation_batcher = AdaptiveBatcher(getattr(args, 'batch_target_bytes', 2000000), getattr(args, 'batch_target_latency', 5))
+        # import (full or incremental) currently running
+        self.importer = None
         self.report_time = datetime.utcnow().isoformat()
+
+    # Called at the start of every import run, in daemon mode one context is used by many runs
+    def start_run(self):
+        from car_framework.metrics import Metrics
+        self.metrics = Metrics()
+        self.importer = None
+        self.report_time = datetime.utcnow().isoformat()
+        # a source deleted in CAR since the previous run is created again
+        self.car_service.sources_created.clear()
+        if self._async_car_service: self._async_car_service.sources_created.clear()
+
+    # asyncio counterpart of car_service, created on first use as it requires aiohttp
+    @property
+    def async_car_service(self):
+        if self._async_car_service is None:
+            from car_framework.async_car_service import AsyncCarService
+            from car_framework.async_communicator import AsyncCommunicator
+            self._async_car_service = AsyncCarService(AsyncCommunicator())
+        return self._async_car_service
         
 
 global_context = None
+thread_context = threading.local()
+
 def context():
-    return global_context
+    return getattr(thread_context, 'context', None) or global_context
+
+# Makes context() return ctx in the current thread, None for the global context
+def set_thread_context(ctx):
+    thread_context.context = ctx
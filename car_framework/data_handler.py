@@ -1,19 +1,42 @@
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from datetime import datetime
+import gzip
+import hashlib
 import json
-import jsonpickle
 import os
+import queue
 import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
 import uuid
+import weakref
+from collections import OrderedDict
 
-from car_framework.context import context
+from car_framework.context import context, set_thread_context
 from car_framework.full_import import BaseFullImport
 
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
 
 class JsonField():
     def __init__(self, obj):
         self.obj = obj
 
 
+# json.dumps hook for mutation variables: JsonField values are sent as JSON, other values as strings
+def json_default(value):
+    if isinstance(value, JsonField): return value.obj
+    return str(value)
+
+
 class Mutation():
     def __init__(self, collection_name, data):
         self.collection_name = collection_name
@@ -23,20 +46,18 @@ class Mutation():
 
 
     def save(self, file_path):
-        data = jsonpickle.encode(self)
-        with open(file_path, 'w') as outfile:
-            outfile.write(data)
+        spill_format_for(file_path).write(self, file_path)
 
 
     @staticmethod
     def load(file_path):
-        with open(file_path, 'r') as inpfile:
-            data = inpfile.read()
-            mutation = jsonpickle.decode(data)
-            return mutation
+        return spill_format_for(file_path).read(file_path)
 
 
-    def serialize(self):
+    def serialize(self, use_variables=None):
+        if use_variables is None: use_variables = getattr(context().args, 'mutation_format', 'inline') == 'variables'
+        if use_variables: return self._serialize_as_variables()
+
         body = '''
             {
                 insert_%s(objects: [ %s ]) { affected_rows }
@@ -51,6 +72,12 @@ class Mutation():
         else: return {'query': query}
 
 
+    # All objects are sent in one typed variable, the query text does not depend on the data
+    def _serialize_as_variables(self):
+        query = 'mutation ($objects: [%s_insert_input!]!) { insert_%s(objects: $objects) { affected_rows } }' % (self.collection_name, self.collection_name)
+        return {'query': query, 'variables': {'objects': self.data}}
+
+
     def _serialize_object(self, obj):
         return '{%s}' % ', '.join(map(lambda item: self._serialize_field(item[0], item[1]), obj.items()))
 
@@ -68,6 +95,447 @@ class Mutation():
 
 
 
+class JsonPickleSpillFormat():
+    """ Legacy spill file format, the whole Mutation object encoded with jsonpickle. """
+    extension = '.json'
+
+    def write(self, mutation, file_path):
+        import jsonpickle
+        with open(file_path, 'w') as outfile:
+            outfile.write(jsonpickle.encode(mutation))
+
+    def read(self, file_path):
+        import jsonpickle
+        with open(file_path, 'r') as inpfile:
+            return jsonpickle.decode(inpfile.read())
+
+
+class NdjsonSpillFormat():
+    """
+    Newline delimited JSON spill file format. The first line holds the collection name,
+    every following line is one object. Records can be appended to an existing file and
+    are read back one at a time.
+    """
+    extension = '.ndjson'
+    json_field_marker = '__json_field__'
+
+    def open(self, file_path, mode):
+        return open(file_path, mode, encoding='utf-8')
+
+    def write(self, mutation, file_path):
+        with self.open(file_path, 'wt') as outfile:
+            outfile.write(json.dumps({'collection_name': mutation.collection_name}))
+            outfile.write('\n')
+            self.append(outfile, mutation.data)
+
+    def append(self, outfile, objects):
+        for obj in objects:
+            outfile.write(json.dumps(obj, default=self._encode_value))
+            outfile.write('\n')
+
+    def read(self, file_path):
+        records = self.iter_records(file_path)
+        header = next(records)
+        return Mutation(header['collection_name'], list(records))
+
+    def iter_records(self, file_path):
+        with self.open(file_path, 'rt') as inpfile:
+            yield json.loads(inpfile.readline())
+            for line in inpfile:
+                yield self._decode_object(json.loads(line))
+
+    def _encode_value(self, value):
+        if isinstance(value, JsonField): return {self.json_field_marker: value.obj}
+        return str(value)
+
+    def _decode_object(self, obj):
+        for name, value in obj.items():
+            if isinstance(value, dict) and self.json_field_marker in value:
+                obj[name] = JsonField(value[self.json_field_marker])
+        return obj
+
+
+class GzipNdjsonSpillFormat(NdjsonSpillFormat):
+    """ Gzip compressed newline delimited JSON spill file format. """
+    extension = '.ndjson.gz'
+
+    def open(self, file_path, mode):
+        return gzip.open(file_path, mode, encoding='utf-8', compresslevel=1)
+
+
+SPILL_FORMATS = {
+    'ndjson': NdjsonSpillFormat(),
+    'ndjson.gz': GzipNdjsonSpillFormat(),
+    'jsonpickle': JsonPickleSpillFormat(),
+}
+
+
+def spill_format_for(file_path):
+    # longest extension first, so that ".ndjson.gz" is not taken for ".gz"
+    for spill_format in sorted(SPILL_FORMATS.values(), key=lambda f: -len(f.extension)):
+        if file_path.endswith(spill_format.extension): return spill_format
+    raise ValueError('Unknown export_data file format: %s' % file_path)
+
+
+class MutationUploader():
+    """
+    Sends export_data files to CAR with up to `workers` concurrent requests while the total
+    size of the files being sent stays within `max_inflight_bytes` (0 for no limit).
+    `on_sent` is called with the path of each file acknowledged by CAR.
+    """
+    def __init__(self, importer, workers=1, max_inflight_bytes=0, on_sent=None):
+        self.importer = importer
+        self.on_sent = on_sent
+        self.workers = max(1, workers)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.inflight_bytes = 0
+        self.failed = False
+        self.condition = threading.Condition()
+
+    def send_files(self, files):
+        if self.workers == 1:
+            for file_path in files:
+                self._send_file(file_path)
+            return
+
+        ctx = context()
+
+        def send(file_path, size):
+            set_thread_context(ctx)
+            self._send_reserved_file(file_path, size)
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='car-upload') as executor:
+            for file_path in files:
+                size = os.path.getsize(file_path)
+                self._reserve(size)
+                if self.failed:
+                    self._release(size)
+                    break
+                futures.append(executor.submit(send, file_path, size))
+
+        # all submitted requests are finished here; report the failure of the earliest file
+        for future in futures:
+            future.result()
+
+    def _send_file(self, file_path):
+        self.importer.send_mutation(load_export_data_file(file_path))
+        if self.on_sent: self.on_sent(file_path)
+
+    def _send_reserved_file(self, file_path, size):
+        try:
+            self._send_file(file_path)
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            self._release(size)
+
+    def _reserve(self, size):
+        with self.condition:
+            # a single file larger than the budget is still sent, alone
+            while self.max_inflight_bytes and self.inflight_bytes > 0 and self.inflight_bytes + size > self.max_inflight_bytes:
+                self.condition.wait()
+            self.inflight_bytes += size
+
+    def _release(self, size):
+        with self.condition:
+            self.inflight_bytes -= size
+            self.condition.notify_all()
+
+
+class StreamingUploader():
+    """
+    Sends pages to CAR from background threads while the connector is still adding data.
+    The queue holds at most `queue_size` pages; when it is full the page is not accepted
+    and the caller spills it to disk to be sent later.
+    """
+    def __init__(self, importer, workers=1, queue_size=4):
+        self.importer = importer
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.errors = []
+        self.discarded = False
+        # the pages are sent with the context of the data handler, e.g. of its source
+        self.context = context()
+        self.threads = [threading.Thread(target=self._run, name='car-stream-upload-%d' % i, daemon=True) for i in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    # Returns False if the page has to be spilled to disk
+    def offer(self, mutation):
+        self.check_for_error()
+        try:
+            self.queue.put_nowait(mutation)
+            return True
+        except queue.Full:
+            return False
+
+    # Waits until all accepted pages are sent
+    def join(self):
+        self.queue.join()
+        self.check_for_error()
+
+    # discard: the pages not sent yet are dropped, e.g. when the import failed
+    def close(self, discard=False):
+        if discard:
+            self.discarded = True
+            while True:
+                try: self.queue.get_nowait()
+                except queue.Empty: break
+                self.queue.task_done()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def check_for_error(self):
+        if self.errors: raise self.errors[0]
+
+    def _run(self):
+        set_thread_context(self.context)
+        while True:
+            mutation = self.queue.get()
+            try:
+                if mutation is None: return
+                # after a failure the remaining pages are dropped, the import fails anyway
+                if not self.errors and not self.discarded: self.importer.send_mutation(mutation)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+
+# Approximate memory used by a vertex or edge object
+def estimate_size(value):
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, JsonField):
+        return sys.getsizeof(value) + estimate_size(value.obj)
+    return sys.getsizeof(value)
+
+
+# field missing in some edges of an EdgeBuffer
+MISSING = object()
+
+
+class StrColumn():
+    """
+    Column of an EdgeBuffer whose values are all strings, stored UTF-8 encoded in one bytearray with
+    the end offset of each value, instead of one str object per value. The offsets take 4 bytes
+    until the data exceeds 4 GB.
+    """
+    __slots__ = ('data', 'ends')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array('I')
+
+    # Returns the memory used by the value in the column
+    def append(self, value):
+        encoded = value.encode('utf-8', 'surrogatepass')
+        data = self.data
+        data += encoded
+        end = len(data)
+        if end > 0xFFFFFFFF and self.ends.typecode == 'I': self.ends = array('Q', self.ends)
+        self.ends.append(end)
+        return self.ends.itemsize + len(encoded)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, index):
+        ends = self.ends
+        if index < 0: index += len(ends)
+        if not 0 <= index < len(ends): raise IndexError('StrColumn index out of range')
+        return self.data[ends[index - 1] if index else 0:ends[index]].decode('utf-8', 'surrogatepass')
+
+    def __iter__(self):
+        data = self.data
+        text = data.decode('utf-8', 'surrogatepass')
+        # ASCII only, the byte offsets are offsets in the text
+        if len(text) != len(data): text = None
+        start = 0
+        for end in self.ends:
+            yield text[start:end] if text is not None else data[start:end].decode('utf-8', 'surrogatepass')
+            start = end
+
+    def to_list(self):
+        return list(self)
+
+
+class EdgeBuffer():
+    """
+    Edges of a collection not yet flushed to a page, stored as one column of values per field instead
+    of one dict per edge. Columns of strings (the external ids) are StrColumns, other columns are lists.
+    `defaults` (source and reported_at) are stored once and added to the edges when they are read, as dicts.
+    """
+    __slots__ = ('defaults', 'fields', 'columns', 'count', 'sparse')
+
+    def __init__(self, defaults):
+        self.defaults = defaults
+        # field name -> index in columns
+        self.fields = {}
+        self.columns = []
+        self.count = 0
+        # some edges do not have all fields
+        self.sparse = False
+
+    # Returns the estimated memory used by the edge in the buffer
+    def append(self, edge):
+        size = 0
+        fields = self.fields
+        columns = self.columns
+        for name, value in edge.items():
+            index = fields.get(name)
+            if index is None:
+                index = fields[name] = len(columns)
+                if self.count: self.sparse = True
+                columns.append(StrColumn() if not self.count and type(value) is str else [MISSING] * self.count)
+            column = columns[index]
+            if type(column) is StrColumn:
+                if type(value) is str:
+                    size += column.append(value)
+                    continue
+                column = columns[index] = column.to_list()
+            column.append(value)
+            size += 8 + sys.getsizeof(value)
+        self.count += 1
+        if len(edge) < len(columns):
+            self.sparse = True
+            for index, column in enumerate(columns):
+                if len(column) < self.count:
+                    if type(column) is StrColumn: column = columns[index] = column.to_list()
+                    column.append(MISSING)
+        return size
+
+    def _edge(self, values):
+        if self.sparse: edge = {name: value for name, value in zip(self.fields, values) if value is not MISSING}
+        else: edge = dict(zip(self.fields, values))
+        edge.update(self.defaults)
+        return edge
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice): return [self._edge(values) for values in list(zip(*self.columns))[index]]
+        return self._edge([column[index] for column in self.columns])
+
+    def __iter__(self):
+        return (self._edge(values) for values in zip(*self.columns))
+
+    def to_list(self):
+        return list(self)
+
+
+def peak_process_memory():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_export_data_file(file_path):
+    with context().metrics.timer('spill_read_seconds'):
+        return Mutation.load(file_path)
+
+
+class KeyIndex():
+    """ Set of the keys already added to a collection, used for O(1) deduplication. """
+    def __init__(self):
+        self.keys = set()
+
+    # Returns True if the key was not in the index yet
+    def add(self, key):
+        if key in self.keys: return False
+        self.keys.add(key)
+        return True
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def close(self):
+        pass
+
+
+class FingerprintKeyIndex(KeyIndex):
+    """ Keeps 64 bit fingerprints of the keys instead of the keys, for sources with millions of rows. """
+    def add(self, key):
+        return super().add(fingerprint(key))
+
+    def __contains__(self, key):
+        return super().__contains__(fingerprint(key))
+
+
+def fingerprint(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class SqliteKeyIndex():
+    """
+    Keeps the keys in a temporary SQLite file in export_data dir, for sources whose keys do not fit in
+    memory. The last `cache_size` keys added or found are kept in memory as well.
+    """
+    def __init__(self, cache_size=None):
+        self.cache_size = getattr(context().args, 'dedup_index_cache_size', 100000) if cache_size is None else cache_size
+        self.cache = OrderedDict()
+        self.count = 0
+        os.makedirs(context().args.export_data_dir, exist_ok=True)
+        fd, self.file_path = tempfile.mkstemp(suffix='.keys.sqlite', dir=context().args.export_data_dir)
+        os.close(fd)
+        self.connection = sqlite3.connect(self.file_path, check_same_thread=False)
+        # the file is only a spill of the index, it is not needed after a crash
+        self.connection.executescript('''
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA cache_size = -8192;
+            CREATE TABLE keys (key TEXT PRIMARY KEY) WITHOUT ROWID;
+        ''')
+        self._finalizer = weakref.finalize(self, SqliteKeyIndex._remove, self.connection, self.file_path)
+
+    @staticmethod
+    def _remove(connection, file_path):
+        connection.close()
+        if os.path.exists(file_path): os.remove(file_path)
+
+    def close(self):
+        self._finalizer()
+
+    def _cache(self, key):
+        self.cache[key] = None
+        if len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+
+    def add(self, key):
+        key = str(key)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return False
+        added = self.connection.execute('INSERT OR IGNORE INTO keys VALUES (?)', (key,)).rowcount == 1
+        if added: self.count += 1
+        self._cache(key)
+        return added
+
+    def __contains__(self, key):
+        key = str(key)
+        if key in self.cache: return True
+        return self.connection.execute('SELECT 1 FROM keys WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self.count
+
+
+KEY_INDEX_TYPES = {
+    'memory': KeyIndex,
+    'fingerprint': FingerprintKeyIndex,
+    'sqlite': SqliteKeyIndex,
+}
+
+
 class BaseDataHandler():
 
     source = None
@@ -78,72 +546,253 @@ class BaseDataHandler():
     edges = {}
     edge_keys = {}
 
-    def __init__(self):
+    def __init__(self, importer=None):
+        # -export-data-memory-bytes accounting: (edges, name) -> estimated bytes of the page in memory
+        self.memory_budget = getattr(context().args, 'export_data_memory_bytes', 0)
+        # streaming upload, see _flush_page
+        self.importer = importer
+        self.uploader = None
+        self.reset()
+
+    # Drops the data and the dedup keys of a run. Called when the edges are sent or the import failed,
+    # so that a data handler kept by the importer (e.g. created in its __init__) can be used by the
+    # next run in daemon mode.
+    def reset(self):
         self.export_data_dir = os.path.join(context().args.export_data_dir, datetime.now().strftime('%Y-%m-%d_%H:%M:%S_r%f'))
+        self.collections = {}
+        self.collection_keys = {}
+        self.edges = {}
+        self.edge_keys = {}
+        self.page_bytes = {}
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+        self.vertices_sent = False
+
+    def _create_key_index(self):
+        return KEY_INDEX_TYPES[getattr(context().args, 'dedup_index', 'memory')]()
 
     # Adds the collection data
     def add_item_to_collection(self, name, object):
         objects = self.collections.get(name)
-        if not objects:
+        if objects is None:
             objects = []
             self.collections[name] = objects
 
         keys = self.collection_keys.get(name)
-        if not keys:
-            keys = []
+        if keys is None:
+            keys = self._create_key_index()
             self.collection_keys[name] = keys
+            self._register()
 
-        if not object['external_id'] in self.collection_keys[name]:
+        if keys.add(object['external_id']):
             objects.append(object)
-            self.collection_keys[name].append(object['external_id'])
+            if self.memory_budget:
+                self._account(name, estimate_size(object))
+                return
 
         # dump collection to file to free memory
-        if len(self.collections[name]) >= context().args.export_data_page_size:
-            self._save_export_data_file(name, self.collections[name])
+        if not self.memory_budget and len(self.collections[name]) >= context().args.export_data_page_size:
+            self._flush_page(name, self.collections[name])
             self.collections[name] = []
 
     # Adds the edge between two vertices
 
     def add_edge(self, name, object):
         objects = self.edges.get(name)
-        if not objects:
-            objects = []
+        if objects is None:
+            objects = self._create_edge_buffer()
             self.edges[name] = objects
 
         keys = self.edge_keys.get(name)
-        if not keys:
-            keys = []
+        if keys is None:
+            keys = self._create_key_index()
             self.edge_keys[name] = keys
+            self._register()
 
         key = '#'.join(str(x) for x in object.values())
-        if not key in self.edge_keys[name]:
-            object['source'] = context().args.source
-            object['reported_at'] = context().report_time
-            objects.append(object)
-            self.edge_keys[name].append(key)
+        if keys.add(key):
+            size = objects.append(object)
+            if self.memory_budget:
+                self._account(name, size, edges=True)
+                return
 
         # dump edges to file to free memory
-        if len(self.edges[name]) >= context().args.export_data_page_size:
-            self._save_export_data_file(name, self.edges[name])
-            self.edges[name] = []
+        if not self.memory_budget and len(self.edges[name]) >= context().args.export_data_page_size:
+            self._flush_page(name, self.edges[name], edges=True)
+            self.edges[name] = self._create_edge_buffer()
+
+    def _create_edge_buffer(self):
+        return EdgeBuffer({'source': context().args.source, 'reported_at': context().report_time})
+
+    # With -export-data-memory-bytes pages are flushed when they reach -export-data-page-bytes,
+    # or, largest first, when all pages in memory together exceed the budget
+    def _account(self, name, size, edges=False):
+        key = (edges, name)
+        self.page_bytes[key] = self.page_bytes.get(key, 0) + size
+        self.buffered_bytes += size
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+        if self.page_bytes[key] >= getattr(context().args, 'export_data_page_bytes', 4000000):
+            self._flush_buffer(key)
+        while self.buffered_bytes > self.memory_budget:
+            self._flush_buffer(max(self.page_bytes, key=self.page_bytes.get))
+
+    def _flush_buffer(self, key):
+        edges, name = key
+        buffers = self.edges if edges else self.collections
+        self._flush_page(name, buffers[name], edges)
+        buffers[name] = self._create_edge_buffer() if edges else []
+        self.buffered_bytes -= self.page_bytes.pop(key)
+
+    def _release_buffers(self, edges):
+        for key in [key for key in self.page_bytes if key[0] == edges]:
+            self.buffered_bytes -= self.page_bytes.pop(key)
+
+    def _report_memory(self):
+        metrics = context().metrics
+        peak = peak_process_memory()
+        if peak: metrics.set_max('process_peak_memory_bytes', peak)
+        if self.memory_budget:
+            metrics.set_max('buffered_bytes_peak', self.peak_buffered_bytes)
+            context().logger.info('Peak memory: %s bytes, data buffered: %d bytes (estimated, budget %d bytes)', peak, self.peak_buffered_bytes, self.memory_budget)
+        else:
+            context().logger.info('Peak memory: %s bytes', peak)
 
     def send_collections(self, importer):
         context().logger.info('Creating vertices')
-        for name, data in self.collections.items():
-            # save residual data
-            if len(data) > 0:
-                self._save_export_data_file(name, data)
-            self._send(name, importer)
+        with context().metrics.phase('send_collections'):
+            for name, data in self.collections.items():
+                # save residual data
+                if len(data) > 0:
+                    self._flush_page(name, data)
+            self._release_buffers(edges=False)
+            self._join_uploader()
+            self._send(self.collections.keys(), importer, 'vertices')
+        self.vertices_sent = True
+        self._record_counts('vertices', self.collection_keys)
         context().logger.info('Creating vertices: done %s', {key: len(value) for key, value in self.collection_keys.items()})
 
     def send_edges(self, importer):
         context().logger.info('Creating edges')
-        for name, data in self.edges.items():
-            # save residual data
-            if len(data) > 0:
-                self._save_export_data_file(name, data)
-            self._send(name, importer)
+        with context().metrics.phase('send_edges'):
+            try:
+                for name, data in self.edges.items():
+                    # save residual data
+                    if len(data) > 0:
+                        self._flush_page(name, data, edges=True)
+                self._release_buffers(edges=True)
+                self._join_uploader()
+                self._send(self.edges.keys(), importer, 'edges')
+            finally:
+                self._close_uploader()
+        self._record_counts('edges', self.edge_keys)
+        self._report_memory()
+        self._close_key_indexes()
+        context().logger.info('Creating edges done: %s', {key: len(value) for key, value in self.edge_keys.items()})
+        self.reset()
+
+    # The data of the import was sent or the import failed
+    def _close_key_indexes(self):
+        for keys in list(self.collection_keys.values()) + list(self.edge_keys.values()):
+            keys.close()
+
+    def _record_counts(self, kind, keys):
+        for name, value in keys.items():
+            context().metrics.set('%s_total' % kind, len(value), collection=name)
+
+    # Run manifest of a resumable full import, see RunManifest
+    def _get_manifest(self, importer=None):
+        return getattr(importer or self.importer or context().importer, 'manifest', None)
+
+    # With -streaming-upload full pages are handed to a background uploader right away, and spilled
+    # to disk only when its queue is full. Edges are streamed only after all vertices have been sent.
+    # A resumable full import always spills, and drops the data of a stage resumed from the manifest.
+    def _flush_page(self, name, data, edges=False):
+        manifest = self._get_manifest()
+        if manifest and manifest.is_resumed('edges' if edges else 'vertices'): return
+        if isinstance(data, EdgeBuffer): data = data.to_list()
+        data = self._filter_page(name, data, edges)
+        if not data: return
+        uploader = self._get_uploader() if not manifest and (not edges or self.vertices_sent) else None
+        if uploader:
+            try:
+                if uploader.offer(Mutation(name, data)):
+                    context().metrics.inc('streamed_pages_total', collection=name)
+                    return
+            except Exception:
+                self._close_uploader()
+                raise
+        self._save_export_data_file(name, data)
+
+    def _filter_page(self, name, data, edges=False):
+        page_filter = getattr(self.importer or context().importer, 'filter_edges' if edges else 'filter_vertices', None)
+        return page_filter(name, data) if page_filter else data
+
+    def _get_uploader(self):
+        if self.uploader is None and getattr(context().args, 'streaming_upload', False):
+            importer = self.importer or context().importer
+            if importer:
+                self.uploader = StreamingUploader(importer, getattr(context().args, 'upload_workers', 1), getattr(context().args, 'streaming_queue_size', 4))
+        return self.uploader
+
+    # The import closes the data handler if it fails
+    def _register(self):
+        add_data_handler = getattr(self.importer or context().importer, 'add_data_handler', None)
+        if add_data_handler: add_data_handler(self)
+
+    def _join_uploader(self):
+        if self.uploader:
+            try:
+                self.uploader.join()
+            except Exception:
+                self._close_uploader()
+                raise
+
+    def _close_uploader(self, discard=False):
+        if self.uploader:
+            self.uploader.close(discard)
+            self.uploader = None
+
+    # Stops the background upload without sending the pages not sent yet, called when the import failed
+    def close(self):
+        self._close_uploader(discard=True)
+        self._close_key_indexes()
+        self.reset()
+
+    # asyncio variants of send_collections and send_edges, mutations are sent with importer.send_mutation_async.
+    # The files are not recorded in the run manifest and the AdaptiveBatcher is not used.
+    async def send_collections_async(self, importer):
+        context().logger.info('Creating vertices')
+        with context().metrics.phase('send_collections'):
+            for name, data in self.collections.items():
+                data = self._filter_page(name, data)
+                if len(data) > 0:
+                    self._save_export_data_file(name, data)
+            self._release_buffers(edges=False)
+            # pages streamed while collecting are sent by the uploader threads
+            await asyncio.get_running_loop().run_in_executor(None, self._join_uploader)
+            await self._send_async(self.collections.keys(), importer)
+        self.vertices_sent = True
+        self._record_counts('vertices', self.collection_keys)
+        context().logger.info('Creating vertices: done %s', {key: len(value) for key, value in self.collection_keys.items()})
+
+    async def send_edges_async(self, importer):
+        context().logger.info('Creating edges')
+        with context().metrics.phase('send_edges'):
+            try:
+                for name, data in self.edges.items():
+                    data = self._filter_page(name, data.to_list(), edges=True)
+                    if len(data) > 0:
+                        self._save_export_data_file(name, data)
+                self._release_buffers(edges=True)
+                await asyncio.get_running_loop().run_in_executor(None, self._join_uploader)
+                await self._send_async(self.edges.keys(), importer)
+            finally:
+                self._close_uploader()
+        self._record_counts('edges', self.edge_keys)
+        self._report_memory()
+        self._close_key_indexes()
         context().logger.info('Creating edges done: %s', {key: len(value) for key, value in self.edge_keys.items()})
+        self.reset()
 
     def _create_export_data_dir(self, name):
         dir_path = os.path.join(self.export_data_dir, name)
@@ -160,21 +809,55 @@ class BaseDataHandler():
 
     def _save_export_data_file(self, name, data):
         dir_path = self._create_export_data_dir(name)
-        filename = os.path.join(dir_path, '%s.json' % str(uuid.uuid4())[0:8])
-        mutation = Mutation(name, data)
-        mutation.save(filename)
+        spill_format = SPILL_FORMATS[getattr(context().args, 'export_data_format', 'ndjson')]
+        filename = os.path.join(dir_path, '%s%s' % (str(uuid.uuid4())[0:8], spill_format.extension))
+        with context().metrics.timer('spill_write_seconds'):
+            spill_format.write(Mutation(name, data), filename)
+        context().metrics.inc('spill_files_total', collection=name)
         return filename
 
-    def _send(self, name, importer):
-        dir_path = os.path.join(self.export_data_dir, name)
-        for _, _, files in os.walk(dir_path):
-            for data_file in files:
-                mutation = Mutation.load(os.path.join(dir_path, data_file))
-                importer.send_mutation(mutation)
-        self._delete_export_data_dir(dir_path)
+    # Sends all export_data files of the given collections, requests for different collections can run concurrently
+    def _send(self, names, importer, stage=None):
+        dir_paths, files = self._export_data_files(names)
+        manifest = self._get_manifest(importer)
+        if manifest and stage:
+            # the files are deleted when the full import is completed
+            if not manifest.is_resumed(stage): manifest.add_files(stage, files)
+            manifest.send_files(stage, importer)
+            return
+
+        uploader = MutationUploader(importer, getattr(context().args, 'upload_workers', 1), getattr(context().args, 'upload_max_inflight_bytes', 0))
+        uploader.send_files(files)
+
+        for dir_path in dir_paths:
+            self._delete_export_data_dir(dir_path)
+
+    async def _send_async(self, names, importer):
+        dir_paths, files = self._export_data_files(names)
+        semaphore = asyncio.Semaphore(max(1, getattr(context().args, 'upload_workers', 1)))
+
+        async def send(file_path):
+            async with semaphore:
+                await importer.send_mutation_async(load_export_data_file(file_path))
+
+        results = await asyncio.gather(*[send(file_path) for file_path in files], return_exceptions=True)
+        # report the failure of the earliest file, like MutationUploader does
+        for result in results:
+            if isinstance(result, BaseException): raise result
+
+        for dir_path in dir_paths:
+            self._delete_export_data_dir(dir_path)
+
+    def _export_data_files(self, names):
+        dir_paths = [os.path.join(self.export_data_dir, name) for name in names]
+        files = []
+        for dir_path in dir_paths:
+            if os.path.exists(dir_path):
+                files.extend(os.path.join(dir_path, data_file) for data_file in sorted(os.listdir(dir_path)))
+        return dir_paths, files
 
     def printData(self):
         context().logger.debug("Vertexes to be created:")
         context().logger.debug(self.collections)
         context().logger.debug("Edges to be created:")
-        context().logger.debug(self.edges)
+        context().logger.debug({name: data.to_list() for name, data in self.edges.items()})
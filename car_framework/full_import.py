@@ -1,10 +1,14 @@
 from car_framework.base_import import BaseImport
 from car_framework.context import context
+from car_framework.run_manifest import RunManifest
+from car_framework.util import UnrecoverableFailure
 
 
 class BaseFullImport(BaseImport):
     def __init__(self):
         super().__init__()
+        # run manifest with -resumable-full-import
+        self.manifest = None
 
 
     def import_vertices(self):
@@ -19,20 +23,76 @@ class BaseFullImport(BaseImport):
         raise NotImplementedError()
 
 
+    # Vertices and edges are recorded in the snapshot store, if there is one, as sent
+    def filter_vertices(self, collection, objects):
+        if context().snapshot_store: context().snapshot_store.record_vertices(collection, objects)
+        return objects
+
+
+    def filter_edges(self, collection, objects):
+        if context().snapshot_store: context().snapshot_store.record_edges(collection, objects)
+        return objects
+
+
     def init(self):
         context().car_service.create_source_if_needed()
+        if context().snapshot_store: context().snapshot_store.begin()
+        self.manifest = RunManifest.load() if getattr(context().args, 'resumable_full_import', False) else None
+        if self.manifest:
+            # continue the unfinished run, CAR is already prepared for its report_time
+            context().logger.info('Resuming full import with report time %s' % self.manifest.report_time)
+            context().report_time = self.manifest.report_time
+            self.new_model_state_id = self.manifest.new_model_state_id
+            return
+
         context().car_service.prepare_full_import(context().report_time)
         self.new_model_state_id = self.get_new_model_state_id()
+        if getattr(context().args, 'resumable_full_import', False):
+            self.manifest = RunManifest.create(context().report_time, self.new_model_state_id)
 
 
     def complete(self):
         context().car_service.complete_full_import()
+        store = context().snapshot_store
+        if store:
+            # data of the stages resumed from the manifest was not recorded
+            if self.manifest and self.manifest.resumed_stages: store.reset()
+            store.commit()
         self.save_new_model_state_id(self.new_model_state_id)
+        if self.manifest:
+            self.manifest.remove()
+            self.manifest = None
         context().logger.info('Done.')
 
 
     def run(self):
-        self.init()
-        self.import_vertices()
-        self.import_edges()
-        self.complete()
+        try:
+            self._run()
+        except BaseException as e:
+            self.close_data_handlers()
+            # resuming would send the same data again, the next run starts over
+            if isinstance(e, UnrecoverableFailure) and self.manifest:
+                context().logger.info('Discarding full import manifest %s' % self.manifest.file_path)
+                self.manifest.remove()
+                self.manifest = None
+            raise
+        self.data_handlers = []
+
+
+    def _run(self):
+        context().importer = self
+        metrics = context().metrics
+        with metrics.phase('init', run='full'):
+            self.init()
+        if self.manifest and self.manifest.is_resumed('edges'):
+            # all data was spilled before the previous run failed, the datasource is not read again
+            with metrics.phase('resume', run='full'):
+                self.manifest.send_files('vertices', self)
+                self.manifest.send_files('edges', self)
+        else:
+            with metrics.phase('import_vertices', run='full'):
+                self.import_vertices()
+            with metrics.phase('import_edges', run='full'):
+                self.import_edges()
+        with metrics.phase('complete', run='full'):
+            self.complete()
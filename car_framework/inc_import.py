@@ -1,5 +1,8 @@
+import time
+
 from car_framework.base_import import BaseImport
 from car_framework.context import context
+from car_framework.data_handler import BaseDataHandler
 from car_framework.util import IncrementalImportNotPossible
 
 
@@ -7,6 +10,8 @@ class BaseIncrementalImport(BaseImport):
     def __init__(self):
         super().__init__()
         self.updated_vertices = {}
+        # ids of the vertices skipped by -skip-unchanged, per collection
+        self.unchanged_vertices = {}
 
 
     def get_new_model_state_id(self):
@@ -34,21 +39,66 @@ class BaseIncrementalImport(BaseImport):
 
 
     def add_updated_vertex(self, collection, id):
+        # dict is used as an insertion ordered set of ids
         ids = self.updated_vertices.get(collection)
         if ids == None:
-            ids = []
+            ids = {}
             self.updated_vertices[collection] = ids
-        ids.append(id)
+        ids[id] = None
+
+
+    # True when the vertices and edges are recorded in the snapshot store
+    def uses_snapshot(self):
+        return bool(context().snapshot_store) and getattr(context().args, 'skip_unchanged', False)
+
+
+    def commit_snapshot(self):
+        context().snapshot_store.commit(complete=False)
+
+
+    # With -skip-unchanged, vertices identical to the ones sent before are not sent again
+    def filter_vertices(self, collection, objects):
+        if not self.uses_snapshot(): return objects
+        changed = context().snapshot_store.record_vertices(collection, objects)
+        if len(changed) < len(objects):
+            changed_ids = set(id(obj) for obj in changed)
+            unchanged = self.unchanged_vertices.setdefault(collection, set())
+            unchanged.update(str(obj['external_id']) for obj in objects if id(obj) not in changed_ids)
+            context().metrics.inc('unchanged_vertices_skipped_total', len(objects) - len(changed), collection=collection)
+        return changed
+
+
+    def filter_edges(self, collection, objects):
+        if self.uses_snapshot(): context().snapshot_store.record_edges(collection, objects)
+        return objects
 
 
     def limit_edges_of_updated_vertices_to_current_report(self):
-        for collection in self.updated_vertices.keys():
+        items = []
+        for collection, ids in self.updated_vertices.items():
             edge_collections = self.get_owned_edges(collection)
-            if edge_collections:
-                context().car_service.limit_edges_to_report(context().args.source, collection, edge_collections, self.updated_vertices[collection], context().report_time)
+            if edge_collections and ids:
+                unchanged = self.unchanged_vertices.get(collection)
+                if unchanged:
+                    # edges of skipped vertices are limited only if they changed
+                    changed = set(context().snapshot_store.changed_edge_vertices(collection, edge_collections))
+                    ids = [id for id in ids if str(id) not in unchanged or str(id) in changed]
+                    if not ids: continue
+                items.append((collection, edge_collections, list(ids)))
+        context().car_service.limit_edges_to_report_batch(context().args.source, items, context().report_time)
 
 
     def run(self):
+        try:
+            self._run()
+        except BaseException:
+            self.close_data_handlers()
+            raise
+        self.data_handlers = []
+
+
+    def _run(self):
+        context().importer = self
         context().car_service.create_source_if_needed()
         last_model_state_id = self.get_last_model_state_id()
         if not last_model_state_id:
@@ -62,12 +112,109 @@ class BaseIncrementalImport(BaseImport):
             context().logger.info('The source model has not changed.')
             return
 
-        context().car_service.prepare_incremental_import(context().report_time)
-        self.get_data_for_delta(last_model_state_id, new_model_state_id)
-        self.import_vertices()
-        self.import_edges()
-        self.limit_edges_of_updated_vertices_to_current_report()
-        self.delete_vertices()
-        context().car_service.complete_incremental_import()
-
+        metrics = context().metrics
+        with metrics.phase('init', run='incremental'):
+            context().car_service.prepare_incremental_import(context().report_time)
+            self.updated_vertices = {}
+            self.unchanged_vertices = {}
+            if self.uses_snapshot(): context().snapshot_store.begin()
+        with metrics.phase('get_data_for_delta', run='incremental'):
+            self.get_data_for_delta(last_model_state_id, new_model_state_id)
+        with metrics.phase('import_vertices', run='incremental'):
+            self.import_vertices()
+        with metrics.phase('import_edges', run='incremental'):
+            self.import_edges()
+        with metrics.phase('limit_edges', run='incremental'):
+            self.limit_edges_of_updated_vertices_to_current_report()
+        with metrics.phase('delete_vertices', run='incremental'):
+            self.delete_vertices()
+        with metrics.phase('complete', run='incremental'):
+            context().car_service.complete_incremental_import()
+
+        if self.uses_snapshot(): self.commit_snapshot()
         self.save_new_model_state_id(new_model_state_id)
+
+
+class SnapshotIncrementalImport(BaseIncrementalImport):
+    """
+    Incremental import for datasources without a change feed, requires -snapshot-db.
+
+    get_data reads all data of the datasource into self.data_handler. New and changed vertices are
+    sent and marked as updated, vertices not read anymore are deleted, based on the snapshot of the
+    data sent by the previous run. All edges are sent; vertices whose edges changed are marked as
+    updated, so that their edges not reported anymore are removed.
+    """
+    def __init__(self):
+        super().__init__()
+        self.data_handler = None
+
+
+    # Reads all vertices and edges of the datasource and adds them to self.data_handler
+    def get_data(self):
+        raise NotImplementedError()
+
+
+    def get_new_model_state_id(self):
+        return str(int(time.time() * 1000))
+
+
+    def get_last_model_state_id(self):
+        store = context().snapshot_store
+        if not store:
+            raise IncrementalImportNotPossible('Snapshot store is not configured (-snapshot-db).')
+        if store.last_generation() is None:
+            raise IncrementalImportNotPossible('Snapshot of the source is not available.')
+        return super().get_last_model_state_id()
+
+
+    def filter_vertices(self, collection, objects):
+        changed = context().snapshot_store.record_vertices(collection, objects)
+        for obj in changed:
+            self.add_updated_vertex(collection, obj['external_id'])
+        return changed
+
+
+    def filter_edges(self, collection, objects):
+        context().snapshot_store.record_edges(collection, objects)
+        return objects
+
+
+    def uses_snapshot(self):
+        return True
+
+
+    def commit_snapshot(self):
+        context().snapshot_store.commit()
+
+
+    def get_data_for_delta(self, last_model_state_id, new_model_state_id):
+        self.data_handler = BaseDataHandler(self)
+        self.get_data()
+
+
+    def import_vertices(self):
+        self.data_handler.send_collections(self)
+
+
+    def import_edges(self):
+        self.data_handler.send_edges(self)
+
+
+    def limit_edges_of_updated_vertices_to_current_report(self):
+        store = context().snapshot_store
+        for collection in store.collections():
+            edge_collections = self.get_owned_edges(collection)
+            if edge_collections:
+                for id in store.changed_edge_vertices(collection, edge_collections):
+                    self.add_updated_vertex(collection, id)
+        super().limit_edges_of_updated_vertices_to_current_report()
+
+
+    def delete_vertices(self):
+        store = context().snapshot_store
+        for collection in store.collections():
+            ids = store.deleted_vertices(collection)
+            if ids:
+                context().logger.info('Deleting %d vertices of %s' % (len(ids), collection))
+                context().car_service.delete_vertices(collection, ids)
+
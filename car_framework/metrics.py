@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+from car_framework.util import write_file_atomic
+
+METRIC_PREFIX = 'car_connector_'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound: self.bucket_counts[i] += 1
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'min': self.min, 'max': self.max,
+                'avg': round(self.sum / self.count, 6) if self.count else None}
+
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms of an import run, keyed by name and labels.
+    Reported as a JSON summary and optionally as a Prometheus text file.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def set_max(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = max(self.gauges.get(key, value), value)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # Observes the duration of the block in seconds
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def phase(self, phase, **labels):
+        return self.timer('phase_duration_seconds', phase=phase, **labels)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'counters': [dict(labels, name=name, value=value) for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [dict(labels, name=name, value=value) for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [dict(labels, name=name, **histogram.summary()) for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def prometheus_text(self, const_labels=None):
+        const_labels = tuple(sorted((const_labels or {}).items()))
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append('# TYPE %s%s %s' % (METRIC_PREFIX, name, kind))
+                    for (metric_name, labels), value in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append('%s%s%s %s' % (METRIC_PREFIX, name, format_labels(const_labels + labels), value))
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append('# TYPE %s%s histogram' % (METRIC_PREFIX, name))
+                for (metric_name, labels), histogram in sorted(self.histograms.items()):
+                    if metric_name != name: continue
+                    labels = const_labels + labels
+                    for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                        lines.append('%s%s_bucket%s %d' % (METRIC_PREFIX, name, format_labels(labels + (('le', bound),)), count))
+                    lines.append('%s%s_bucket%s %d' % (METRIC_PREFIX, name, format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                    lines.append('%s%s_sum%s %s' % (METRIC_PREFIX, name, format_labels(labels), histogram.sum))
+                    lines.append('%s%s_count%s %d' % (METRIC_PREFIX, name, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file_path, const_labels=None):
+        write_file_atomic(file_path, self.prometheus_text(const_labels))
+
+    def write_json(self, file_path):
+        write_file_atomic(file_path, json.dumps(self.summary(), indent=2))
+
+
+def format_labels(labels):
+    if not labels: return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
@@ -0,0 +1,134 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from car_framework.context import context
+from car_framework.util import write_file_atomic
+
+STAGES = ('vertices', 'edges')
+# options of the run recorded in the manifest, a run with other values does not resume it
+MANIFEST_ARGS = ('connector_name', 'version', 'car_service_apikey_url', 'car_service_token_url')
+
+
+def manifest_args():
+    return {name: getattr(context().args, name, None) for name in MANIFEST_ARGS}
+
+
+class RunManifest():
+    """
+    Progress of a full import run with -resumable-full-import, kept in export_data_dir.
+
+    The manifest records the report_time and new model state id of the run and, once all data of a
+    stage (vertices, edges) is spilled, the export_data files of the stage. Files acknowledged by
+    CAR are appended to a separate log, so that a rerun sends only the files which are left.
+    A manifest older than -resumable-full-import-max-age or written with other connector or CAR
+    options (MANIFEST_ARGS) is discarded with its files.
+    """
+    def __init__(self, file_path, data):
+        self.file_path = file_path
+        self.sent_log_path = file_path + '.sent'
+        self.data = data
+        self.sent = set()
+        # stages all data of which was spilled by the run being resumed
+        self.resumed_stages = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def path():
+        source = re.sub(r'[^\w.-]', '_', context().args.source)
+        return os.path.join(context().args.export_data_dir, 'full_import_%s.manifest.json' % source)
+
+    # Returns the manifest of an unfinished run of the source, or None
+    @staticmethod
+    def load():
+        file_path = RunManifest.path()
+        if not os.path.exists(file_path): return None
+        try:
+            with open(file_path) as infile:
+                data = json.load(infile)
+        except ValueError as e:
+            context().logger.warning('Ignoring unreadable full import manifest %s: %s' % (file_path, str(e)))
+            return None
+        if data.get('source') != context().args.source: return None
+
+        manifest = RunManifest(file_path, data)
+        max_age = getattr(context().args, 'resumable_full_import_max_age', 86400)
+        if max_age and time.time() - data.get('created', 0) > max_age:
+            context().logger.info('Discarding full import manifest %s older than %s sec' % (file_path, max_age))
+            manifest.remove()
+            return None
+        if data.get('args') != manifest_args():
+            context().logger.info('Discarding full import manifest %s of a run with other connector options' % file_path)
+            manifest.remove()
+            return None
+        if os.path.exists(manifest.sent_log_path):
+            with open(manifest.sent_log_path) as infile:
+                manifest.sent = set(line.rstrip('\n') for line in infile if line.endswith('\n'))
+        manifest.resumed_stages = set(data['stages'])
+        return manifest
+
+    @staticmethod
+    def create(report_time, new_model_state_id):
+        os.makedirs(context().args.export_data_dir, exist_ok=True)
+        manifest = RunManifest(RunManifest.path(), {'source': context().args.source, 'report_time': report_time,
+                                                    'new_model_state_id': new_model_state_id, 'stages': {},
+                                                    'created': time.time(), 'args': manifest_args()})
+        if os.path.exists(manifest.sent_log_path): os.remove(manifest.sent_log_path)
+        manifest.save()
+        return manifest
+
+    @property
+    def report_time(self):
+        return self.data['report_time']
+
+    @property
+    def new_model_state_id(self):
+        return self.data['new_model_state_id']
+
+    # True when all data of the stage is in the export_data files of the run being resumed
+    def is_resumed(self, stage):
+        return stage in self.resumed_stages
+
+    def add_files(self, stage, files):
+        with self.lock:
+            stage_files = self.data['stages'].setdefault(stage, [])
+            recorded = set(stage_files)
+            stage_files.extend(file_path for file_path in files if file_path not in recorded)
+            self.save()
+
+    def mark_sent(self, file_path):
+        with self.lock:
+            self.sent.add(file_path)
+            with open(self.sent_log_path, 'a') as outfile:
+                outfile.write(file_path + '\n')
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+    def unsent_files(self, stage):
+        return [file_path for file_path in self.data['stages'].get(stage, []) if file_path not in self.sent]
+
+    # Sends the files of the stage which were not acknowledged yet, in the original order
+    def send_files(self, stage, importer):
+        from car_framework.data_handler import MutationUploader
+        files = self.unsent_files(stage)
+        total = len(self.data['stages'].get(stage, []))
+        if len(files) < total:
+            context().logger.info('Resuming full import: %d of %d %s export_data files left to send', len(files), total, stage)
+        uploader = MutationUploader(importer, getattr(context().args, 'upload_workers', 1), getattr(context().args, 'upload_max_inflight_bytes', 0), on_sent=self.mark_sent)
+        uploader.send_files(files)
+
+    def save(self):
+        write_file_atomic(self.file_path, json.dumps(self.data))
+
+    # Called when the run is completed, the export_data files are kept until then
+    def remove(self):
+        if not context().args.keep_export_data_dir:
+            for dir_path in sorted(set(os.path.dirname(file_path) for stage in STAGES for file_path in self.data['stages'].get(stage, []))):
+                if os.path.exists(dir_path):
+                    context().logger.debug('Delete export_data dir: %s', dir_path)
+                    shutil.rmtree(dir_path)
+        for file_path in (self.file_path, self.sent_log_path):
+            if os.path.exists(file_path): os.remove(file_path)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+# (name, min, max) of the cron expression fields
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day of month', 1, 31), ('month', 1, 12), ('day of week', 0, 7))
+
+
+def parse_cron_field(value, name, low, high):
+    values = set()
+    for part in value.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError('Invalid %s in cron expression: %s' % (name, value))
+        values.update(range(start, end + 1, step))
+    if name == 'day of week' and 7 in values:
+        # 7 is Sunday as well
+        values.remove(7)
+        values.add(0)
+    return values
+
+
+class CronSchedule(object):
+    """
+    Standard 5 field cron expression "minute hour day-of-month month day-of-week" with *, ranges,
+    lists and steps, in local time. As in cron, when both day fields are restricted a day matching
+    either of them matches.
+    """
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError('Cron expression must have 5 fields: %s' % expression)
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = \
+            [parse_cron_field(value, *field) for value, field in zip(fields, CRON_FIELDS)]
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def day_matches(self, time):
+        # datetime.weekday() is 0 for Monday, cron uses 0 for Sunday
+        day, weekday = time.day in self.days, (time.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday: return day and weekday
+        return day or weekday
+
+    # Returns the first matching minute after `after`
+    def next_time(self, after, last_start=None):
+        time = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = time + timedelta(days=366 * 5)
+        while time < limit:
+            if time.month not in self.months:
+                time = (time.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(time):
+                time = time.replace(hour=0, minute=0) + timedelta(days=1)
+            elif time.hour not in self.hours:
+                time = time.replace(minute=0) + timedelta(hours=1)
+            elif time.minute not in self.minutes:
+                time += timedelta(minutes=1)
+            else:
+                return time
+        raise ValueError('Cron expression never matches: %s' % self.expression)
+
+
+class IntervalSchedule(object):
+    """ Runs start every `interval` seconds, a run taking longer is followed by the next one right away. """
+    def __init__(self, interval):
+        self.interval = timedelta(seconds=interval)
+
+    def next_time(self, after, last_start=None):
+        return max(after, (last_start or after) + self.interval)
+
+
+def seconds_until(time):
+    return max(0, (time - datetime.now()).total_seconds())
@@ -1,5 +1,107 @@
-from car_framework.util import DatasourceFailure
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from car_framework.context import context, set_thread_context
+from car_framework.util import DatasourceFailure, TokenBucket
+
+# seconds before the first retry of a page, doubled for every further retry
+retry_backoff = 1
+retry_max_backoff = 60
+lock = threading.Lock()
+
 
 class BaseAssetServer:
+    """
+    Datasource access of a connector. fetch_pages and fetch_into read the pages of a datasource API
+    concurrently (-datasource-workers) within -datasource-rate-limit requests per second, retrying
+    failed pages (-datasource-retries). Page functions should use `self.session`, which keeps the
+    connections to the datasource for all workers.
+    """
+    # exceptions of a page function after which the page is requested again
+    retry_exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, DatasourceFailure)
+
     def test_connection(self):
-        raise DatasourceFailure("AssetServer.test_connection not implemented")
\ No newline at end of file
+        raise DatasourceFailure("AssetServer.test_connection not implemented")
+
+    # created on first use, connectors do not need to call BaseAssetServer.__init__
+    @property
+    def session(self):
+        with lock:
+            if getattr(self, '_session', None) is None:
+                adapter = HTTPAdapter(pool_maxsize=max(10, getattr(context().args, 'datasource_workers', 4)))
+                self._session = requests.Session()
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+            return self._session
+
+    # connectors may use their own session, e.g. with authentication set up
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    @property
+    def rate_limiter(self):
+        with lock:
+            if getattr(self, '_rate_limiter', None) is None:
+                self._rate_limiter = TokenBucket(getattr(context().args, 'datasource_rate_limit', 0))
+            return self._rate_limiter
+
+    # Yields the objects returned by page_function(page) for every page in `pages`, in the order of the pages.
+    # until_empty: no more pages are requested after a page without objects, e.g. for pages=itertools.count()
+    def fetch_pages(self, page_function, pages, until_empty=False):
+        ctx = context()
+        workers = max(1, getattr(ctx.args, 'datasource_workers', 4))
+
+        def fetch(page):
+            set_thread_context(ctx)
+            return self._fetch_page(page_function, page)
+
+        pages = iter(pages)
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='datasource')
+        try:
+            last_page = False
+            while True:
+                # a few pages ahead so that the workers are busy while the objects are consumed
+                while not last_page and len(pending) < workers * 2:
+                    try: page = next(pages)
+                    except StopIteration:
+                        last_page = True
+                        break
+                    pending.append(executor.submit(fetch, page))
+                if not pending: break
+                objects = pending.popleft().result()
+                if until_empty and not objects: last_page = True
+                for obj in objects or ():
+                    yield obj
+        finally:
+            for future in pending: future.cancel()
+            executor.shutdown()
+
+    # Adds the objects of all pages to the collection of data_handler
+    def fetch_into(self, data_handler, collection, page_function, pages, until_empty=False):
+        for obj in self.fetch_pages(page_function, pages, until_empty):
+            data_handler.add_item_to_collection(collection, obj)
+
+    def _fetch_page(self, page_function, page):
+        retries = getattr(context().args, 'datasource_retries', 3)
+        metrics = context().metrics
+        for attempt in range(retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                with metrics.timer('datasource_page_duration_seconds'):
+                    objects = page_function(page)
+                metrics.inc('datasource_pages_total')
+                return objects
+            except self.retry_exceptions as e:
+                if attempt == retries: raise
+                backoff = min(retry_max_backoff, retry_backoff * 2 ** attempt) * random.uniform(0.5, 1)
+                context().logger.info('Retrying page %s of the datasource in %.1f sec: %s' % (page, backoff, str(e)))
+                metrics.inc('datasource_retries_total')
+                time.sleep(backoff)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+from car_framework.context import context
+
+# ids per query, below the default SQLite limit of host parameters
+QUERY_CHUNK_SIZE = 500
+# edge fields set by the framework in every run
+EDGE_RUN_FIELDS = ('source', 'reported_at')
+
+
+def content_hash(obj):
+    from car_framework.data_handler import json_default
+    data = json.dumps(obj, sort_keys=True, separators=(',', ':'), default=json_default)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).digest()
+
+
+def edge_hash(edge):
+    return int.from_bytes(content_hash({k: v for k, v in edge.items() if k not in EDGE_RUN_FIELDS})[:8], 'big', signed=True)
+
+
+def chunks(items, size=QUERY_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SnapshotStore():
+    """
+    Local SQLite snapshot of the data last sent to CAR, per source: content hash of every vertex by
+    collection and external_id, and a hash of the set of edges of every vertex by edge collection.
+
+    A run calls begin(), records the data read from the datasource and commit() when the import is
+    completed. Vertices not recorded by a run which reads all data are the deleted ones. Changes of
+    a run that did not commit are rolled back by the next begin().
+    """
+    def __init__(self, file_path):
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.generation = None
+        with self.lock:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS generations (source TEXT PRIMARY KEY, generation INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS vertices (source TEXT, collection TEXT, external_id TEXT, hash BLOB, generation INTEGER,
+                    PRIMARY KEY (source, collection, external_id)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS edge_sets (source TEXT, edge_collection TEXT, external_id TEXT, hash INTEGER,
+                    PRIMARY KEY (source, edge_collection, external_id)) WITHOUT ROWID;
+                CREATE TEMP TABLE IF NOT EXISTS current_edge_sets (edge_collection TEXT, external_id TEXT, hash INTEGER,
+                    PRIMARY KEY (edge_collection, external_id)) WITHOUT ROWID;
+            ''')
+
+    def close(self):
+        self.connection.close()
+
+    @property
+    def source(self):
+        return context().args.source
+
+    # Generation of the last committed run of the source, None if there is no snapshot yet
+    def last_generation(self):
+        with self.lock:
+            row = self.connection.execute('SELECT generation FROM generations WHERE source = ?', (self.source,)).fetchone()
+            return row[0] if row else None
+
+    def begin(self):
+        with self.lock:
+            self.connection.rollback()
+            self.connection.execute('DELETE FROM current_edge_sets')
+            self.generation = (self.last_generation() or 0) + 1
+
+    # Forgets the snapshot of the source, e.g. when the data of the run was not recorded
+    def reset(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM vertices WHERE source = ?', (self.source,))
+            self.connection.execute('DELETE FROM edge_sets WHERE source = ?', (self.source,))
+            self.connection.execute('DELETE FROM current_edge_sets')
+
+    # Records the vertices seen in the run, returns the new and changed ones
+    def record_vertices(self, collection, objects):
+        hashes = [(str(obj['external_id']), content_hash(obj)) for obj in objects]
+        with self.lock:
+            last = {}
+            for chunk in chunks([external_id for external_id, _ in hashes]):
+                last.update(self.connection.execute(
+                    'SELECT external_id, hash FROM vertices WHERE source = ? AND collection = ? AND external_id IN (%s)' % ','.join('?' * len(chunk)),
+                    [self.source, collection] + chunk))
+            self.connection.executemany('REPLACE INTO vertices VALUES (?, ?, ?, ?, ?)',
+                                        [(self.source, collection, external_id, value, self.generation) for external_id, value in hashes])
+        return [obj for obj, (external_id, value) in zip(objects, hashes) if last.get(external_id) != value]
+
+    # Records the edges seen in the run, for both ends of every edge
+    def record_edges(self, collection, objects):
+        rows = []
+        for edge in objects:
+            value = edge_hash(edge)
+            for field in ('_from_external_id', '_to_external_id'):
+                if edge.get(field) is not None: rows.append((collection, str(edge[field]), value))
+        with self.lock:
+            # hash of the edge set is the XOR of the hashes of its edges
+            self.connection.executemany('''
+                INSERT INTO current_edge_sets VALUES (?, ?, ?) ON CONFLICT (edge_collection, external_id)
+                DO UPDATE SET hash = (hash | excluded.hash) & ~(hash & excluded.hash)''', rows)
+
+    # Returns the ids of the vertices of the collection seen in the run whose edges in edge_collections changed
+    def changed_edge_vertices(self, collection, edge_collections):
+        ids = []
+        with self.lock:
+            for edge_collection in edge_collections:
+                ids.extend(row[0] for row in self.connection.execute('''
+                    SELECT v.external_id FROM vertices v
+                    LEFT JOIN current_edge_sets c ON c.edge_collection = ? AND c.external_id = v.external_id
+                    LEFT JOIN edge_sets s ON s.source = v.source AND s.edge_collection = ? AND s.external_id = v.external_id
+                    WHERE v.source = ? AND v.collection = ? AND v.generation = ? AND c.hash IS NOT s.hash''',
+                    (edge_collection, edge_collection, self.source, collection, self.generation)))
+        return ids
+
+    def collections(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT DISTINCT collection FROM vertices WHERE source = ?', (self.source,))]
+
+    # Returns the ids of the vertices of the collection which were not seen in the run
+    def deleted_vertices(self, collection):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT external_id FROM vertices WHERE source = ? AND collection = ? AND generation < ?',
+                                                              (self.source, collection, self.generation))]
+
+    def discard_vertices(self, collection, ids):
+        with self.lock:
+            self.connection.executemany('DELETE FROM vertices WHERE source = ? AND collection = ? AND external_id = ?',
+                                        [(self.source, collection, str(id)) for id in ids])
+
+    # complete: all data of the source was recorded in the run, vertices not recorded are removed.
+    # Otherwise (incremental import) only the vertices recorded in the run and their edge sets are updated.
+    def commit(self, complete=True):
+        with self.lock:
+            if complete:
+                self.connection.execute('DELETE FROM vertices WHERE source = ? AND generation < ?', (self.source, self.generation))
+                self.connection.execute('DELETE FROM edge_sets WHERE source = ?', (self.source,))
+                self.connection.execute('INSERT INTO edge_sets SELECT ?, edge_collection, external_id, hash FROM current_edge_sets', (self.source,))
+            else:
+                recorded = 'SELECT external_id FROM vertices WHERE source = ? AND generation = ?'
+                self.connection.execute('DELETE FROM edge_sets WHERE source = ? AND external_id IN (%s)' % recorded, (self.source, self.source, self.generation))
+                self.connection.execute('INSERT INTO edge_sets SELECT ?, edge_collection, external_id, hash FROM current_edge_sets WHERE external_id IN (%s)' % recorded,
+                                        (self.source, self.source, self.generation))
+            self.connection.execute('DELETE FROM current_edge_sets')
+            self.connection.execute('REPLACE INTO generations VALUES (?, ?)', (self.source, self.generation))
+            self.connection.commit()
+            self.generation = None
@@ -1,5 +1,8 @@
 from enum import Enum
 import json
+import os
+import threading
+import time
 from math import floor
 
 BATCH_SIZE = 20
@@ -34,6 +37,20 @@ def get_json(response):
     except: return {}
 
 
+class LogBody(object):
+    """ Request or response body in a log message, read by get_data() and truncated to max_size characters (0 for no limit) only when the message is formatted. """
+    def __init__(self, get_data, max_size):
+        self.get_data = get_data
+        self.max_size = max_size
+
+    def __str__(self):
+        data = self.get_data()
+        text = data.decode('utf-8', 'replace') if isinstance(data, bytes) else str(data)
+        if self.max_size and len(text) > self.max_size:
+            return '%s... (%d more characters)' % (text[:self.max_size], len(text) - self.max_size)
+        return text
+
+
 def get(var, path):
     fields = path.split('.')
     v = var
@@ -42,6 +59,37 @@ def get(var, path):
         if v == None: return None
     return v
 
+# Readers (node_exporter textfile collector, a resumed import) never see a partially written file
+def write_file_atomic(file_path, text):
+    tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+    with open(tmp_path, 'w') as outfile:
+        outfile.write(text)
+    os.replace(tmp_path, file_path)
+
+
+class TokenBucket(object):
+    """ Thread safe rate limiter, `rate` tokens per second with up to `capacity` tokens saved while idle, rate 0 for no limit. """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Waits for the tokens, returns the time waited
+    def acquire(self, tokens=1):
+        if not self.rate: return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # taken in advance, later callers wait for these tokens as well
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait: time.sleep(wait)
+        return wait
+
+
 class ErrorCode(Enum):
     # https://komodor.com/learn/exit-codes-in-containers-and-kubernetes-the-complete-guide/
     ## kubectl preserved
@@ -88,3 +88,17 @@ class JsonTextResponse:
         return self.text
 
 
+
+
+class MockCommunicator:
+    """
+    Summary Communicator stub, `handler(data)` gets the GraphQL request body and returns the response json
+        """
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    def post(self, path, **args):
+        data = json.loads(args['data'])
+        self.requests.append(data)
+        return MockJsonResponse(200, json.dumps(self.handler(data)))
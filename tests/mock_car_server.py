@@ -0,0 +1,179 @@
+"""
+Local in-memory stand-in for the CAR service, used by end-to-end tests and benchmarks.
+
+Supports the requests the framework sends: GraphQL /query (source queries and updates,
+insert_<collection> mutations inline or with $objects variable, async actions and their
+status queries) and /carSchema. Async jobs complete after `async_job_latency` seconds,
+every request can be delayed by `latency` seconds.
+"""
+import gzip
+import json
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PATH = '/api/car/v2'
+
+ASYNC_ACTIONS = ('prepare_full_import', 'complete_full_import', 'prepare_incremental_import', 'complete_incremental_import',
+                 'soft_delete_vertices', 'limit_edges_to_report')
+
+
+class MockCarServer(object):
+    def __init__(self, latency=0, async_job_latency=0):
+        self.latency = latency
+        self.async_job_latency = async_job_latency
+        self.lock = threading.Lock()
+        self.sources = {}
+        self.extensions = {}
+        self.jobs = {}
+        self.rows = {}
+        self.deleted = {}
+        # async action -> number of submitted jobs
+        self.actions = {}
+        self.request_count = 0
+        self.bytes_received = 0
+        # status codes returned, in order, before requests are handled normally
+        self.fail_statuses = []
+        # collection -> number of insert requests accepted before one insert of the collection fails with fail_insert_status
+        self.fail_inserts = {}
+        self.fail_insert_status = 500
+        self.inserts = {}
+        # insert requests with a larger body are rejected with 413
+        self.max_insert_bytes = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d%s' % (self.httpd.server_address[1], API_PATH)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-car-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # wire_size: size of the request body as sent, before decompression
+    def handle(self, method, path, body, wire_size):
+        with self.lock:
+            self.request_count += 1
+            self.bytes_received += wire_size
+            if self.fail_statuses:
+                return self.fail_statuses.pop(0), {}
+        if self.latency: time.sleep(self.latency)
+
+        if not path.startswith(API_PATH): return 404, {}
+        path = path[len(API_PATH):]
+        if path == '/query' and method == 'POST':
+            if self.max_insert_bytes and len(body) > self.max_insert_bytes and b'insert_' in body:
+                return 413, {'error': 'Request Entity Too Large'}
+            res = self.graphql(json.loads(body))
+            return res if isinstance(res, tuple) else (200, res)
+        if path.startswith('/carSchema'):
+            if method == 'POST':
+                extension = json.loads(body)
+                self.extensions[extension['key']] = extension
+                return 200, {}
+            extension = self.extensions.get(path.split('/')[-1])
+            return (200, extension) if extension else (404, {})
+        return 404, {}
+
+    def graphql(self, data):
+        query = data['query']
+        variables = data.get('variables') or {}
+
+        match = re.search(r'insert_(\w+)\(objects:', query)
+        if match and match.group(1) != 'source':
+            collection = match.group(1)
+            with self.lock:
+                if self.fail_inserts.get(collection) == self.inserts.get(collection, 0):
+                    del self.fail_inserts[collection]
+                    return self.fail_insert_status, {'errors': [{'message': 'Insert failure'}]}
+                self.inserts[collection] = self.inserts.get(collection, 0) + 1
+            if 'objects' in variables: count = len(variables['objects'])
+            else: count = len(re.findall(r'\}\s*,\s*\{', query.split('objects:', 1)[1])) + 1
+            with self.lock:
+                self.rows[collection] = self.rows.get(collection, 0) + count
+            return {'data': {'insert_%s' % collection: {'affected_rows': count}}}
+
+        if 'insert_source' in query:
+            source = re.search(r'id: "([^"]*)"', query).group(1)
+            self.sources[source] = {'id': source, 'properties': None}
+            return {'data': {'insert_source': {'affected_rows': 1}}}
+
+        if 'update_source' in query:
+            source = re.search(r'_eq: "([^"]*)"', query).group(1)
+            properties = re.search(r'properties: "(.*)"\}\)', query).group(1).replace('\\"', '"')
+            if source in self.sources: self.sources[source]['properties'] = properties
+            return {'data': {'update_source': {'affected_rows': 1 if source in self.sources else 0}}}
+
+        statuses = re.findall(r'(job\d+): (\w+)\(id: "([^"]*)"\)', query)
+        if statuses:
+            now = time.monotonic()
+            return {'data': {alias: {'errors': None, 'output': {'error': None} if self.jobs.get(job_id, 0) <= now else None}
+                             for alias, _, job_id in statuses}}
+
+        match = re.search(r'mutation\s*\{\s*(\w+)\(', query)
+        if match and match.group(1) in ASYNC_ACTIONS:
+            action = match.group(1)
+            with self.lock:
+                self.actions[action] = self.actions.get(action, 0) + 1
+            if action == 'soft_delete_vertices':
+                collection = re.search(r'collection: "([^"]*)"', query).group(1)
+                ids = re.findall(r'"([^"]*)"', re.search(r'ids: \[(.*)\]', query).group(1))
+                with self.lock:
+                    self.deleted[collection] = self.deleted.get(collection, 0) + len(ids)
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = time.monotonic() + self.async_job_latency
+            return {'data': {action: job_id}}
+
+        match = re.search(r'source\(where: \{id: \{_eq: "([^"]*)"\}\}\)', query)
+        if match:
+            source = self.sources.get(match.group(1))
+            return {'data': {'source': [source] if source else []}}
+
+        return {'errors': [{'message': 'Unsupported query'}]}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def _respond(self, method):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                wire_size = len(body)
+                encoding = self.headers.get('Content-Encoding')
+                if encoding == 'gzip': body = gzip.decompress(body)
+                elif encoding == 'deflate': body = zlib.decompress(body)
+                status, data = server.handle(method, self.path, body, wire_size)
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
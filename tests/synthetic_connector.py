@@ -0,0 +1,158 @@
+"""
+Connector generating synthetic assets, IP addresses and the edges between them, used with
+MockCarServer by end-to-end tests and benchmarks.
+"""
+import asyncio
+import sys
+import time
+
+from car_framework.app import BaseApp
+from car_framework.context import context
+from car_framework.data_handler import BaseDataHandler, JsonField, Mutation
+from car_framework.full_import import BaseFullImport
+from car_framework.inc_import import BaseIncrementalImport, SnapshotIncrementalImport
+
+
+def asset(i, version=0):
+    return {
+        'external_id': 'asset-%d' % i,
+        'name': 'host-%d.example.com' % i,
+        'description': 'Synthetic asset %d, version %d' % (i, version),
+        'asset_type': 'server',
+        'risk': i % 10,
+        'properties': JsonField({'os': 'linux', 'index': i, 'version': version}),
+    }
+
+
+def ipaddress(i):
+    return {'external_id': '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255), 'version': 4}
+
+
+def asset_ipaddress(i):
+    return {'_from_external_id': 'asset-%d' % i, '_to_external_id': ipaddress(i)['external_id']}
+
+
+class FullImport(BaseFullImport):
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self.data_handler = None
+
+    def get_new_model_state_id(self):
+        return str(int(time.time() * 1000))
+
+    def import_vertices(self):
+        self.data_handler = BaseDataHandler()
+        for i in range(self.size):
+            self.data_handler.add_item_to_collection('asset', asset(i))
+            self.data_handler.add_item_to_collection('ipaddress', ipaddress(i))
+            self.data_handler.add_edge('asset_ipaddress', asset_ipaddress(i))
+        self.data_handler.send_collections(self)
+
+    def import_edges(self):
+        self.data_handler.send_edges(self)
+
+
+class AsyncFullImport(FullImport):
+    """ Sends the data with the asyncio methods of the data handler. """
+    def import_vertices(self):
+        async def import_vertices():
+            self.data_handler = BaseDataHandler()
+            for i in range(self.size):
+                self.data_handler.add_item_to_collection('asset', asset(i))
+                self.data_handler.add_item_to_collection('ipaddress', ipaddress(i))
+                self.data_handler.add_edge('asset_ipaddress', asset_ipaddress(i))
+            await self.data_handler.send_collections_async(self)
+        self.run_async(import_vertices())
+
+    def import_edges(self):
+        self.run_async(self.data_handler.send_edges_async(self))
+
+
+class AsyncMutationImport(FullImport):
+    """ Sends every asset with its own mutation with BaseImport.send_mutation_async. """
+    def import_vertices(self):
+        async def send():
+            await asyncio.gather(*[self.send_mutation_async(Mutation('asset', [asset(i)])) for i in range(self.size)])
+        self.run_async(send())
+
+    def import_edges(self):
+        pass
+
+
+class IncrementalImport(BaseIncrementalImport):
+    """ Updates the first `updated` assets and deletes the last `deleted` ones. """
+    def __init__(self, size, updated, deleted):
+        super().__init__()
+        self.size = size
+        self.updated = updated
+        self.deleted = deleted
+        self.data_handler = None
+
+    def get_new_model_state_id(self):
+        return str(int(time.time() * 1000) + 1)
+
+    def get_data_for_delta(self, last_model_state_id, new_model_state_id):
+        self.data_handler = BaseDataHandler()
+        for i in range(self.updated):
+            self.data_handler.add_item_to_collection('asset', asset(i, version=1))
+            self.data_handler.add_edge('asset_ipaddress', asset_ipaddress(i))
+            self.add_updated_vertex('asset', 'asset-%d' % i)
+
+    def import_vertices(self):
+        self.data_handler.send_collections(self)
+
+    def import_edges(self):
+        self.data_handler.send_edges(self)
+
+    def delete_vertices(self):
+        context().car_service.delete_vertices('asset', ['asset-%d' % i for i in range(self.size - self.deleted, self.size)])
+
+    def get_owned_edges(self, collection):
+        return {'asset': ['asset_ipaddress']}.get(collection)
+
+
+class SnapshotImport(SnapshotIncrementalImport):
+    """ Reads all data of the source, with the first `updated` assets changed and the last `deleted` ones removed. """
+    def __init__(self, size, updated, deleted):
+        super().__init__()
+        self.size = size
+        self.updated = updated
+        self.deleted = deleted
+
+    def get_data(self):
+        for i in range(self.size - self.deleted):
+            self.data_handler.add_item_to_collection('asset', asset(i, version=1 if i < self.updated else 0))
+            self.data_handler.add_item_to_collection('ipaddress', ipaddress(i))
+            self.data_handler.add_edge('asset_ipaddress', asset_ipaddress(i))
+
+    def get_owned_edges(self, collection):
+        return {'asset': ['asset_ipaddress']}.get(collection)
+
+
+class App(BaseApp):
+    def __init__(self, size=100, updated=10, deleted=5):
+        super().__init__('Synthetic CAR connector')
+        self.size = size
+        self.updated = updated
+        self.deleted = deleted
+
+    def setup(self, argv):
+        saved_argv = sys.argv
+        sys.argv = ['synthetic_connector'] + list(argv)
+        try:
+            super().setup()
+        finally:
+            sys.argv = saved_argv
+        self.setup_context()
+
+    def setup_context(self):
+        context().full_importer = FullImport(self.size)
+        context().inc_importer = IncrementalImport(self.size, self.updated, self.deleted)
+
+
+def create_app(server_url, size=100, updated=10, deleted=5, args=()):
+    app = App(size, updated, deleted)
+    app.setup(['-car-service-url-for-token', server_url, '-car-service-token', 'token', '-source', 'synthetic-source',
+               '-name', 'synthetic'] + list(args))
+    return app
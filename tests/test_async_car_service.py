@@ -0,0 +1,115 @@
+"""Unit test cases for asyncio Car Service"""
+
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from car_framework.context import context
+from tests.common_validate import context_patch
+
+try:
+    from aiohttp import web
+    from car_framework.async_car_service import AsyncCarService
+    from car_framework.async_communicator import AsyncCommunicator, parse_retry_after
+except ImportError:
+    web = None
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class TestAsyncCarService(unittest.TestCase):
+    """asyncio Car Service Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+        self.statuses = []
+        self.queries = []
+
+    async def handle_query(self, request):
+        self.queries.append(json.loads(await request.text())['query'])
+        if self.statuses:
+            return web.json_response({}, status=self.statuses.pop(0))
+        query = self.queries[-1]
+        if 'mutation' in query:
+            return web.json_response({'data': {'prepare_full_import': 'job-1'}})
+        if 'job0' in query:
+            return web.json_response({'data': {'job0': {'errors': None, 'output': {'error': None}}}})
+        return web.json_response({'data': {'source': [{'id': 'AWS-TEST'}]}})
+
+    def run_with_server(self, test):
+        async def run():
+            app = web.Application()
+            app.router.add_post('/api/car/v2/query', self.handle_query)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            context().args.car_service_token_url = 'http://127.0.0.1:%d/api/car/v2' % port
+            service = AsyncCarService(AsyncCommunicator())
+            try:
+                await test(service)
+            finally:
+                await service.close()
+                await runner.cleanup()
+        asyncio.run(run())
+
+    def test_create_source_if_needed(self):
+        async def test(service):
+            await service.create_source_if_needed()
+        self.run_with_server(test)
+        self.assertEqual(len(self.queries), 1)
+
+    @mock.patch('car_framework.async_communicator.retry_backoff_time', return_value=0)
+    def test_retry_on_service_unavailable(self, _):
+        self.statuses = [503, 429]
+        async def test(service):
+            await service.create_source_if_needed()
+        self.run_with_server(test)
+        self.assertEqual(len(self.queries), 3)
+
+    @mock.patch('car_framework.async_communicator.retry_backoff_time', return_value=0)
+    def test_retries_exhausted(self, _):
+        self.statuses = [503] * 4
+        async def test(service):
+            with self.assertRaises(Exception):
+                await service.create_source_if_needed()
+        self.run_with_server(test)
+        self.assertEqual(len(self.queries), 4)
+
+    @mock.patch('car_framework.async_car_service.asyncio.sleep')
+    def test_async_action(self, sleep):
+        async def test(service):
+            await service.prepare_full_import('2021-01-01')
+            self.assertEqual(service.async_action_stats['prepare_full_import']['count'], 1)
+        self.run_with_server(test)
+
+    def test_connection_error_response(self):
+        async def test():
+            context().args.car_service_token_url = 'http://127.0.0.1:1/api/car/v2'
+            communicator = AsyncCommunicator()
+            with mock.patch('car_framework.async_communicator.retry_backoff_time', return_value=0):
+                r = await communicator.post('/query', data='{}')
+            await communicator.close()
+            self.assertEqual(r.status_code, 503)
+        asyncio.run(test())
+
+    def test_circuit_breaker_trial_exception(self):
+        async def test(service):
+            breaker = service.communicator.circuit_breaker
+            breaker.reset_timeout = 0
+            for _ in range(breaker.failures):
+                breaker.record(503)
+            with mock.patch.object(service.communicator, 'encode_body', side_effect=ValueError('Unexpected error')):
+                with self.assertRaises(ValueError):
+                    await service.create_source_if_needed()
+            # the trial request failed, the next one is a new trial
+            self.assertTrue(breaker.is_open())
+            await service.create_source_if_needed()
+            self.assertFalse(breaker.is_open())
+        self.run_with_server(test)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('5'), 5)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
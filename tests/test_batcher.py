@@ -0,0 +1,91 @@
+"""Unit test cases for AdaptiveBatcher"""
+
+import time
+import unittest
+from unittest import mock
+
+from car_framework.batcher import AdaptiveBatcher
+from car_framework.car_service import CarService
+from car_framework.communicator import Communicator
+from car_framework.context import context
+from car_framework.data_handler import Mutation
+from car_framework.util import UnrecoverableFailure
+from tests.common_validate import context_patch, MockJsonResponse
+
+
+class FakeCarService(object):
+    def __init__(self, max_rows=None, row_latency=0):
+        self.max_rows = max_rows
+        self.row_latency = row_latency
+        self.batches = []
+        self.sizes = []
+
+    def send_mutation_body(self, body):
+        rows = body.count('external_id')
+        if self.max_rows and rows > self.max_rows:
+            return 413, {}
+        time.sleep(self.row_latency * rows)
+        self.batches.append(rows)
+        self.sizes.append(len(body))
+        return 200, {'data': {}}
+
+
+def rows(count):
+    return [{'external_id': str(i), 'name': 'asset %d' % i} for i in range(count)]
+
+
+class TestAdaptiveBatcher(unittest.TestCase):
+    """AdaptiveBatcher Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+
+    def test_split_on_413(self):
+        context().car_service = FakeCarService(max_rows=30)
+        batcher = AdaptiveBatcher(target_bytes=10 ** 6, target_latency=5)
+        batcher.send(Mutation('asset', rows(100)))
+        self.assertEqual(sum(context().car_service.batches), 100)
+        self.assertTrue(max(context().car_service.batches) <= 30)
+        # the next page starts with the learned batch size
+        context().car_service.batches = []
+        batcher.send(Mutation('asset', rows(100)))
+        self.assertEqual(sum(context().car_service.batches), 100)
+        self.assertTrue(len(context().car_service.batches) <= 6)
+
+    def test_split_on_504_with_circuit_breaker(self):
+        # CAR times out for more than 5 rows, 6 consecutive 504 responses for the first page
+        def post(url, data=None, **kwargs):
+            if data.count('external_id') > 5: return MockJsonResponse(504, '{}')
+            return MockJsonResponse(200, '{"data": {}}')
+        communicator = Communicator()
+        communicator.http.post = mock.Mock(side_effect=post)
+        context().car_service = CarService(communicator)
+        self.assertTrue(communicator.circuit_breaker.failures < 6)
+        AdaptiveBatcher(target_bytes=10 ** 6, target_latency=5).send(Mutation('asset', rows(200)))
+        self.assertFalse(communicator.circuit_breaker.is_open())
+
+    def test_single_row_too_large(self):
+        context().car_service = FakeCarService(max_rows=-1)
+        with self.assertRaises(UnrecoverableFailure):
+            AdaptiveBatcher(target_bytes=10 ** 6, target_latency=5).send(Mutation('asset', rows(4)))
+
+    def test_target_bytes(self):
+        context().car_service = FakeCarService()
+        batcher = AdaptiveBatcher(target_bytes=2000, target_latency=5)
+        batcher.send(Mutation('asset', rows(100)))
+        batcher.send(Mutation('asset', rows(100)))
+        # the first page is sent at once, the rest in batches of up to about 2000 bytes
+        self.assertEqual(context().car_service.batches[0], 100)
+        self.assertTrue(len(context().car_service.batches) > 3)
+        self.assertTrue(max(context().car_service.sizes[1:]) <= 2200)
+
+    def test_grow_and_shrink_by_latency(self):
+        context().car_service = FakeCarService()
+        batcher = AdaptiveBatcher(target_bytes=10 ** 6, target_latency=5)
+        batcher.send(Mutation('asset', rows(10)))
+        self.assertEqual(batcher.batch_rows('asset', 1000), 15)
+
+        context().car_service = FakeCarService(row_latency=0.002)
+        batcher = AdaptiveBatcher(target_bytes=10 ** 6, target_latency=0.05)
+        batcher.send(Mutation('asset', rows(40)))
+        self.assertEqual(batcher.batch_rows('asset', 1000), 20)
@@ -1,7 +1,16 @@
 """Unit test cases for Car Service"""
 
 import os
+import re
+import tempfile
 import unittest
+from unittest import mock
+
+from car_framework import car_service
+from car_framework.car_service import CarService
+from car_framework.context import context
+from car_framework.util import RecoverableFailure
+from tests.common_validate import context_patch, MockCommunicator
 
 TEST_DIR = os.path.dirname(os.path.realpath(__file__))
 LOGGER = ""
@@ -9,9 +18,127 @@ SOURCE = 'AWS-CAR-demo'
 UPDATES_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
+def async_job_handler(polls_until_done):
+    polls = {}
+    submitted = []
+    def handler(data):
+        query = data['query']
+        if 'mutation' in query:
+            action = query.split('{')[1].split('(')[0].strip()
+            submitted.append(query)
+            return {'data': {action: 'job-%d' % len(submitted)}}
+        polls['count'] = polls.get('count', 0) + 1
+        output = {'error': None} if polls['count'] >= polls_until_done else None
+        return {'data': {alias: {'errors': None, 'output': output} for alias in re.findall(r'(job\d+): \w+\(', query)}}
+    handler.submitted = submitted
+    return handler
+
+
 class TestCarService(unittest.TestCase):
     """Car Service Unit test cases"""
 
+    def setUp(self):
+        context_patch()
+
     @staticmethod
     def test1():
         pass
+
+    def test_poll_intervals_back_off(self):
+        intervals = car_service.poll_intervals()
+        values = [next(intervals) for _ in range(30)]
+        self.assertLess(values[0], 1)
+        self.assertLess(values[0], values[5])
+        self.assertLessEqual(max(values), car_service.max_poll_interval * (1 + car_service.poll_jitter))
+
+    @mock.patch('car_framework.car_service.time.sleep')
+    def test_async_action_wait(self, sleep):
+        service = CarService(MockCommunicator(async_job_handler(3)))
+        service.prepare_full_import('2021-01-01')
+        self.assertEqual(sleep.call_count, 3)
+        self.assertEqual(service.async_action_stats['prepare_full_import']['polls'], 3)
+
+    def test_async_action_timeout(self):
+        context().args.async_job_timeout = 0.01
+        service = CarService(MockCommunicator(async_job_handler(1000)))
+        with self.assertRaises(RecoverableFailure):
+            service.complete_full_import()
+
+    @mock.patch('car_framework.car_service.time.sleep')
+    def test_delete_vertices_is_paginated(self, sleep):
+        context().args.async_action_page_bytes = 100
+        handler = async_job_handler(2)
+        communicator = MockCommunicator(handler)
+        service = CarService(communicator)
+        ids = ['asset-%04d' % i for i in range(100)]
+        service.delete_vertices('asset', ids)
+        self.assertGreater(len(handler.submitted), 5)
+        deleted = re.findall(r'asset-\d{4}', ''.join(handler.submitted))
+        self.assertEqual(sorted(deleted), ids)
+        # all jobs are polled together
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(service.async_action_stats['soft_delete_vertices']['count'], 1)
+
+    @mock.patch('car_framework.car_service.time.sleep')
+    def test_many_jobs_are_polled_in_one_poll(self, sleep):
+        context().args.async_action_page_bytes = 10
+        handler = async_job_handler(1)
+        service = CarService(MockCommunicator(handler))
+        service.delete_vertices('asset', ['asset-%04d' % i for i in range(120)])
+        self.assertGreater(len(handler.submitted), car_service.max_jobs_per_status_query * 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    @mock.patch('car_framework.car_service.time.sleep')
+    def test_delete_no_vertices(self, sleep):
+        communicator = MockCommunicator(async_job_handler(1))
+        CarService(communicator).delete_vertices('asset', [])
+        self.assertEqual(communicator.requests, [])
+
+    def test_source_metadata_cache(self):
+        def handler(data):
+            if 'update_source' in data['query']:
+                return {'data': {'update_source': {'affected_rows': 1}}}
+            return {'data': {'source': [{'id': 'AWS-TEST', 'properties': '{"model_state_id": "1"}'}]}}
+        communicator = MockCommunicator(handler)
+        service = CarService(communicator)
+        service.create_source_if_needed()
+        self.assertEqual(service.get_model_state_id(), '1')
+        # one query for both
+        self.assertEqual(len(communicator.requests), 1)
+
+        service.save_model_state_id('2')
+        self.assertEqual(service.get_model_state_id(), '2')
+        self.assertEqual(len(communicator.requests), 2)
+
+        context().args.car_metadata_cache_ttl = 0
+        service = CarService(communicator)
+        service.get_model_state_id()
+        service.get_model_state_id()
+        self.assertEqual(len(communicator.requests), 4)
+
+    def test_deleted_source_is_created_in_next_run(self):
+        context().args.car_metadata_cache_ttl = 0
+        sources = []
+        def handler(data):
+            if 'insert_source' in data['query']:
+                sources.append({'id': 'AWS-TEST'})
+                return {'data': {'insert_source': {'affected_rows': 1}}}
+            return {'data': {'source': sources}}
+        context().car_service = CarService(MockCommunicator(handler))
+        context().car_service.create_source_if_needed()
+        context().car_service.create_source_if_needed()
+        self.assertEqual(len(sources), 1)
+        # deleted in CAR before the next daemon run
+        sources.clear()
+        context().start_run()
+        context().car_service.create_source_if_needed()
+        self.assertEqual(len(sources), 1)
+
+    def test_source_metadata_cache_file(self):
+        communicator = MockCommunicator(lambda data: {'data': {'source': [{'id': 'AWS-TEST', 'properties': '{"model_state_id": "1"}'}]}})
+        with tempfile.TemporaryDirectory() as dir_path:
+            context().args.car_metadata_cache_file = os.path.join(dir_path, 'cache.json')
+            self.assertEqual(CarService(communicator).get_model_state_id(), '1')
+            # a new process reads the cache file
+            self.assertEqual(CarService(communicator).get_model_state_id(), '1')
+            self.assertEqual(len(communicator.requests), 1)
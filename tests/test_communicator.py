@@ -0,0 +1,140 @@
+"""Unit test cases for Communicator"""
+
+import gzip
+import time
+import unittest
+import zlib
+from unittest import mock
+
+from requests.exceptions import ConnectionError
+
+from car_framework.communicator import CircuitBreaker, Communicator, Throttle
+from car_framework.context import Context, context
+from car_framework.util import RecoverableFailure
+from tests.common_validate import context_patch, MockJsonResponse, Struct
+
+
+class TestCommunicator(unittest.TestCase):
+    """Communicator Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+
+    def send(self, data):
+        communicator = Communicator()
+        post = mock.Mock(return_value=MockJsonResponse(200, '{}'))
+        communicator.http.post = post
+        communicator.post('/query', data=data)
+        return post.call_args[1]
+
+    def test_uncompressed_by_default(self):
+        args = self.send('x' * 5000)
+        self.assertEqual(args['data'], 'x' * 5000)
+        self.assertNotIn('Content-Encoding', args['headers'])
+
+    def test_gzip_request_body(self):
+        context().args.car_request_compression = 'gzip'
+        args = self.send('x' * 5000)
+        self.assertEqual(gzip.decompress(args['data']), b'x' * 5000)
+        self.assertEqual(args['headers']['Content-Encoding'], 'gzip')
+
+    def test_deflate_request_body(self):
+        context().args.car_request_compression = 'deflate'
+        args = self.send('x' * 5000)
+        self.assertEqual(zlib.decompress(args['data']), b'x' * 5000)
+        self.assertEqual(args['headers']['Content-Encoding'], 'deflate')
+
+    def test_small_body_is_not_compressed(self):
+        context().args.car_request_compression = 'gzip'
+        args = self.send('{}')
+        self.assertEqual(args['data'], '{}')
+
+    def test_pool_size_follows_concurrency(self):
+        context().args.upload_workers = 32
+        adapter = Communicator().http.get_adapter('https://example.com')
+        self.assertEqual(adapter._pool_maxsize, 32)
+
+    def test_throttle_aimd(self):
+        throttle = Throttle(8)
+        throttle.acquire()
+        throttle.release(429)
+        self.assertEqual(throttle.limit, 4)
+        # within a second of the last decrease
+        throttle.acquire()
+        throttle.release(503)
+        self.assertEqual(throttle.limit, 4)
+        for _ in range(5):
+            throttle.acquire()
+            throttle.release(200)
+        self.assertEqual(int(throttle.limit), 5)
+
+    def test_retry_after(self):
+        communicator = Communicator()
+        throttled = MockJsonResponse(429, '{}')
+        throttled.headers = {'Retry-After': '0.3'}
+        post = mock.Mock(side_effect=[throttled, MockJsonResponse(200, '{}')])
+        communicator.http.post = post
+        start = time.monotonic()
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 200)
+        self.assertTrue(time.monotonic() - start >= 0.3)
+        self.assertEqual(post.call_count, 2)
+        # halved by the 429, increased by the 200
+        self.assertAlmostEqual(communicator.throttle.limit, communicator.pool_maxsize / 2 + 2 / communicator.pool_maxsize)
+
+    def test_circuit_breaker(self):
+        context().args.car_circuit_breaker_failures = 2
+        context().args.car_circuit_breaker_reset = 0.2
+        communicator = Communicator()
+        post = mock.Mock(side_effect=ConnectionError('Connection refused'))
+        communicator.http.post = post
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 503)
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 503)
+        with self.assertRaises(RecoverableFailure):
+            communicator.post('/query', data='{}')
+        self.assertEqual(post.call_count, 2)
+
+        time.sleep(0.2)
+        post.side_effect = None
+        post.return_value = MockJsonResponse(200, '{}')
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 200)
+        self.assertFalse(communicator.circuit_breaker.is_open())
+
+    def test_circuit_breaker_trial_failure(self):
+        breaker = CircuitBreaker(1, 0)
+        breaker.record(503)
+        breaker.before_request()
+        # only one request is sent while the trial request is running
+        with self.assertRaises(RecoverableFailure):
+            breaker.before_request()
+        breaker.record(502)
+        self.assertTrue(breaker.is_open())
+
+    def test_circuit_breaker_trial_exception(self):
+        context().args.car_circuit_breaker_failures = 1
+        context().args.car_circuit_breaker_reset = 0.1
+        communicator = Communicator()
+        post = mock.Mock(side_effect=ConnectionError('Connection refused'))
+        communicator.http.post = post
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 503)
+        time.sleep(0.1)
+        post.side_effect = ValueError('Unexpected error')
+        with self.assertRaises(ValueError):
+            communicator.post('/query', data='{}')
+        # the failed trial opened the circuit again, another trial is sent after reset_timeout
+        with self.assertRaises(RecoverableFailure):
+            communicator.post('/query', data='{}')
+        time.sleep(0.1)
+        post.side_effect = None
+        post.return_value = MockJsonResponse(200, '{}')
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 200)
+        self.assertFalse(communicator.circuit_breaker.is_open())
+
+    def test_args_without_newer_options(self):
+        # args of connector tests written for earlier versions
+        Context(Struct({'car_service': 'https://example.com/api/car/v2', 'api_key': None, 'api_password': 'abc-xyz',
+                        'car_service_token_url': 'abc-xyz', 'api_token': 'abc-xyz', 'source': 'AWS-TEST', 'debug': False,
+                        'connector_name': 'test-connector-name'}))
+        communicator = context().car_service.communicator
+        communicator.http.post = mock.Mock(return_value=MockJsonResponse(500, '{}'))
+        self.assertEqual(communicator.post('/query', data='{}').status_code, 500)
+        self.assertIsNone(context().snapshot_store)
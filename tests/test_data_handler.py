@@ -0,0 +1,301 @@
+"""Unit test cases for Data Handler"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from car_framework.context import context
+from car_framework.data_handler import BaseDataHandler, EdgeBuffer, estimate_size, FingerprintKeyIndex, JsonField, SqliteKeyIndex, json_default, KeyIndex, Mutation, SPILL_FORMATS, StrColumn
+from car_framework.full_import import BaseFullImport
+from car_framework.util import RecoverableFailure, UnrecoverableFailure
+from tests.common_validate import context_patch
+
+
+class RecordingImporter():
+    def __init__(self, fail_on=None, delay=0):
+        self.mutations = []
+        self.fail_on = fail_on
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def send_mutation(self, mutation):
+        time.sleep(self.delay)
+        with self.lock:
+            self.mutations.append(mutation)
+            count = len(self.mutations)
+        if count == self.fail_on:
+            raise UnrecoverableFailure('Import job failure')
+
+
+class FailingFullImport(BaseFullImport):
+    """ Collects assets with a streaming upload, then fails reading the datasource. """
+    def __init__(self):
+        super().__init__()
+        self.recorder = RecordingImporter(delay=0.02)
+
+    def init(self):
+        pass
+
+    def send_mutation(self, mutation):
+        self.recorder.send_mutation(mutation)
+
+    def import_vertices(self):
+        handler = BaseDataHandler()
+        for i in range(200):
+            handler.add_item_to_collection('asset', {'external_id': str(i)})
+        raise RecoverableFailure('Datasource error')
+
+
+class KeptHandlerFullImport(BaseFullImport):
+    """ Creates its data handler once and uses it in every run, like a connector in daemon mode. """
+    def __init__(self):
+        super().__init__()
+        self.data_handler = BaseDataHandler(self)
+        self.mutations = []
+        self.version = 'v1'
+        self.fail = False
+
+    def init(self):
+        pass
+
+    def complete(self):
+        pass
+
+    def send_mutation(self, mutation):
+        self.mutations.append(mutation)
+
+    def import_vertices(self):
+        self.data_handler.add_item_to_collection('asset', {'external_id': 'a', 'name': self.version})
+        if self.fail: raise RecoverableFailure('Datasource error')
+        self.data_handler.send_collections(self)
+
+    def import_edges(self):
+        self.data_handler.add_edge('asset_ipaddress', {'_from_external_id': 'a', '_to_external_id': self.version})
+        self.data_handler.send_edges(self)
+
+
+class TestDataHandler(unittest.TestCase):
+    """Data Handler Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+        self.export_data_dir = tempfile.TemporaryDirectory()
+        context().args.export_data_dir = self.export_data_dir.name
+        context().args.keep_export_data_dir = False
+        context().args.export_data_page_size = 2000
+
+    def tearDown(self):
+        self.export_data_dir.cleanup()
+
+    def test_key_index(self):
+        for index in (KeyIndex(), FingerprintKeyIndex()):
+            self.assertTrue(index.add('a'))
+            self.assertFalse(index.add('a'))
+            self.assertTrue(index.add('b'))
+            self.assertIn('a', index)
+            self.assertEqual(len(index), 2)
+
+    def test_sqlite_key_index(self):
+        index = SqliteKeyIndex(cache_size=2)
+        for key in ('a', 'b', 'c', 'd'):
+            self.assertTrue(index.add(key))
+        # 'a' and 'b' are no longer in the cache
+        self.assertFalse(index.add('a'))
+        self.assertFalse(index.add('d'))
+        self.assertIn('b', index)
+        self.assertNotIn('e', index)
+        self.assertEqual(len(index), 4)
+        self.assertTrue(os.path.exists(index.file_path))
+        index.close()
+        self.assertFalse(os.path.exists(index.file_path))
+        self.assertEqual(len(index), 4)
+
+    def test_duplicate_vertices_are_skipped(self):
+        for dedup_index in ('memory', 'fingerprint', 'sqlite'):
+            context().args.dedup_index = dedup_index
+            handler = BaseDataHandler()
+            for i in (1, 2, 1, 3, 2):
+                handler.add_item_to_collection('asset', {'external_id': str(i)})
+            self.assertEqual([o['external_id'] for o in handler.collections['asset']], ['1', '2', '3'])
+            self.assertEqual(len(handler.collection_keys['asset']), 3)
+
+    def test_duplicate_edges_are_skipped(self):
+        handler = BaseDataHandler()
+        handler.add_edge('asset_ipaddress', {'_from_external_id': '1', '_to_external_id': '10.0.0.1'})
+        handler.add_edge('asset_ipaddress', {'_from_external_id': '1', '_to_external_id': '10.0.0.1'})
+        handler.add_edge('asset_ipaddress', {'_from_external_id': '2', '_to_external_id': '10.0.0.1'})
+        self.assertEqual(len(handler.edges['asset_ipaddress']), 2)
+        self.assertEqual(handler.edges['asset_ipaddress'][0]['source'], context().args.source)
+
+    def test_edge_buffer(self):
+        buffer = EdgeBuffer({'source': 'src', 'reported_at': 't'})
+        buffer.append({'_from_external_id': '1', '_to_external_id': '2'})
+        buffer.append({'_from_external_id': '3', '_to_external_id': '4', 'active': True})
+        buffer.append({'_to_external_id': '6', '_from_external_id': '5'})
+        self.assertEqual(buffer.to_list(), [
+            {'_from_external_id': '1', '_to_external_id': '2', 'source': 'src', 'reported_at': 't'},
+            {'_from_external_id': '3', '_to_external_id': '4', 'active': True, 'source': 'src', 'reported_at': 't'},
+            {'_from_external_id': '5', '_to_external_id': '6', 'source': 'src', 'reported_at': 't'}])
+        self.assertEqual(buffer[1]['active'], True)
+        self.assertEqual(len(buffer[1:]), 2)
+
+    def test_edge_buffer_string_columns(self):
+        buffer = EdgeBuffer({})
+        buffer.append({'_from_external_id': 'h\u00f6st', '_to_external_id': '1'})
+        buffer.append({'_from_external_id': '\ud800', '_to_external_id': '2'})
+        self.assertIsInstance(buffer.columns[0], StrColumn)
+        self.assertEqual([e['_from_external_id'] for e in buffer], ['h\u00f6st', '\ud800'])
+        self.assertEqual(buffer[-1]['_from_external_id'], '\ud800')
+        # a column with values other than strings is a list
+        buffer.append({'_from_external_id': 'a', '_to_external_id': 3})
+        buffer.append({'_from_external_id': 'b'})
+        self.assertEqual(buffer.to_list()[1:], [{'_from_external_id': '\ud800', '_to_external_id': '2'},
+                                                {'_from_external_id': 'a', '_to_external_id': 3}, {'_from_external_id': 'b'}])
+
+    def test_handlers_do_not_share_state(self):
+        BaseDataHandler().add_item_to_collection('asset', {'external_id': '1'})
+        handler = BaseDataHandler()
+        handler.add_item_to_collection('asset', {'external_id': '1'})
+        self.assertEqual(len(handler.collections['asset']), 1)
+
+    def test_spill_formats_round_trip(self):
+        data = [{'external_id': '1', 'name': 'a "quoted" \\ name', 'count': 3, 'properties': JsonField({'a': [1, 2]})},
+                {'external_id': '2', 'name': 'b'}]
+        with tempfile.TemporaryDirectory() as dir_path:
+            for spill_format in SPILL_FORMATS.values():
+                file_path = os.path.join(dir_path, 'page' + spill_format.extension)
+                Mutation('asset', data).save(file_path)
+                mutation = Mutation.load(file_path)
+                self.assertEqual(mutation.collection_name, 'asset')
+                self.assertEqual(mutation.serialize(), Mutation('asset', data).serialize())
+
+    def test_send_concurrently(self):
+        context().args.upload_workers = 4
+        context().args.export_data_page_size = 10
+        importer = RecordingImporter()
+        handler = BaseDataHandler()
+        for i in range(95):
+            handler.add_item_to_collection('asset', {'external_id': str(i)})
+            handler.add_edge('asset_ipaddress', {'_from_external_id': str(i), '_to_external_id': '10.0.0.1'})
+        handler.send_collections(importer)
+        handler.send_edges(importer)
+        self.assertEqual(len(importer.mutations), 20)
+        self.assertEqual({m.collection_name for m in importer.mutations[:10]}, {'asset'})
+        self.assertEqual({m.collection_name for m in importer.mutations[10:]}, {'asset_ipaddress'})
+        self.assertEqual(sum(len(m.data) for m in importer.mutations[:10]), 95)
+
+    def test_memory_budget(self):
+        context().args.export_data_memory_bytes = 500000
+        context().args.export_data_page_bytes = 250000
+        importer = RecordingImporter()
+        handler = BaseDataHandler()
+        object_size = estimate_size({'external_id': '0', 'description': 'x' * 1000})
+        for i in range(200):
+            for name in ('asset', 'application', 'user', 'account'):
+                handler.add_item_to_collection(name, {'external_id': str(i), 'description': 'x' * 1000})
+            handler.add_edge('asset_ipaddress', {'_from_external_id': str(i), '_to_external_id': '10.0.0.1'})
+        self.assertLessEqual(handler.peak_buffered_bytes, 500000 + object_size)
+        handler.send_collections(importer)
+        handler.send_edges(importer)
+        self.assertEqual(sum(len(m.data) for m in importer.mutations), 1000)
+        # small edge rows are kept in one page
+        self.assertEqual([len(m.data) for m in importer.mutations if m.collection_name == 'asset_ipaddress'], [200])
+        self.assertEqual(handler.buffered_bytes, 0)
+
+    def test_send_concurrently_raises_failure(self):
+        context().args.upload_workers = 4
+        context().args.export_data_page_size = 10
+        handler = BaseDataHandler()
+        for i in range(100):
+            handler.add_item_to_collection('asset', {'external_id': str(i)})
+        with self.assertRaises(UnrecoverableFailure):
+            handler.send_collections(RecordingImporter(fail_on=3))
+
+
+    def test_serialize_as_variables(self):
+        data = [{'external_id': '1', 'name': 'a "quoted" \\ name', 'risk': 3, 'properties': JsonField({'a': [1, 2]})}]
+        request = Mutation('asset', data).serialize(use_variables=True)
+        self.assertIn('$objects: [asset_insert_input!]!', request['query'])
+        self.assertIn('insert_asset(objects: $objects)', request['query'])
+        body = json.loads(json.dumps(request, default=json_default))
+        self.assertEqual(body['variables']['objects'], [{'external_id': '1', 'name': 'a "quoted" \\ name', 'risk': 3, 'properties': {'a': [1, 2]}}])
+
+    def test_serialize_format_from_arguments(self):
+        context().args.mutation_format = 'variables'
+        self.assertIn('variables', Mutation('asset', [{'external_id': '1'}]).serialize())
+        context().args.mutation_format = 'inline'
+        self.assertIn('external_id: "1"', Mutation('asset', [{'external_id': '1'}]).serialize()['query'])
+
+    def test_streaming_upload(self):
+        context().args.streaming_upload = True
+        context().args.streaming_queue_size = 20
+        context().args.export_data_page_size = 10
+        importer = RecordingImporter()
+        handler = BaseDataHandler(importer)
+        for i in range(95):
+            handler.add_item_to_collection('asset', {'external_id': str(i)})
+            handler.add_edge('asset_ipaddress', {'_from_external_id': str(i), '_to_external_id': '10.0.0.1'})
+        handler.uploader.queue.join()
+        # full vertex pages are sent while collecting, edges wait for the vertices
+        self.assertEqual([m.collection_name for m in importer.mutations], ['asset'] * 9)
+        handler.send_collections(importer)
+        handler.send_edges(importer)
+        self.assertEqual([m.collection_name for m in importer.mutations], ['asset'] * 10 + ['asset_ipaddress'] * 10)
+        self.assertIsNone(handler.uploader)
+
+    def test_streaming_upload_spills_when_behind(self):
+        context().args.streaming_upload = True
+        context().args.streaming_queue_size = 1
+        context().args.export_data_page_size = 10
+        importer = RecordingImporter(delay=0.05)
+        context().importer = importer
+        handler = BaseDataHandler()
+        for i in range(100):
+            handler.add_item_to_collection('asset', {'external_id': str(i)})
+        self.assertTrue(os.path.exists(os.path.join(handler.export_data_dir, 'asset')))
+        handler.send_collections(importer)
+        self.assertEqual(sum(len(m.data) for m in importer.mutations), 100)
+
+    def test_streaming_upload_stopped_when_import_fails(self):
+        context().args.streaming_upload = True
+        context().args.streaming_queue_size = 20
+        context().args.export_data_page_size = 10
+        threads = set(threading.enumerate())
+        importer = FailingFullImport()
+        with self.assertRaises(RecoverableFailure):
+            importer.run()
+        self.assertEqual(set(threading.enumerate()), threads)
+        sent = len(importer.recorder.mutations)
+        self.assertLess(sent, 20)
+        time.sleep(0.1)
+        self.assertEqual(len(importer.recorder.mutations), sent)
+        self.assertEqual(importer.data_handlers, [])
+
+    def test_data_handler_of_importer_is_reset_between_runs(self):
+        importer = KeptHandlerFullImport()
+        importer.run()
+        self.assertEqual([m.data for m in importer.mutations if m.collection_name == 'asset'], [[{'external_id': 'a', 'name': 'v1'}]])
+
+        importer.version = 'v2'
+        importer.fail = True
+        with self.assertRaises(RecoverableFailure):
+            importer.run()
+        importer.fail = False
+        importer.mutations = []
+        importer.run()
+        self.assertEqual([m.data for m in importer.mutations if m.collection_name == 'asset'], [[{'external_id': 'a', 'name': 'v2'}]])
+        edges = [m.data for m in importer.mutations if m.collection_name == 'asset_ipaddress']
+        self.assertEqual([[e['_to_external_id'] for e in data] for data in edges], [['v2']])
+        self.assertEqual(importer.data_handler.collections, {})
+
+    def test_streaming_upload_failure(self):
+        context().args.streaming_upload = True
+        context().args.export_data_page_size = 10
+        handler = BaseDataHandler(RecordingImporter(fail_on=1))
+        with self.assertRaises(UnrecoverableFailure):
+            for i in range(100):
+                handler.add_item_to_collection('asset', {'external_id': str(i)})
+            handler.send_collections(handler.importer)
@@ -0,0 +1,221 @@
+"""End-to-end import test cases against the mock CAR server"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+from car_framework.context import context
+from car_framework.util import IncrementalImportNotPossible, RecoverableFailure, UnrecoverableFailure
+from tests.mock_car_server import MockCarServer
+from tests.synthetic_connector import AsyncFullImport, AsyncMutationImport, create_app
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class TestImportEndToEnd(unittest.TestCase):
+    """End-to-end import test cases"""
+
+    def setUp(self):
+        self.server = MockCarServer().start()
+        self.export_data_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        self.export_data_dir.cleanup()
+
+    def run_imports(self, *args):
+        create_app(self.server.url, size=250, updated=20, deleted=5,
+                   args=['-export-data-dir', self.export_data_dir.name, '-export-data-page-size', '50'] + list(args))
+        with self.assertRaises(IncrementalImportNotPossible):
+            context().inc_importer.run()
+        context().full_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 250, 'ipaddress': 250, 'asset_ipaddress': 250})
+        self.assertTrue(context().car_service.get_model_state_id())
+
+        context().inc_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 270, 'ipaddress': 250, 'asset_ipaddress': 270})
+        self.assertEqual(self.server.deleted, {'asset': 5})
+
+        summary = context().metrics.summary()
+        requests = sum(c['value'] for c in summary['counters'] if c['name'] == 'car_requests_total')
+        self.assertEqual(requests, self.server.request_count)
+        phases = {(h.get('run'), h['phase']) for h in summary['histograms'] if h['name'] == 'phase_duration_seconds'}
+        self.assertIn(('full', 'import_vertices'), phases)
+        self.assertIn(('incremental', 'delete_vertices'), phases)
+
+    def test_default_options(self):
+        self.run_imports()
+
+    def test_performance_options(self):
+        self.run_imports('-upload-workers', '4', '-streaming-upload', '-mutation-format', 'variables',
+                         '-car-request-compression', 'gzip', '-export-data-format', 'ndjson.gz', '-dedup-index', 'fingerprint')
+
+    def test_sqlite_dedup_index(self):
+        self.run_imports('-dedup-index', 'sqlite', '-dedup-index-cache-size', '10')
+        self.assertFalse([name for name in os.listdir(self.export_data_dir.name) if name.endswith('.sqlite')])
+
+    def test_adaptive_batching(self):
+        self.server.max_insert_bytes = 8000
+        self.run_imports('-adaptive-batching', '-batch-target-bytes', '6000')
+        # only the first page of a collection is split, later batches stay under the target size
+        splits = [c for c in context().metrics.summary()['counters'] if c['name'] == 'batch_splits_total']
+        self.assertTrue(all(c['value'] == 1 for c in splits))
+
+    def run_async_full_import(self, *args):
+        create_app(self.server.url, size=250, args=['-export-data-dir', self.export_data_dir.name, '-export-data-page-size', '50'] + list(args))
+        context().full_importer = AsyncFullImport(250)
+        context().full_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 250, 'ipaddress': 250, 'asset_ipaddress': 250})
+        self.assertTrue(context().car_service.get_model_state_id())
+        self.assertEqual(context().metrics.gauges[('vertices_total', (('collection', 'asset'),))], 250)
+        self.assertEqual(context().metrics.gauges[('edges_total', (('collection', 'asset_ipaddress'),))], 250)
+        phases = {h['phase'] for h in context().metrics.summary()['histograms'] if h['name'] == 'phase_duration_seconds'}
+        self.assertTrue({'send_collections', 'send_edges'} <= phases)
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_full_import(self):
+        self.run_async_full_import()
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_full_import_performance_options(self):
+        self.run_async_full_import('-upload-workers', '4', '-streaming-upload', '-mutation-format', 'variables', '-car-request-compression', 'gzip')
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_send_mutation_async(self):
+        create_app(self.server.url, size=50, args=['-export-data-dir', self.export_data_dir.name])
+        context().full_importer = AsyncMutationImport(50)
+        context().full_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 50})
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_request_timeout(self):
+        create_app(self.server.url, args=['-car-request-timeout', '0.1'])
+        self.server.latency = 0.5
+        communicator = context().async_car_service.communicator
+        response = context().full_importer.run_async(communicator.post('/query', data='{}'))
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(self.server.request_count, 1)
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_session_of_earlier_event_loop_is_closed(self):
+        create_app(self.server.url)
+        communicator = context().async_car_service.communicator
+        session = asyncio.run(communicator.get_session())
+        self.assertIsNot(asyncio.run(communicator.get_session()), session)
+        self.assertTrue(session.closed)
+        asyncio.run(communicator.close())
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_streaming_upload_failure(self):
+        self.server.fail_inserts = {'asset': 9}
+        create_app(self.server.url, size=200, args=['-export-data-dir', self.export_data_dir.name, '-export-data-page-size', '20', '-streaming-upload', '-streaming-queue-size', '20'])
+        context().full_importer = AsyncFullImport(200)
+        threads = set(threading.enumerate())
+        with self.assertRaises(RecoverableFailure):
+            context().full_importer.run()
+        self.assertFalse([thread for thread in set(threading.enumerate()) - threads if thread.name.startswith('car-stream-upload')])
+        self.assertFalse(context().car_service.get_model_state_id())
+
+    def test_resumable_full_import(self):
+        args = ['-export-data-dir', self.export_data_dir.name, '-export-data-page-size', '50', '-resumable-full-import']
+        self.server.fail_inserts = {'asset_ipaddress': 2}
+        create_app(self.server.url, size=250, args=args)
+        with self.assertRaises(RecoverableFailure):
+            context().full_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 250, 'ipaddress': 250, 'asset_ipaddress': 100})
+        report_time = context().report_time
+
+        create_app(self.server.url, size=250, args=args)
+        context().full_importer.import_vertices = None
+        context().full_importer.run()
+        self.assertEqual(context().report_time, report_time)
+        self.assertEqual(self.server.rows, {'asset': 250, 'ipaddress': 250, 'asset_ipaddress': 250})
+        self.assertTrue(context().car_service.get_model_state_id())
+        # manifest and export_data files are removed once the import is completed
+        self.assertEqual([files for _, _, files in os.walk(self.export_data_dir.name) if files], [])
+
+    def test_manifest_not_resumed(self):
+        args = ['-export-data-dir', self.export_data_dir.name, '-export-data-page-size', '50', '-resumable-full-import']
+        for next_args in (['-version', '2.0'], ['-resumable-full-import-max-age', '0.001']):
+            self.server.inserts = {}
+            self.server.fail_inserts = {'asset_ipaddress': 2}
+            create_app(self.server.url, size=250, args=args)
+            with self.assertRaises(RecoverableFailure):
+                context().full_importer.run()
+            report_time = context().report_time
+
+            # other connector version or a stale manifest, a new full import
+            create_app(self.server.url, size=250, args=args + next_args)
+            context().full_importer.run()
+            self.assertNotEqual(context().report_time, report_time)
+            self.assertEqual([files for _, _, files in os.walk(self.export_data_dir.name) if files], [])
+        self.assertEqual(self.server.actions['prepare_full_import'], 4)
+
+    def test_unrecoverable_failure_discards_manifest(self):
+        args = ['-export-data-dir', self.export_data_dir.name, '-export-data-page-size', '50', '-resumable-full-import']
+        self.server.fail_inserts = {'asset_ipaddress': 2}
+        self.server.fail_insert_status = 422
+        create_app(self.server.url, size=250, args=args)
+        with self.assertRaises(UnrecoverableFailure):
+            context().full_importer.run()
+        self.assertEqual([files for _, _, files in os.walk(self.export_data_dir.name) if files], [])
+        report_time = context().report_time
+
+        # the next run is a new full import, all data is read and sent again
+        create_app(self.server.url, size=250, args=args)
+        context().full_importer.run()
+        self.assertNotEqual(context().report_time, report_time)
+        self.assertEqual(self.server.actions['prepare_full_import'], 2)
+        self.assertEqual(self.server.rows, {'asset': 500, 'ipaddress': 500, 'asset_ipaddress': 350})
+
+    def test_daemon(self):
+        app = create_app(self.server.url, size=250, updated=20, deleted=5,
+                         args=['-export-data-dir', self.export_data_dir.name, '-daemon', '-interval', '0'])
+        communicator = context().car_service.communicator
+        app.run_daemon(max_runs=3)
+        self.assertEqual(self.server.actions['prepare_full_import'], 1)
+        self.assertEqual(self.server.actions['prepare_incremental_import'], 2)
+        self.assertEqual(self.server.rows['asset'], 290)
+        self.assertIs(context().car_service.communicator, communicator)
+        self.assertEqual(context().car_service.sources_created, {'synthetic-source'})
+        self.assertEqual(context().metrics.gauges[('run_exit_code', ())], 0)
+
+    def run_sources(self, args=()):
+        sources_file = os.path.join(self.export_data_dir.name, 'sources.json')
+        with open(sources_file, 'w') as outfile:
+            json.dump([{'source': 'source-%d' % i} for i in range(3)], outfile)
+        app = create_app(self.server.url, size=100, args=['-export-data-dir', self.export_data_dir.name, '-sources-file', sources_file,
+                                                         '-source-parallelism', '2', '-metrics-json-file', os.path.join(self.export_data_dir.name, 'metrics.json')] + list(args))
+        handlers = len(logging.getLogger().handlers)
+        self.assertEqual(app.run_once(), 0)
+        self.assertEqual(len(logging.getLogger().handlers), handlers)
+        self.assertEqual(self.server.rows, {'asset': 300, 'ipaddress': 300, 'asset_ipaddress': 300})
+        # rows sent from upload threads are counted by the context of their source
+        for source_context in app.source_contexts:
+            with open(os.path.join(self.export_data_dir.name, 'metrics_%s.json' % source_context.args.source)) as infile:
+                counters = json.load(infile)['counters']
+            for collection in ('asset', 'asset_ipaddress'):
+                self.assertEqual(sum(c['value'] for c in counters if c['name'] == 'mutation_rows_total' and c['collection'] == collection), 100)
+        return app
+
+    def test_multiple_sources(self):
+        app = self.run_sources()
+        self.assertEqual(sorted(s for s, props in self.server.sources.items() if props['properties']), ['source-0', 'source-1', 'source-2'])
+
+        communicator = context().car_service.communicator
+        for source_context in app.source_contexts:
+            self.assertIs(source_context.car_service.communicator, communicator)
+            self.assertIsNot(source_context.full_importer, context().full_importer)
+
+    def test_multiple_sources_upload_workers(self):
+        self.run_sources(['-upload-workers', '2', '-export-data-page-size', '20'])
+
+    def test_multiple_sources_streaming_upload(self):
+        self.run_sources(['-streaming-upload', '-upload-workers', '2', '-export-data-page-size', '20'])
@@ -0,0 +1,43 @@
+"""Unit test cases for Incremental Import"""
+
+import re
+import unittest
+from unittest import mock
+
+from car_framework.car_service import CarService
+from car_framework.context import context
+from car_framework.inc_import import BaseIncrementalImport
+from tests.common_validate import context_patch, MockCommunicator
+from tests.test_car_service import async_job_handler
+
+
+class IncrementalImport(BaseIncrementalImport):
+    def get_owned_edges(self, collection):
+        return {'asset': ['asset_ipaddress'], 'host': ['host_ipaddress'], 'ipaddress': []}.get(collection)
+
+
+class TestIncrementalImport(unittest.TestCase):
+    """Incremental Import Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+
+    def test_updated_vertices_are_deduplicated(self):
+        importer = IncrementalImport()
+        for id in ('1', '2', '1', '3', '2'):
+            importer.add_updated_vertex('asset', id)
+        self.assertEqual(list(importer.updated_vertices['asset']), ['1', '2', '3'])
+
+    @mock.patch('car_framework.car_service.time.sleep')
+    def test_limit_edges_in_one_polling_loop(self, sleep):
+        handler = async_job_handler(1)
+        context().car_service = CarService(MockCommunicator(handler))
+        importer = IncrementalImport()
+        for i in range(10):
+            importer.add_updated_vertex('asset', 'asset-%d' % i)
+            importer.add_updated_vertex('host', 'host-%d' % i)
+            importer.add_updated_vertex('ipaddress', '10.0.0.%d' % i)
+        importer.limit_edges_of_updated_vertices_to_current_report()
+        self.assertEqual(len(handler.submitted), 2)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(len(re.findall(r'asset-\d', handler.submitted[0] + handler.submitted[1])), 10)
@@ -0,0 +1,70 @@
+"""Unit test cases for logging"""
+
+import io
+import json
+import logging
+import queue
+import threading
+import unittest
+from logging.handlers import QueueListener
+from unittest import mock
+
+from car_framework.communicator import Communicator
+from car_framework.context import context, set_thread_context, ContextQueueHandler, CustomJsonFormatter
+from car_framework.util import LogBody
+from tests.common_validate import context_patch, MockJsonResponse
+
+
+class TestLogging(unittest.TestCase):
+    """Logging Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+
+    def test_log_body_truncated(self):
+        self.assertEqual(str(LogBody(lambda: 'x' * 10, 4)), 'xxxx... (6 more characters)')
+        self.assertEqual(str(LogBody(lambda: b'abc', 0)), 'abc')
+
+    def test_response_body_not_read_without_debug(self):
+        context().logger.setLevel(logging.INFO)
+        communicator = Communicator()
+        response = MockJsonResponse(200, '{}')
+        response.json = mock.Mock(return_value={})
+        communicator.http.post = mock.Mock(return_value=response)
+        communicator.post('/query', data='{}')
+        response.json.assert_not_called()
+
+    def test_queue_handler_keeps_context_fields(self):
+        stream = io.StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(CustomJsonFormatter('%(ibm_datetime)s %(level)s %(label)s %(message)s'))
+        handler = ContextQueueHandler(queue.SimpleQueue())
+        listener = QueueListener(handler.queue, stream_handler)
+        logger = logging.getLogger('test_queue_handler')
+        logger.propagate = False
+        logger.addHandler(handler)
+        listener.start()
+
+        source_context = mock.Mock(args=mock.Mock(connector_name='conn', source='source-2', version='1.0'), _log_fields=None)
+        def log():
+            set_thread_context(source_context)
+            logger.warning('message %d', 1)
+        thread = threading.Thread(target=log)
+        thread.start()
+        thread.join()
+        listener.stop()
+        logger.removeHandler(handler)
+
+        record = json.loads(stream.getvalue())
+        self.assertEqual(record['message'], 'message 1')
+        self.assertEqual((record['source'], record['connector'], record['version']), ('source-2', 'conn', '1.0'))
+        self.assertTrue(record['ibm_datetime'].endswith('Z'))
+
+    def test_queue_handler_formats_other_messages_when_logged(self):
+        handler = ContextQueueHandler(queue.SimpleQueue())
+        collections = {'asset': [1]}
+        record = handler.prepare(logging.LogRecord('test', logging.DEBUG, __file__, 1, collections, (), None))
+        collections['ipaddress'] = [2]
+        self.assertEqual(record.msg, "{'asset': [1]}")
+        record = handler.prepare(logging.LogRecord('test', logging.DEBUG, __file__, 1, 'message %s', ('a',), None))
+        self.assertEqual((record.msg, record.args), ('message %s', ('a',)))
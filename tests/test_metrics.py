@@ -0,0 +1,47 @@
+"""Unit test cases for Metrics"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from car_framework.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Metrics Unit test cases"""
+
+    def test_counters_and_histograms(self):
+        metrics = Metrics()
+        metrics.inc('car_requests_total', method='POST', status='200')
+        metrics.inc('car_requests_total', method='POST', status='200')
+        metrics.observe('car_request_duration_seconds', 0.02, method='POST')
+        metrics.observe('car_request_duration_seconds', 3, method='POST')
+        with metrics.phase('import_vertices', run='full'):
+            pass
+        summary = metrics.summary()
+        self.assertEqual(summary['counters'], [{'name': 'car_requests_total', 'method': 'POST', 'status': '200', 'value': 2}])
+        durations = [h for h in summary['histograms'] if h['name'] == 'car_request_duration_seconds'][0]
+        self.assertEqual((durations['count'], durations['min'], durations['max']), (2, 0.02, 3))
+        self.assertEqual([h['phase'] for h in summary['histograms'] if h['name'] == 'phase_duration_seconds'], ['import_vertices'])
+        json.dumps(summary)
+
+    def test_prometheus_text(self):
+        metrics = Metrics()
+        metrics.inc('spill_files_total', collection='asset')
+        metrics.set('vertices_total', 10, collection='asset')
+        metrics.observe('spill_write_seconds', 0.2)
+        text = metrics.prometheus_text({'source': 'src'})
+        self.assertIn('# TYPE car_connector_spill_files_total counter', text)
+        self.assertIn('car_connector_spill_files_total{source="src",collection="asset"} 1', text)
+        self.assertIn('car_connector_vertices_total{source="src",collection="asset"} 10', text)
+        self.assertIn('car_connector_spill_write_seconds_bucket{source="src",le="0.25"} 1', text)
+        self.assertIn('car_connector_spill_write_seconds_bucket{source="src",le="0.1"} 0', text)
+        self.assertIn('car_connector_spill_write_seconds_count{source="src"} 1', text)
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            file_path = os.path.join(dir_path, 'car.prom')
+            metrics.write_prometheus(file_path, {'source': 'src'})
+            with open(file_path) as f:
+                self.assertEqual(f.read(), text)
+            self.assertEqual(os.listdir(dir_path), ['car.prom'])
@@ -0,0 +1,35 @@
+"""Unit test cases for daemon mode schedules"""
+
+import unittest
+from datetime import datetime
+
+from car_framework.schedule import CronSchedule, IntervalSchedule
+
+
+class TestSchedule(unittest.TestCase):
+    """Schedule Unit test cases"""
+
+    def test_cron_next_time(self):
+        now = datetime(2022, 3, 15, 10, 7, 30)
+        self.assertEqual(CronSchedule('* * * * *').next_time(now), datetime(2022, 3, 15, 10, 8))
+        self.assertEqual(CronSchedule('*/15 * * * *').next_time(now), datetime(2022, 3, 15, 10, 15))
+        self.assertEqual(CronSchedule('5 2 * * *').next_time(now), datetime(2022, 3, 16, 2, 5))
+        self.assertEqual(CronSchedule('0 9-17/4 * * 1-5').next_time(now), datetime(2022, 3, 15, 13, 0))
+        # 2022-03-20 is Sunday
+        self.assertEqual(CronSchedule('30 0 * * 7').next_time(now), datetime(2022, 3, 20, 0, 30))
+        self.assertEqual(CronSchedule('0 0 1 1,7 *').next_time(now), datetime(2022, 7, 1))
+        # either day field matches when both are restricted
+        self.assertEqual(CronSchedule('0 0 31 * 3').next_time(now), datetime(2022, 3, 16))
+        self.assertEqual(CronSchedule('0 0 29 2 *').next_time(now), datetime(2024, 2, 29))
+
+    def test_invalid_cron(self):
+        for expression in ('* * * *', '60 * * * *', '* * 0 * *', '*/0 * * * *', 'a * * * *'):
+            with self.assertRaises(ValueError):
+                CronSchedule(expression)
+
+    def test_interval(self):
+        schedule = IntervalSchedule(60)
+        start = datetime(2022, 3, 15, 10, 0, 0)
+        self.assertEqual(schedule.next_time(datetime(2022, 3, 15, 10, 0, 20), start), datetime(2022, 3, 15, 10, 1, 0))
+        # the run took longer than the interval
+        self.assertEqual(schedule.next_time(datetime(2022, 3, 15, 10, 1, 30), start), datetime(2022, 3, 15, 10, 1, 30))
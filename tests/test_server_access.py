@@ -0,0 +1,99 @@
+"""Unit test cases for BaseAssetServer"""
+
+import itertools
+import threading
+import time
+import unittest
+
+import requests
+
+from car_framework import server_access
+from car_framework.context import context
+from car_framework.data_handler import BaseDataHandler
+from car_framework.server_access import BaseAssetServer
+from car_framework.util import DatasourceFailure, TokenBucket
+from tests.common_validate import context_patch
+
+
+class AssetServer(BaseAssetServer):
+    def __init__(self, size=95, page_size=10, failures=0, delay=0):
+        self.size = size
+        self.page_size = page_size
+        self.failures = failures
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.requested = []
+
+    def get_assets(self, page):
+        with self.lock:
+            self.requested.append(page)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            fail = self.failures > 0
+            if fail: self.failures -= 1
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if fail: raise DatasourceFailure('Datasource unavailable')
+        start = page * self.page_size
+        return [{'external_id': str(i)} for i in range(start, min(self.size, start + self.page_size))]
+
+
+class TestBaseAssetServer(unittest.TestCase):
+    """BaseAssetServer Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+        server_access.retry_backoff = 0.01
+
+    def test_pages_are_fetched_concurrently_in_order(self):
+        server = AssetServer(delay=0.05)
+        objects = list(server.fetch_pages(server.get_assets, range(10)))
+        self.assertEqual([o['external_id'] for o in objects], [str(i) for i in range(95)])
+        self.assertEqual(server.max_running, 4)
+
+    def test_until_empty(self):
+        server = AssetServer()
+        objects = list(server.fetch_pages(server.get_assets, itertools.count(), until_empty=True))
+        self.assertEqual(len(objects), 95)
+        self.assertTrue(max(server.requested) < 10 + 8)
+
+    def test_retry(self):
+        server = AssetServer(failures=2)
+        self.assertEqual(len(list(server.fetch_pages(server.get_assets, range(10)))), 95)
+        context().args.datasource_retries = 1
+        server = AssetServer(failures=2)
+        context().args.datasource_workers = 1
+        with self.assertRaises(DatasourceFailure):
+            list(server.fetch_pages(server.get_assets, range(10)))
+
+    def test_fetch_into(self):
+        context().args.export_data_dir = '/tmp/car_temp_export_data_test'
+        context().args.export_data_page_size = 2000
+        server = AssetServer()
+        handler = BaseDataHandler()
+        server.fetch_into(handler, 'asset', server.get_assets, range(10))
+        self.assertEqual(len(handler.collection_keys['asset']), 95)
+
+    def test_session(self):
+        server = AssetServer()
+        self.assertIs(server.session, server.session)
+        # connectors setting up their own session
+        session = requests.Session()
+        server.session = session
+        self.assertIs(server.session, session)
+
+    def test_rate_limit(self):
+        context().args.datasource_rate_limit = 10
+        server = AssetServer()
+        start = time.monotonic()
+        list(server.fetch_pages(server.get_assets, range(15)))
+        # the first 10 requests are allowed right away
+        self.assertTrue(time.monotonic() - start >= 0.4)
+        bucket = TokenBucket(100, capacity=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertTrue(time.monotonic() - start >= 0.09)
@@ -0,0 +1,115 @@
+"""Unit test cases for SnapshotStore and SnapshotIncrementalImport"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from car_framework.context import context
+from car_framework.snapshot import SnapshotStore
+from car_framework.util import IncrementalImportNotPossible
+from tests.common_validate import context_patch
+from tests.mock_car_server import MockCarServer
+from tests.synthetic_connector import SnapshotImport, create_app
+
+
+def vertices(*ids, version=0):
+    return [{'external_id': id, 'name': 'host-%s' % id, 'version': version} for id in ids]
+
+
+def edge(from_id, to_id):
+    return {'_from_external_id': from_id, '_to_external_id': to_id, 'source': 'AWS-TEST', 'reported_at': '2022-01-01'}
+
+
+class TestSnapshotStore(unittest.TestCase):
+    """SnapshotStore Unit test cases"""
+
+    def setUp(self):
+        context_patch()
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = SnapshotStore(os.path.join(self.dir.name, 'snapshot.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def test_changes(self):
+        self.assertIsNone(self.store.last_generation())
+        self.store.begin()
+        self.assertEqual(len(self.store.record_vertices('asset', vertices('1', '2', '3'))), 3)
+        self.store.record_edges('asset_ip', [edge('1', 'a'), edge('2', 'b')])
+        self.store.commit()
+        self.assertEqual(self.store.last_generation(), 1)
+
+        self.store.begin()
+        changed = self.store.record_vertices('asset', vertices('1', '3') + vertices('2', version=1) + vertices('4'))
+        self.assertEqual([v['external_id'] for v in changed], ['2', '4'])
+        # reported_at of the edges changes every run
+        self.store.record_edges('asset_ip', [dict(edge('1', 'a'), reported_at='2022-01-02'), edge('3', 'c')])
+        self.assertEqual(self.store.deleted_vertices('asset'), [])
+        self.assertEqual(sorted(self.store.changed_edge_vertices('asset', ['asset_ip'])), ['2', '3'])
+        self.store.commit()
+
+        self.store.begin()
+        self.store.record_vertices('asset', vertices('1'))
+        self.assertEqual(sorted(self.store.deleted_vertices('asset')), ['2', '3', '4'])
+
+    def test_uncommitted_run_is_rolled_back(self):
+        self.store.begin()
+        self.store.record_vertices('asset', vertices('1'))
+        self.store.commit()
+        self.store.begin()
+        self.store.record_vertices('asset', vertices('1', version=1))
+        self.store.begin()
+        self.assertEqual(len(self.store.record_vertices('asset', vertices('1', version=1))), 1)
+
+
+class TestSnapshotIncrementalImport(unittest.TestCase):
+    """SnapshotIncrementalImport end-to-end test cases"""
+
+    def setUp(self):
+        self.server = MockCarServer().start()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        context().snapshot_store.close()
+        self.dir.cleanup()
+
+    def test_snapshot_incremental_import(self):
+        create_app(self.server.url, size=250, args=['-export-data-dir', self.dir.name, '-export-data-page-size', '50',
+                                                    '-snapshot-db', os.path.join(self.dir.name, 'snapshot.db')])
+        context().inc_importer = SnapshotImport(250, updated=20, deleted=5)
+        with self.assertRaises(IncrementalImportNotPossible):
+            context().inc_importer.run()
+        context().full_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 250, 'ipaddress': 250, 'asset_ipaddress': 250})
+
+        context().inc_importer.run()
+        self.assertEqual(self.server.rows, {'asset': 270, 'ipaddress': 250, 'asset_ipaddress': 495})
+        self.assertEqual(self.server.deleted, {'asset': 5, 'ipaddress': 5})
+        self.assertEqual(list(context().inc_importer.updated_vertices), ['asset'])
+        self.assertEqual(len(context().inc_importer.updated_vertices['asset']), 20)
+
+        # nothing changed
+        context().inc_importer.run()
+        self.assertEqual(self.server.rows['asset'], 270)
+        self.assertEqual(self.server.deleted, {'asset': 5, 'ipaddress': 5})
+
+    def test_skip_unchanged(self):
+        create_app(self.server.url, size=250, updated=20, deleted=0,
+                   args=['-export-data-dir', self.dir.name, '-snapshot-db', os.path.join(self.dir.name, 'snapshot.db'), '-skip-unchanged'])
+        with self.assertRaises(IncrementalImportNotPossible):
+            context().inc_importer.run()
+        context().full_importer.run()
+        context().inc_importer.run()
+        self.assertEqual(self.server.rows['asset'], 270)
+        self.assertEqual(self.server.actions['limit_edges_to_report'], 1)
+
+        # the same objects again: nothing to send and no edges to limit
+        time.sleep(0.01)
+        context().inc_importer.run()
+        self.assertEqual(self.server.rows['asset'], 270)
+        self.assertEqual(self.server.rows['asset_ipaddress'], 290)
+        self.assertEqual(self.server.actions['limit_edges_to_report'], 1)
+        self.assertEqual(len(context().inc_importer.unchanged_vertices['asset']), 20)